@@ -1,70 +1,82 @@
+import lzma
 import os
-from os.path import basename, join, relpath
-import tarfile
-import zipfile
+from os.path import join
+from shutil import copyfileobj, which
+import subprocess
+import sys
+import threading
 
 import paths
 
 
-__all__ = ('archive',)
+__all__ = ('git_archive',)
 
 
-_EXCLUDE_DIRS = ('CVS', '.svn', '.git')
+# Not preexec_fn: this process runs threads (trash.py), it is unsafe then
+_NICE = which('nice')
 
 
-def zip(root, path, base=None, comment=None, format=zipfile.ZIP_DEFLATED):
-    if base is None:
-        base = basename(path)
-    with zipfile.ZipFile(path+'.zip', 'w', compression=format) as zf:
-        if comment is not None:
-            zf.comment = bytes(comment)
-        for dirname, subdirs, files in os.walk(root):
-            for exc in _EXCLUDE_DIRS:
-                if exc in subdirs:
-                    subdirs.remove(exc)
-            root_rel = join(base, relpath(dirname, root))
-            zf.write(dirname, root_rel)
-            for filename in files:
-                zf.write(join(dirname, filename), join(root_rel, filename))
-
+def _base_name(changeset, version, master, full=True):
+    if not full:
+        version += '_sep'
+    return changeset + '_' + version + '-' + master
 
-def tar(root, path, base=None, comment=None, format='xz'):
-    if base is None:
-        base = basename(path)
-    if format is None:
-        path = path + '.tar'
-        format = 'w'
-    else:
-        path = path + '.tar.' + format
-        format = 'w:' + format
-    with tarfile.open(path, format) as tf:
-        tf.add(root, arcname=base, filter=lambda x:
-            None if basename(x.name) in _EXCLUDE_DIRS else x)
 
+def git_archive(dst, commit, changeset, version, master, full=True,
+        threads=0):
+    """Start writing dst/src.tar.xz for commit in the background.
 
-def _archive(root, path, base=None, comment=None, format='xz'):
-    if format == 'zip':
-        zip(root, path, base, comment)
+    git archive reads the repository, not the worktree, so it is safe to build
+    at the same time. Returns a function that waits for it to end and tells
+    whether it went well.
+    """
+    path = join(dst, 'src.tar.xz')
+    tmp = path + '.tmp'
+    base = _base_name(changeset, version, master, full)
+    git = subprocess.Popen(['git', 'archive', '--format=tar',
+            '--prefix=' + base + '/', commit],
+        cwd=paths.worktree(), stdout=subprocess.PIPE)
+    xz = which('xz')
+    if xz:
+        command = [xz, '-T' + str(threads), '-c']
+        if _NICE:
+            command = [_NICE, '-n', '10'] + command
+        with open(tmp, 'wb') as out:
+            compressor = subprocess.Popen(command, stdin=git.stdout,
+                stdout=out)
+        git.stdout.close()
+        compressed = compressor.wait
     else:
-        if format in ('', 'tar'):
-            format = None
-        elif format == 'gzip':
-            format = 'gz'
-        elif format == 'bzip2':
-            format = 'bz2'
-        elif format == 'lzma':
-            format = 'xz'
-        tar(root, path, base, comment, format)
-
-
-def archive(dst, changeset, version, master, full=True):
-    src_path = paths.worktree()
-    dst = join(dst, 'src')
-    if not full:
-        version += '_sep'
-    base = changeset + '_' + version + '-' + master
-    comment = bytes('Changeset: ' + changeset + '\nVersion: ' + version
-        + '\nOver: ' + master,
-        encoding='UTF8')
-    _archive(src_path, dst, base=base, comment=comment, format='xz')
+        # Slower, still in the background
+        error = []
+        def compress():
+            try:
+                with lzma.open(tmp, 'wb') as out:
+                    copyfileobj(git.stdout, out)
+            except Exception as e:
+                error.append(e)
+            finally:
+                # Not to leave git blocked on a full pipe
+                git.stdout.close()
+        thread = threading.Thread(target=compress)
+        thread.start()
+        def compressed():
+            thread.join()
+            if error:
+                print('ARCHIVE', repr(error[0]), file=sys.stderr)
+                return 1
+            return 0
 
+    def wait():
+        ok = compressed() == 0
+        ok = git.wait() == 0 and ok
+        if ok:
+            os.replace(tmp, path)
+        else:
+            print('ARCHIVE FAILED', commit, file=sys.stderr)
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+        return ok
+    return wait
@@ -0,0 +1,80 @@
+import hashlib
+import os
+from os.path import basename, dirname, exists, join
+from shutil import move
+import stat
+
+import paths
+import trash
+
+
+__all__ = ('store', 'gc')
+
+
+# Packages and images, by content. Build directories have hardlinks to these
+# files, so a package that did not change is stored once for all the builds.
+# The link count is the reference count: a file with just one link is only
+# in the pool and can go.
+_POOL = join(paths.www_root(), '.pool')
+
+_MODE = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+def _digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(1 << 20)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+def _link(src, dst):
+    tmp = dst + '.tmp'
+    try:
+        os.remove(tmp)
+    except FileNotFoundError:
+        pass
+    os.link(src, tmp)
+    os.replace(tmp, dst)
+
+
+def store(src, dst):
+    """Move the file src to the directory dst, through the pool."""
+    digest = _digest(src)
+    pooled = join(_POOL, digest[:2], digest[2:])
+    if exists(pooled):
+        os.remove(src)
+    else:
+        os.makedirs(dirname(pooled), exist_ok=True)
+        tmp = pooled + '.tmp'
+        move(src, tmp)
+        os.chmod(tmp, _MODE)
+        os.replace(tmp, pooled)
+    _link(pooled, join(dst, basename(src)))
+
+
+def gc(in_trash=None):
+    """Remove the files no build links to. Returns the bytes freed.
+
+    in_trash counts the links waiting to be removed, as trash.held().
+    """
+    if in_trash is None:
+        in_trash = {}
+    names = []
+    freed = 0
+    try:
+        subdirs = os.listdir(_POOL)
+    except FileNotFoundError:
+        return 0
+    for d in subdirs:
+        for entry in os.scandir(join(_POOL, d)):
+            st = entry.stat(follow_symlinks=False)
+            links = st.st_nlink - in_trash.get((st.st_dev, st.st_ino), 0)
+            if links <= 1 or entry.name.endswith('.tmp'):
+                names.append(entry.path)
+                freed += st.st_blocks * 512
+    trash.discard(*names, size=freed)
+    return freed
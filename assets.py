@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+from os.path import abspath, dirname, exists, join, splitext
+import re
+import tempfile
+
+import paths
+
+
+__all__ = ('hashed_name', 'manifest', 'link')
+
+
+# The files in web/assets, web/css and web/js, copied below www_root/static
+# with a hash of their contents in the name: they never change, so they can
+# be served with far-future cache headers. static/manifest.json maps each
+# name ('css/log.css') to its copy ('static/css/log.0123456789ab.css').
+# Older copies are never removed: build logs are kept for months and link
+# to the ones they were written with, and they are small.
+
+_WEB = join(dirname(abspath(__file__)), 'web')
+_DIR = 'static'
+# assets before css, which refers to them
+_KINDS = ('assets', 'css', 'js')
+_RE_URL = re.compile(r"url\('\.\./([^']+)'\)")
+
+_manifest = None
+
+
+def hashed_name(name, content):
+    """name with a hash of content (bytes) before the extension."""
+    stem, ext = splitext(name)
+    return stem + '.' + hashlib.sha256(content).hexdigest()[:12] + ext
+
+
+def _write(path, content):
+    # Unique, for the processes of reextract.py doing it at the same time
+    fd, tmp = tempfile.mkstemp(dir=dirname(path), prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+
+def _install():
+    root = join(paths.www_root(), _DIR)
+    manifest_file = join(root, 'manifest.json')
+    try:
+        with open(manifest_file, 'rt') as f:
+            old = json.load(f)
+    except FileNotFoundError:
+        old = {}
+    new = {}
+    for kind in _KINDS:
+        os.makedirs(join(root, kind), exist_ok=True)
+        for f in sorted(os.listdir(join(_WEB, kind))):
+            with open(join(_WEB, kind, f), 'rb') as fin:
+                content = fin.read()
+            if kind == 'css':
+                content = _RE_URL.sub(lambda m: "url('../"
+                    + new[m.group(1)][len(_DIR) + 1:] + "')",
+                    content.decode('utf-8')).encode('utf-8')
+            name = join(_DIR, kind, hashed_name(f, content))
+            if not exists(join(paths.www_root(), name)):
+                _write(join(paths.www_root(), name), content)
+            new[kind + '/' + f] = name
+    if new != old:
+        _write(manifest_file, json.dumps(new, indent=1).encode('utf-8'))
+    return new
+
+
+def manifest():
+    """{name: copy}, installing the copies the first time."""
+    global _manifest
+    if _manifest is None:
+        _manifest = _install()
+    return _manifest
+
+
+def link(name):
+    """Link to the copy of name, as paths.link_root()."""
+    return paths.link_root() + '/' + manifest()[name]
@@ -0,0 +1,123 @@
+#! /usr/bin/python
+
+# End to end throughput of testbuilds.py, offline: python -m bench.e2e
+# Makes a bench.fixture, serves its changes with bench.gerritstub and runs
+# testbuilds.py until there is nothing left to build, uploading new versions
+# between runs if asked to. Reports what the build cycles recorded.
+
+import argparse
+from collections import Counter
+import json
+import os
+from os.path import abspath, join
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench import fixture
+from bench.gerritstub import ChangeStore, PAGE_SIZE, serve
+
+
+def run_testbuilds(root, env):
+    with open(join(root, 'testbuilds.log'), 'at') as log:
+        return subprocess.run([sys.executable,
+            join(fixture.REPO_ROOT, 'testbuilds.py')], cwd=root, env=env,
+            stdout=log, stderr=subprocess.STDOUT).returncode
+
+
+def load_cycles(root):
+    with open(join(root, 'www', 'builds.json'), 'rt') as f:
+        return json.load(f).get('cycles', [])
+
+
+def print_row(name, builds, seconds, phases):
+    rate = builds * 60 / seconds if seconds else 0
+    print('{:<8}{:>8}{:>10.1f}{:>12.2f}  {}'.format(name, builds, seconds,
+        rate, ' '.join('{}={:.1f}'.format(k, v)
+            for k, v in sorted(phases.items()))))
+
+
+parser = argparse.ArgumentParser(description='Offline testbuilds throughput')
+parser.add_argument('--dir', help='fixture directory, must not exist '
+    '(default a temporary one, removed at the end)')
+parser.add_argument('--keep', action='store_true',
+    help='keep the temporary fixture directory')
+parser.add_argument('--uploads', type=int, default=0,
+    help='pending versions to upload after each run (default %(default)s)')
+parser.add_argument('--max-runs', type=int, default=20)
+parser.add_argument('--minutes', type=float, default=30,
+    help='no more runs after these many minutes (default %(default)s)')
+parser.add_argument('--time-limit', type=int, default=14000,
+    help='time_limit for each run (default %(default)s)')
+parser.add_argument('--page-size', type=int, default=PAGE_SIZE,
+    help='gerrit stand-in page size (default %(default)s)')
+parser.add_argument('--jam-lines', type=int, default=20000,
+    help='fake jam log size (default %(default)s)')
+parser.add_argument('--jam-seconds', type=float, default=0,
+    help='fake jam extra time per build (default %(default)s)')
+parser.add_argument('--no-html-logs', dest='html_logs', action='store_false',
+    help='leave the log pages to buildlog.py (html_logs off)')
+parser.add_argument('--json', metavar='FILE', help='also write the report')
+fixture.add_arguments(parser)
+args = fixture.parse_args(parser)
+
+if args.dir:
+    root = abspath(args.dir)
+else:
+    root = join(tempfile.mkdtemp(prefix='hk-e2e-'), 'fixture')
+data = fixture.create(root, args)
+store = ChangeStore(data)
+server = serve(store, page_size=args.page_size)
+fixture.write_config(root, server.url, args.arches, args.time_limit,
+    args.html_logs)
+
+env = dict(os.environ)
+env['PYTHONPATH'] = fixture.REPO_ROOT
+env['FAKEJAM_LINES'] = str(args.jam_lines)
+env['FAKEJAM_SECONDS'] = str(args.jam_seconds)
+
+print(len(data['changes']), 'changes,', len(args.arches), 'arches in', root)
+print('{:<8}{:>8}{:>10}{:>12}  {}'.format('run', 'builds', 'seconds',
+    'builds/min', 'phases (s)'))
+start = time.monotonic()
+runs = []
+failed = False
+for i in range(args.max_runs):
+    t = time.monotonic()
+    status = run_testbuilds(root, env)
+    t = time.monotonic() - t
+    if status:
+        print('testbuilds.py FAILED, see', join(root, 'testbuilds.log'))
+        failed = True
+        break
+    cycle = load_cycles(root)[-1]
+    runs.append({'seconds': t, 'builds': cycle['builds'],
+        'timing': cycle['timing']})
+    print_row(str(i + 1), cycle['builds'], t, cycle['timing'])
+    uploaded = store.upload(args.uploads) if args.uploads else []
+    if not (cycle['builds'] or uploaded):
+        break
+    if time.monotonic() - start > args.minutes * 60:
+        break
+
+server.shutdown()
+total = Counter()
+for run in runs:
+    total.update(run['timing'])
+builds = sum(run['builds'] for run in runs)
+seconds = sum(run['seconds'] for run in runs)
+print_row('total', builds, seconds, total)
+print('gerrit requests:', store.requests, ' reviews posted:',
+    len(store.reviews))
+
+if args.json:
+    with open(args.json, 'wt') as f:
+        json.dump({'runs': runs, 'builds': builds, 'seconds': seconds,
+            'requests': store.requests, 'reviews': len(store.reviews)}, f,
+            indent=1)
+if not (args.dir or args.keep):
+    shutil.rmtree(os.path.dirname(root))
+if failed:
+    raise SystemExit(1)
@@ -0,0 +1,107 @@
+#! /usr/bin/python
+
+# Stand-in for jam in a bench.fixture setup, run through its jam script.
+# Prints a bench.synthlog log: the release one for the arch, or a variant of
+# it for change builds. Fails with a broken mix if the tree has a BROKEN
+# file. Leaves packages for the PKG lines and an image on success.
+# Environment: FAKEJAM_LINES (log size, default 20000), FAKEJAM_SECONDS
+# (extra time per build, default 0), FAKEJAM_IMAGE_KIB (default 256).
+
+import os
+from os.path import basename, exists, join
+import random
+import sys
+import time
+import zlib
+
+
+IMAGE = 'haiku-nightly-anyboot.iso'
+PKG_SUFFIX = '.hpkg: Creating the package ...'
+BLOCK = 4096
+
+
+def parse(argv):
+    config_dir = None
+    variables = {}
+    targets = []
+    args = iter(argv)
+    for arg in args:
+        if arg == '--config-dir':
+            config_dir = next(args)
+        elif arg.startswith('-s'):
+            k, _, v = arg[2:].partition('=')
+            variables[k] = v
+        elif arg.startswith('-'):
+            pass
+        else:
+            targets.append(arg)
+    return config_dir, variables, targets
+
+
+def haiku_top():
+    with open(join('build', 'BuildConfig'), 'rt') as f:
+        for line in f:
+            k, _, v = line.partition('=')
+            if k.strip() == 'HAIKU_TOP':
+                return v.strip().rstrip(';').strip()
+    raise Exception('HAIKU_TOP not in BuildConfig')
+
+
+def load_generator(config_dir):
+    # log_analysis, below synthlog, wants the config.ini
+    here = os.getcwd()
+    os.chdir(config_dir)
+    try:
+        from bench.synthlog import Generator
+    finally:
+        os.chdir(here)
+    return Generator
+
+
+def write_image(arch, revision, kib):
+    # Mostly the same blocks for every build of the arch, as real ones
+    base = random.Random(zlib.crc32(arch.encode()))
+    changed = random.Random(zlib.crc32(revision.encode()))
+    with open(IMAGE, 'wb') as f:
+        for i in range(kib * 1024 // BLOCK):
+            rnd = changed if changed.random() < 0.05 else base
+            f.write(rnd.randbytes(BLOCK))
+
+
+def main(argv):
+    config_dir, variables, targets = parse(argv)
+    arch = basename(os.getcwd())
+    revision = variables.get('HAIKU_REVISION', '')
+    broken = exists(join(haiku_top(), 'BROKEN'))
+    lines = int(os.environ.get('FAKEJAM_LINES', 20000))
+
+    Generator = load_generator(config_dir)
+    gen = Generator(lines, 'broken' if broken else 'default',
+        zlib.crc32(arch.encode()), arch)
+    if '_' in revision:
+        # parent_number_version[_sep]
+        gen = gen.variant(zlib.crc32(revision.encode()))
+
+    pkg_dir = join('objects', 'haiku', arch, 'packaging', 'packages')
+    os.makedirs(pkg_dir, exist_ok=True)
+    out = sys.stdout
+    for line in gen:
+        out.write(line)
+        out.write('\n')
+        if line.endswith(PKG_SUFFIX):
+            name = line[:-len(PKG_SUFFIX)] + '.hpkg'
+            with open(join(pkg_dir, name), 'wt') as f:
+                f.write(revision + '\n')
+    out.flush()
+
+    time.sleep(float(os.environ.get('FAKEJAM_SECONDS', 0)))
+    if broken:
+        return 1
+    if IMAGE in ' '.join(targets) or '@nightly-anyboot' in targets:
+        write_image(arch, revision, int(os.environ.get('FAKEJAM_IMAGE_KIB',
+            256)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
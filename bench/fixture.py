@@ -0,0 +1,325 @@
+#! /usr/bin/python
+
+# Set up a directory to run testbuilds.py offline, as:
+#   python -m bench.fixture DIR [--changes N] ...
+# It gets a remote repo with releases and gerrit-like change refs, a clone
+# with the branches and worktree the README asks for, fake buildtools, a
+# fake jam (bench.fakejam), changes.json for bench.gerritstub and, with
+# --gerrit-url, config.ini. bench.e2e does all of it and runs the builds.
+
+import argparse
+import hashlib
+import json
+import os
+from os.path import abspath, dirname, join
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+from bench.gerritstub import timestamp
+
+
+__all__ = ('create', 'write_config')
+
+
+REPO_ROOT = dirname(dirname(abspath(__file__)))
+
+PROJECT = 'haiku'
+BRANCH = 'master'
+FIRST_RELEASE = 57000
+FIRST_CHANGE = 7000
+
+_CONFIGURE = '''#! /bin/sh
+# Fake Haiku configure: only leaves what the builder looks for
+top=$(cd "$(dirname "$0")" && pwd)
+mkdir -p build
+if [ "$1" != "--update" ]; then
+    echo "HAIKU_TOP = $top ;" > build/BuildConfig
+    echo "CONFIGURE_ARGS = $* ;" >> build/BuildConfig
+fi
+echo "configured $top"
+'''
+
+_JAM = '''#! /bin/sh
+PYTHONPATH={repo}${{PYTHONPATH:+:$PYTHONPATH}} exec {python} -m bench.fakejam \\
+    --config-dir {root} "$@"
+'''
+
+_CONFIG = '''[Builder]
+user = bench
+password = bench
+
+gerrit_url = {gerrit_url}
+gerrit_cache = 0
+
+project = {project}
+branch = {branch}
+
+www_root = {root}/www
+builder_root = {root}
+worktree = %(builder_root)s/haiku
+build = %(builder_root)s/build
+buildtools = %(builder_root)s/buildtools
+jam = %(builder_root)s/jam
+
+site = http://localhost
+link = /testbuild
+
+max_jobs = 1
+
+branch_base = testbuild_base
+branch_rolling = testbuild
+
+keep_done = 10
+keep_done_pressure = 1
+
+time_limit = {time_limit}
+
+low_disk = 0
+
+trash_jobs = 2
+
+archive_src = True
+archive_change_src = False
+
+html_logs = {html_logs}
+
+
+[DEFAULT]
+save_artifacts = True
+chunk_images = False
+jam_options =
+active = True
+'''
+
+_JOB = '''
+[{arch}]
+arch = {arch}
+target = @nightly-anyboot
+'''
+
+_IDENTITY = {'user.name': 'Bench', 'user.email': 'bench@localhost'}
+
+
+def _git(cwd, *args, t=None):
+    env = dict(os.environ)
+    if t is not None:
+        date = '@{} +0000'.format(int(t))
+        env['GIT_AUTHOR_DATE'] = env['GIT_COMMITTER_DATE'] = date
+    for k, v in _IDENTITY.items():
+        args = ('-c', k + '=' + v) + args
+    return subprocess.run(('git',) + args, cwd=cwd, env=env, check=True,
+        capture_output=True, text=True).stdout.strip()
+
+
+def _write(path, text, mode=None):
+    os.makedirs(dirname(path), exist_ok=True)
+    with open(path, 'wt') as f:
+        f.write(text)
+    if mode is not None:
+        os.chmod(path, mode)
+
+
+def _source(name, lines=60):
+    return ''.join('// {} line {}\n'.format(name, i) for i in range(lines))
+
+
+def _edit(path, line, text):
+    with open(path, 'rt') as f:
+        lines = f.readlines()
+    lines[line] = text + '\n'
+    with open(path, 'wt') as f:
+        f.writelines(lines)
+
+
+def _commit(seed, message, t):
+    _git(seed, 'add', '-A')
+    _git(seed, 'commit', '-q', '-m', message, t=t)
+    return _git(seed, 'rev-parse', 'HEAD')
+
+
+def _releases(seed, n, t):
+    """Master history, a tagged release per commit. Returns the shas."""
+    os.makedirs(seed)
+    _git(seed, 'init', '-q', '-b', BRANCH)
+    _write(join(seed, 'configure'), _CONFIGURE, 0o755)
+    _write(join(seed, 'Jamfile'), 'SubInclude HAIKU_TOP src ;\n')
+    _write(join(seed, 'src', 'core.cpp'), _source('core', max(60, n + 1)))
+    shas = [_commit(seed, 'Initial import', t)]
+    _git(seed, 'tag', 'hrev' + str(FIRST_RELEASE))
+    for i in range(1, n):
+        _edit(join(seed, 'src', 'core.cpp'), i, '// core release ' + str(i))
+        shas.append(_commit(seed, 'core: release ' + str(i), t + i))
+        _git(seed, 'tag', 'hrev' + str(FIRST_RELEASE + i))
+    return shas
+
+
+def _changes(seed, releases, remote, args, rnd, now):
+    changes = []
+    previous = None
+    for i in range(args.changes):
+        number = FIRST_CHANGE + i
+        cid = 'I' + hashlib.sha1('{}-{}'.format(args.seed, i).encode()
+            ).hexdigest()
+        conflict = rnd.random() < args.conflicts and len(releases) > 1
+        if conflict:
+            # Same line as the last release, on top of the one before
+            parent = releases[-2]
+        elif previous and rnd.random() < args.chains:
+            parent = previous
+        else:
+            parent = rnd.choice(releases[-2:])
+        broken = rnd.random() < args.broken
+        versions = 2 if rnd.random() < args.versions else 1
+        created = now - rnd.randint(3600, 60 * 24 * 3600)
+        name = 'change{}'.format(number)
+        revisions = {}
+        shas = []
+        for v in range(1, versions + 1):
+            _git(seed, 'checkout', '-q', '--detach', parent)
+            path = join(seed, 'src', name + '.cpp')
+            _write(path, _source(name))
+            _edit(path, 0, '// {} version {}'.format(name, v))
+            if conflict:
+                _edit(join(seed, 'src', 'core.cpp'), len(releases) - 1,
+                    '// core conflicting ' + name)
+            if broken:
+                _write(join(seed, 'BROKEN'), name + '\n')
+            message = '{}: version {}\n\nChange-Id: {}\n'.format(name, v, cid)
+            sha = _commit(seed, message, created + v)
+            ref = 'refs/changes/{:02d}/{}/{}'.format(number % 100, number, v)
+            _git(seed, 'update-ref', ref, sha)
+            revisions[sha] = {
+                '_number': v,
+                'ref': ref,
+                'created': timestamp(created + v * 600),
+                'fetch': {'anonymous http': {'url': remote, 'ref': ref}}
+            }
+            shas.append(sha)
+        # The newer version may be uploaded while benchmarking
+        pending = shas[1:] if rnd.random() < args.pending else []
+        current = shas[-1 - len(pending)]
+        wip = rnd.random() < 0.1
+        change = {
+            'id': '{}~{}~{}'.format(PROJECT, BRANCH, cid),
+            'project': PROJECT,
+            'branch': BRANCH,
+            'change_id': cid,
+            'subject': '{}: version {}'.format(name,
+                revisions[current]['_number']),
+            'status': 'NEW',
+            'created': timestamp(created),
+            'updated': revisions[current]['created'],
+            'hashtags': [],
+            'work_in_progress': wip,
+            'unresolved_comment_count': rnd.choice((0, 0, 0, 1, 2)),
+            '_number': number,
+            'labels': {'Code-Review': rnd.choice(({}, {}, {'approved': {}},
+                {'recommended': {}}, {'disliked': {}}))},
+            'current_revision': current,
+            'revisions': revisions,
+            'pending': pending,
+        }
+        changes.append(change)
+        previous = None if conflict else shas[0]
+    return changes
+
+
+def create(root, args):
+    """Make the fixture in root, which should not exist. Returns the
+    changes.json contents."""
+    rnd = random.Random(args.seed)
+    now = int(time.time())
+    root = abspath(root)
+    os.makedirs(root)
+    seed = join(root, 'seed')
+    remote = join(root, 'remote.git')
+    worktree = join(root, 'haiku')
+
+    releases = _releases(seed, args.releases, now - 90 * 24 * 3600)
+    changes = _changes(seed, releases, remote, args, rnd, now)
+    _git(seed, 'checkout', '-q', BRANCH)
+    _git(root, 'init', '-q', '--bare', remote)
+    _git(seed, 'push', '-q', remote, 'refs/heads/*:refs/heads/*',
+        'refs/tags/*:refs/tags/*', 'refs/changes/*:refs/changes/*')
+    shutil.rmtree(seed)
+
+    _git(root, 'clone', '-q', remote, worktree)
+    for k, v in _IDENTITY.items():
+        _git(worktree, 'config', k, v)
+    _git(worktree, 'branch', '-q', '--track', 'testbuild_base',
+        'origin/' + BRANCH)
+    _git(worktree, 'checkout', '-q', '-b', 'testbuild', 'testbuild_base')
+
+    for arch in args.arches:
+        if arch == 'x86_gcc2h':
+            prefixes = (('x86_gcc2', 'i586-pc'), ('x86', 'i586-pc'))
+        else:
+            prefixes = ((arch, arch),)
+        for name, prefix in prefixes:
+            bindir = join(root, 'buildtools', arch, 'cross-tools-' + name,
+                'bin')
+            for tool in ('gcc', 'ld'):
+                _write(join(bindir, prefix + '-unknown-haiku-' + tool),
+                    '#! /bin/sh\n', 0o755)
+
+    _write(join(root, 'jam'), _JAM.format(repo=REPO_ROOT,
+        python=sys.executable, root=root), 0o755)
+    os.makedirs(join(root, 'www'))
+
+    data = {'project': PROJECT, 'repo': remote, 'changes': changes}
+    with open(join(root, 'changes.json'), 'wt') as f:
+        json.dump(data, f, indent=1)
+    return data
+
+
+def write_config(root, gerrit_url, arches, time_limit=14000, html_logs=True):
+    text = _CONFIG.format(root=abspath(root), gerrit_url=gerrit_url,
+        project=PROJECT, branch=BRANCH, time_limit=time_limit,
+        html_logs=html_logs)
+    for arch in arches:
+        text += _JOB.format(arch=arch)
+    _write(join(root, 'config.ini'), text)
+
+
+def add_arguments(parser):
+    parser.add_argument('--changes', type=int, default=20,
+        help='number of changes (default %(default)s)')
+    parser.add_argument('--releases', type=int, default=3,
+        help='tagged commits in master (default %(default)s)')
+    parser.add_argument('--chains', type=float, default=0.3,
+        help='fraction of changes on top of the previous one')
+    parser.add_argument('--conflicts', type=float, default=0.1,
+        help='fraction of changes that conflict with master')
+    parser.add_argument('--broken', type=float, default=0.1,
+        help='fraction of changes that fail to build')
+    parser.add_argument('--versions', type=float, default=0.3,
+        help='fraction of changes with a second version')
+    parser.add_argument('--pending', type=float, default=0.5,
+        help='fraction of those with the second version not uploaded yet')
+    parser.add_argument('--arch', dest='arches', action='append',
+        help='job to configure, repeat for more (default x86_64)')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def parse_args(parser):
+    args = parser.parse_args()
+    if not args.arches:
+        args.arches = ['x86_64']
+    return args
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline testbuilds setup')
+    parser.add_argument('dir', help='where to create it')
+    parser.add_argument('--gerrit-url',
+        help='also write a config.ini using this server')
+    parser.add_argument('--time-limit', type=int, default=14000)
+    add_arguments(parser)
+    args = parse_args(parser)
+    data = create(args.dir, args)
+    if args.gerrit_url:
+        write_config(args.dir, args.gerrit_url, args.arches, args.time_limit)
+    print(len(data['changes']), 'changes in', abspath(args.dir))
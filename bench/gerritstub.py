@@ -0,0 +1,288 @@
+#! /usr/bin/python
+
+# Serves a change set as the bits of gerrit's REST API that gerrit.py uses.
+# Run from anywhere, as: python -m bench.gerritstub changes.json
+# Changes come from bench.fixture or from a recording (the JSON list a real
+# server returns for changes/?o=ALL_REVISIONS&o=LABELS, saved without the
+# )]}' line).
+
+import argparse
+import base64
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+import subprocess
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+__all__ = ('ChangeStore', 'serve', 'timestamp')
+
+
+XSSI = b")]}'\n"
+
+# Gerrit's default query limit for anonymous users
+PAGE_SIZE = 500
+
+_TERM = re.compile(r'(-?)(\w+):(?:"([^"]*)"|(\S+))')
+
+
+def timestamp(t):
+    return time.strftime('%Y-%m-%d %H:%M:%S.000000000', time.gmtime(t))
+
+
+class ChangeStore:
+    """Changes of one project, plus the revisions not uploaded yet.
+
+    data is the dict bench.fixture writes: project, branches (ref: sha),
+    repo (to read the branches from instead, optional) and changes. A change
+    may have a pending list of revision shas, that upload() makes current.
+    """
+    def __init__(self, data):
+        self.lock = threading.Lock()
+        self.project = data['project']
+        self.repo = data.get('repo')
+        self._branches = data.get('branches', {})
+        self.changes = data['changes']
+        self.reviews = []
+        self.requests = 0
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rt') as f:
+            data = json.load(f)
+        if isinstance(data, list):
+            # Recording
+            project = data[0]['project'] if data else 'haiku'
+            data = {'project': project, 'changes': data}
+        return cls(data)
+
+    def branches(self):
+        if self.repo is None:
+            return dict(self._branches)
+        refs = subprocess.run(['git', 'for-each-ref',
+            '--format=%(objectname) %(refname)', 'refs/heads/'],
+            cwd=self.repo, capture_output=True, text=True, check=True)
+        branches = {}
+        for line in refs.stdout.splitlines():
+            sha, ref = line.split(' ', 1)
+            branches[ref] = sha
+        return branches
+
+    def upload(self, n=1, now=None):
+        """Make the next pending revision current in up to n changes."""
+        if now is None:
+            now = time.time()
+        uploaded = []
+        with self.lock:
+            for change in self.changes:
+                if len(uploaded) >= n:
+                    break
+                if not change.get('pending'):
+                    continue
+                sha = change['pending'].pop(0)
+                rev = change['revisions'][sha]
+                rev['created'] = change['updated'] = timestamp(now)
+                change['current_revision'] = sha
+                uploaded.append(change['change_id'])
+        return uploaded
+
+    def query(self, q, options, limit=PAGE_SIZE, start=0):
+        terms = {}
+        for neg, key, quoted, plain in _TERM.findall(q):
+            terms[neg + key] = quoted or plain
+        found = []
+        with self.lock:
+            for change in self.changes:
+                if 'project' in terms and change['project'] != terms['project']:
+                    continue
+                if 'branch' in terms and change['branch'] != _short_ref(
+                        terms['branch']):
+                    continue
+                if terms.get('is') == 'open' and change['status'] != 'NEW':
+                    continue
+                if 'since' in terms and change['updated'] < terms['since']:
+                    continue
+                if 'before' in terms and change['updated'] > terms['before']:
+                    continue
+                if 'commit' in terms and not [sha
+                        for sha in _visible_revisions(change)
+                        if sha.startswith(terms['commit'])]:
+                    continue
+                found.append(_change_info(change, options))
+        found.sort(key=lambda c: c['updated'], reverse=True)
+        found = found[start:]
+        if len(found) > limit:
+            found = found[:limit]
+            found[-1]['_more_changes'] = True
+        return found
+
+    def review(self, cid, revision, review):
+        with self.lock:
+            for change in self.changes:
+                if cid in (change['change_id'], change['id'],
+                        str(change['_number'])):
+                    break
+            else:
+                return None
+            if revision not in _visible_revisions(change):
+                return None
+            self.reviews.append({'change_id': change['change_id'],
+                'revision': revision, 'review': review})
+            labels = change.setdefault('labels', {})
+            for label, value in review.get('labels', {}).items():
+                value = int(value)
+                if value > 0:
+                    labels[label] = {'approved': {}}
+                elif value < 0:
+                    labels[label] = {'rejected': {}}
+                else:
+                    labels[label] = {}
+            change['updated'] = timestamp(time.time())
+            return {'labels': review.get('labels', {})}
+
+
+def _short_ref(ref):
+    if ref.startswith('refs/heads/'):
+        return ref[11:]
+    return ref
+
+
+def _visible_revisions(change):
+    pending = change.get('pending', ())
+    return [sha for sha in change['revisions'] if sha not in pending]
+
+
+def _change_info(change, options):
+    info = {k: v for k, v in change.items()
+        if k not in ('revisions', 'labels', 'pending', 'current_revision')}
+    if 'CURRENT_REVISION' in options or 'ALL_REVISIONS' in options:
+        current = change['current_revision']
+        info['current_revision'] = current
+        if 'ALL_REVISIONS' in options:
+            shas = _visible_revisions(change)
+        else:
+            shas = [current]
+        info['revisions'] = {sha: change['revisions'][sha] for sha in shas}
+    if 'LABELS' in options:
+        info['labels'] = change.get('labels', {})
+    return json.loads(json.dumps(info))
+
+
+class Handler(BaseHTTPRequestHandler):
+    store = None
+    page_size = PAGE_SIZE
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, obj, status=200):
+        body = XSSI + json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, text):
+        body = text.encode() + b'\n'
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _path(self):
+        url = urlsplit(self.path)
+        parts = [unquote(p) for p in url.path.split('/')]
+        # Leading '', trailing '' for the collections
+        parts = parts[1:]
+        authenticated = parts[:1] == ['a']
+        if authenticated:
+            parts = parts[1:]
+        return parts, parse_qs(url.query), authenticated
+
+    def do_GET(self):
+        self.store.requests += 1
+        parts, params, _ = self._path()
+        store = self.store
+        project = store.project
+        if parts == ['projects', '']:
+            self._reply({name: {'id': name, 'state': 'ACTIVE'}
+                for name in ('All-Projects', project)})
+        elif parts == ['projects', project, '']:
+            self._reply({'id': project, 'name': project,
+                'parent': 'All-Projects', 'state': 'ACTIVE'})
+        elif parts == ['projects', project, 'branches', '']:
+            self._reply([{'ref': ref, 'revision': sha}
+                for ref, sha in sorted(store.branches().items())])
+        elif parts[:3] == ['projects', project, 'branches'] and len(parts) == 4:
+            try:
+                self._reply({'ref': parts[3],
+                    'revision': store.branches()[parts[3]]})
+            except KeyError:
+                self._error(404, 'Not found: ' + parts[3])
+        elif parts == ['changes', '']:
+            try:
+                limit = int(params['n'][0])
+            except (KeyError, ValueError):
+                limit = self.page_size
+            try:
+                start = int(params['S'][0])
+            except (KeyError, ValueError):
+                start = 0
+            self._reply(store.query(params.get('q', [''])[0],
+                params.get('o', []), limit, start))
+        else:
+            self._error(404, 'Not found')
+
+    def do_POST(self):
+        self.store.requests += 1
+        parts, _, authenticated = self._path()
+        if (len(parts) != 5 or parts[0] != 'changes'
+                or parts[2] != 'revisions' or parts[4] != 'review'):
+            self._error(404, 'Not found')
+            return
+        auth = self.headers.get('Authorization', '')
+        if not (authenticated and auth.startswith('Basic ')
+                and b':' in base64.b64decode(auth[6:])):
+            self._error(401, 'Unauthorized')
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        review = json.loads(self.rfile.read(length) or b'{}')
+        result = self.store.review(parts[1], parts[3], review)
+        if result is None:
+            self._error(404, 'Not found: ' + parts[1])
+        else:
+            self._reply(result)
+
+
+def serve(store, port=0, host='127.0.0.1', page_size=PAGE_SIZE):
+    """Start serving store in a thread. Returns the server, see its url."""
+    handler = type('StoreHandler', (Handler,), {'store': store,
+        'page_size': page_size})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.url = 'http://{}:{}/'.format(*server.server_address[:2])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local gerrit stand-in')
+    parser.add_argument('changes', help='bench.fixture changes.json, or a '
+        'recorded change list')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE,
+        help='changes per reply before _more_changes (default %(default)s)')
+    args = parser.parse_args()
+
+    server = serve(ChangeStore.load(args.changes), args.port,
+        page_size=args.page_size)
+    print('Serving', args.changes, 'at', server.url)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
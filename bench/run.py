@@ -0,0 +1,236 @@
+#! /usr/bin/python
+
+# Run from the directory with config.ini, as: python -m bench.run
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from bench.synthlog import Generator, MIXES
+import log_analysis
+
+
+def _canonical(obj):
+    if isinstance(obj, set):
+        return sorted(obj)
+    if isinstance(obj, tuple):
+        return list(obj)
+    raise TypeError(type(obj))
+
+
+def digest(obj):
+    if isinstance(obj, str):
+        data = obj.encode('utf-8')
+    else:
+        data = json.dumps(obj, sort_keys=True, default=_canonical).encode()
+    return hashlib.sha256(data).hexdigest(), len(data)
+
+
+def read_log(path):
+    with open(path, 'rt', errors='replace') as logf:
+        return logf.read().split('\n')
+
+
+def line_msgs(result):
+    # As builder._process_build does
+    refs = {k: [msg[0] for msgs in result[k].values() for msg in msgs]
+        for k in ('warnings', 'errors')}
+    m = max((max(v) for v in refs.values() if v), default=0)
+    lm = [0] * (m + 1)
+    for k, v in (('warnings', 1), ('errors', 2)):
+        for i in refs[k]:
+            lm[i] = v
+    return lm
+
+
+# Each stage takes the state dict, returns (output for the digest, items)
+# and may add to the state for the next ones.
+
+def stage_transform(state):
+    state['log'] = list(log_analysis.PathTransformer().transform(state['raw']))
+    if state['raw_base'] is not None:
+        state['log_base'] = list(log_analysis.PathTransformer().transform(
+            state['raw_base']))
+    return state['log'], len(state['log'])
+
+
+def stage_itemize(state):
+    items = list(log_analysis.itemize(state['log']))
+    state['items'] = items
+    return items, len(state['log'])
+
+
+def stage_match_error_key(state):
+    msgs = [data[3] for type, line, data in state['items']
+        if type in ('WARN', 'ERR')]
+    keys = [log_analysis.match_error_key(msg) for msg in msgs]
+    return keys, len(msgs)
+
+
+def stage_analyse(state):
+    result = log_analysis.analyse(state['log'])
+    state['result'] = result
+    if state.get('log_base') is not None:
+        state['result_base'] = log_analysis.analyse(state['log_base'])
+    return result, len(state['log'])
+
+
+def stage_analyse_file(state):
+    # The same as analyse, from the file
+    return (log_analysis.analyse_file(state['raw_file']),
+        len(state['raw']))
+
+
+def stage_diff(state):
+    base = state.get('result_base')
+    if base is None:
+        base = state['result']
+    removed, added = log_analysis.diff(base['full'], state['result']['full'])
+    n = sum(len(v) for v in state['result']['full'].values())
+    return (removed, added), n
+
+
+def stage_htmlout(state):
+    out = io.StringIO()
+    log_analysis.htmlout(state['log'], out,
+        file_linker=log_analysis.file_link_release('hrev1'),
+        line_msgs=line_msgs(state['result']))
+    return out.getvalue(), len(state['log'])
+
+
+STAGES = (
+    ('transform', stage_transform),
+    ('itemize', stage_itemize),
+    ('match_error_key', stage_match_error_key),
+    ('analyse', stage_analyse),
+    ('analyse_file', stage_analyse_file),
+    ('diff', stage_diff),
+    ('htmlout', stage_htmlout),
+)
+
+
+def run(state, stages, memory=True, repeat=1):
+    report = {}
+    devnull = open(os.devnull, 'wt')
+    for name, stage in STAGES:
+        if name not in stages:
+            continue
+        best = None
+        for i in range(repeat):
+            with contextlib.redirect_stdout(devnull):
+                t = time.perf_counter()
+                output, n = stage(state)
+                t = time.perf_counter() - t
+            if best is None or t < best:
+                best = t
+        row = {'seconds': best, 'items': n,
+            'rate': n / best if best else float('inf')}
+        row['digest'], row['bytes'] = digest(output)
+        if memory:
+            tracemalloc.start()
+            with contextlib.redirect_stdout(devnull):
+                stage(state)
+            row['peak'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        report[name] = row
+    devnull.close()
+    return report
+
+
+def print_report(title, report):
+    print(title)
+    print('  {:<16}{:>10}{:>12}{:>14}{:>12}{:>12}'.format('stage',
+        'seconds', 'items', 'items/s', 'peak MiB', 'out KiB'))
+    for name, row in report.items():
+        peak = row.get('peak')
+        print('  {:<16}{:>10.3f}{:>12}{:>14.0f}{:>12}{:>12.0f}'.format(name,
+            row['seconds'], row['items'], row['rate'],
+            '-' if peak is None else '{:.1f}'.format(peak / 2**20),
+            row['bytes'] / 1024))
+
+
+parser = argparse.ArgumentParser(description='Time the log analysis stages')
+parser.add_argument('logs', nargs='*',
+    help='recorded build.out files instead of generated ones')
+parser.add_argument('--base', help='recorded build.out to diff against')
+parser.add_argument('--lines', type=int, default=200000,
+    help='generated log size (default %(default)s)')
+parser.add_argument('--mix', choices=sorted(MIXES), default='default',
+    help='generated message mix (default %(default)s)')
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--stage', action='append', choices=[s for s, _ in STAGES],
+    help='only run these stages (the previous ones are run anyway)')
+parser.add_argument('--repeat', type=int, default=1,
+    help='keep the best time of these many runs')
+parser.add_argument('--no-memory', action='store_true',
+    help='skip the (slow) peak memory measurement')
+parser.add_argument('--save-reference', metavar='FILE',
+    help='write the output digests to compare later implementations')
+parser.add_argument('--check', metavar='FILE',
+    help='compare the output digests with a saved reference')
+parser.add_argument('--json', metavar='FILE', help='also write the report')
+args = parser.parse_args()
+
+if args.stage:
+    last = max(i for i, (s, _) in enumerate(STAGES) if s in args.stage)
+    stages = {s for s, _ in STAGES[:last + 1]}
+else:
+    stages = {s for s, _ in STAGES}
+
+inputs = []
+if args.logs:
+    base = read_log(args.base) if args.base else None
+    for path in args.logs:
+        inputs.append((path, read_log(path), base, path))
+else:
+    gen = Generator(args.lines, args.mix, args.seed)
+    name = 'synthetic {} lines, {} mix, seed {}'.format(args.lines, args.mix,
+        args.seed)
+    inputs.append((name, list(gen.variant(args.seed + 1)), list(gen), None))
+
+reports = {}
+for name, raw, raw_base, raw_file in inputs:
+    state = {'raw': raw, 'raw_base': raw_base, 'raw_file': raw_file}
+    if raw_file is None and 'analyse_file' in stages:
+        fd, state['raw_file'] = tempfile.mkstemp(suffix='.out')
+        with os.fdopen(fd, 'wt') as f:
+            f.write('\n'.join(raw))
+    try:
+        report = run(state, stages, not args.no_memory, args.repeat)
+    finally:
+        if raw_file is None and 'analyse_file' in stages:
+            os.remove(state['raw_file'])
+    print_report(name, report)
+    reports[name] = report
+
+failed = False
+if args.check:
+    with open(args.check, 'rt') as f:
+        reference = json.load(f)
+    for name, report in reports.items():
+        for stage, row in report.items():
+            try:
+                expected = reference[name][stage]
+            except KeyError:
+                print('NO REFERENCE', name, stage)
+                continue
+            if expected != row['digest']:
+                print('MISMATCH', name, stage)
+                failed = True
+    if not failed:
+        print('Same output as the reference')
+if args.save_reference:
+    with open(args.save_reference, 'wt') as f:
+        json.dump({name: {stage: row['digest'] for stage, row in r.items()}
+            for name, r in reports.items()}, f, indent=1)
+if args.json:
+    with open(args.json, 'wt') as f:
+        json.dump(reports, f, indent=1)
+if failed:
+    raise SystemExit(1)
@@ -0,0 +1,215 @@
+import random
+
+from log_analysis import PathTransformer
+
+
+__all__ = ('Generator', 'MIXES')
+
+
+_DIRS = ('add-ons/kernel/file_systems/bfs', 'add-ons/media/plugins/ffmpeg',
+    'add-ons/translators/png', 'apps/deskbar', 'apps/terminal',
+    'kits/app', 'kits/interface', 'kits/network/libnetapi', 'kits/storage',
+    'libs/compat/freebsd_network', 'servers/app', 'servers/net',
+    'system/boot/loader', 'system/kernel/vm', 'system/libroot/posix',
+    'tests/kits/interface', 'tools/fs_shell')
+
+_WARNINGS = (
+    ("unused variable '{name}'", '-Wunused-variable'),
+    ("'{name}' may be used uninitialized in this function",
+        '-Wmaybe-uninitialized'),
+    ('comparison of integer expressions of different signedness: '
+        "'int' and 'uint32'", '-Wsign-compare'),
+    ("'{name}' defined but not used", '-Wunused-function'),
+    ("enumeration value '{name}' not handled in switch", '-Wswitch'),
+    ("format '%ld' expects argument of type 'long int', but argument 2 has "
+        "type 'int32'", '-Wformat='),
+    ("this statement may fall through", '-Wimplicit-fallthrough='),
+    ("'{name}' is deprecated", '-Wdeprecated-declarations'),
+)
+# Old compilers don't always give the flag
+_BARE_WARNINGS = (
+    'comparison between signed and unsigned',
+    "unused variable `{name}'",
+    "`{name}' might be used uninitialized in this function",
+    'no previous prototype for `{name}\'',
+)
+_ERRORS = (
+    "'{name}' was not declared in this scope",
+    "expected ';' before '}}' token",
+    "no matching function for call to '{name}(int)'",
+    "invalid conversion from 'const char*' to 'char*'",
+)
+_NAMES = ('status', 'count', 'fLock', 'buffer', 'B_OK', 'index', 'cookie',
+    'fTarget', 'result', 'node', 'length', 'gDebug')
+
+_NOISE = (
+    'C++ objects/haiku/{arch}/release/{dir}/{name}.o',
+    'Cc objects/haiku/{arch}/release/{dir}/{name}.o',
+    'Link objects/haiku/{arch}/release/{dir}/{name}',
+    'Archive objects/haiku/{arch}/release/{dir}/lib{name}.a',
+    'Ranlib objects/haiku/{arch}/release/{dir}/lib{name}.a',
+    'XRes1 objects/haiku/{arch}/release/{dir}/{name}',
+    'SetType1 objects/haiku/{arch}/release/{dir}/{name}',
+    'MimeSet1 objects/haiku/{arch}/release/{dir}/{name}',
+    'Copy objects/haiku/{arch}/packaging/repositories/{name}',
+    'Downloading https://eu.hpkg.haiku-os.org/haikuports/master/{arch}/'
+        'current/packages/{name}-1.0-1-{arch}.hpkg ...',
+    'Extracting download/{name}-1.0-1-{arch}.hpkg ...',
+    'AddTargetVariableToScript1 objects/haiku/{arch}/release/{dir}/{name}',
+)
+
+_JAM_MESSAGES = (
+    "Warning: couldn't resolve catalog-access: {name}",
+    'warning: using independent target {name}',
+    'build-feature packages unavailable on {arch}: {name} {name}_devel',
+    'warning: unknown rule {name}',
+)
+
+# Fraction of lines for each kind of item
+MIXES = {
+    'clean': {'warning': 0.005, 'error': 0, 'jam': 0.0005, 'messed': 0.001,
+        'context': 0.01},
+    'default': {'warning': 0.04, 'error': 0.001, 'jam': 0.002,
+        'messed': 0.005, 'context': 0.06},
+    'gcc2h': {'warning': 0.12, 'error': 0.002, 'jam': 0.002, 'messed': 0.01,
+        'context': 0.15},
+    'broken': {'warning': 0.04, 'error': 0.02, 'jam': 0.005, 'messed': 0.01,
+        'context': 0.1},
+}
+
+
+class Generator:
+    """Random jam/gcc output, as it is before PathTransformer.
+
+    A generator produces the same log for the same parameters. variant()
+    gives another log for the same sources with some messages added, removed
+    or moved, as a changeset over a release would.
+    """
+    def __init__(self, lines=100000, mix='default', seed=0, arch='x86_64'):
+        self.lines = lines
+        self.mix = MIXES[mix] if isinstance(mix, str) else mix
+        self.seed = seed
+        self.arch = arch
+        self.src = PathTransformer.rel_src + '/src/'
+        rnd = random.Random(seed)
+        self.files = []
+        for i in range(max(10, lines // 200)):
+            d = rnd.choice(_DIRS)
+            ext = rnd.choice(('.cpp', '.cpp', '.cpp', '.c', '.h'))
+            self.files.append(d + '/' + rnd.choice(_NAMES).strip('fg').title()
+                + str(i) + ext)
+        n_messages = int(lines * (self.mix['warning'] + self.mix['error']))
+        self.sites = [self._site(rnd) for i in range(n_messages)]
+
+    def _site(self, rnd):
+        total = self.mix['warning'] + self.mix['error']
+        name = rnd.choice(_NAMES)
+        file = rnd.choice(self.files)
+        line = rnd.randint(1, 3000)
+        if total and rnd.random() < self.mix['error'] / total:
+            return (file, line, rnd.randint(1, 60), 'error',
+                rnd.choice(_ERRORS).format(name=name), None)
+        if rnd.random() < 0.2:
+            return (file, line, None, 'warning',
+                rnd.choice(_BARE_WARNINGS).format(name=name), None)
+        msg, flag = rnd.choice(_WARNINGS)
+        return (file, line, rnd.randint(1, 60), 'warning',
+            msg.format(name=name), flag)
+
+    def variant(self, seed=1, changed=0.02, shifted=0.1):
+        """Same generator, with a fraction of the messages changed.
+
+        Messages in a fraction of the files are also moved some lines away.
+        """
+        rnd = random.Random(seed)
+        other = Generator.__new__(Generator)
+        other.__dict__.update(self.__dict__)
+        moved_files = {f: rnd.randint(-40, 40) for f in self.files
+            if rnd.random() < shifted}
+        sites = []
+        for site in self.sites:
+            r = rnd.random()
+            if r < changed / 2:
+                # fixed
+                continue
+            if r < changed:
+                sites.append(self._site(rnd))
+            try:
+                site = (site[0], max(1, site[1] + moved_files[site[0]])) \
+                    + site[2:]
+            except KeyError:
+                pass
+            sites.append(site)
+        other.sites = sites
+        return other
+
+    def _message(self, site):
+        file, line, row, mode, msg, flag = site
+        s = self.src + file + ':' + str(line) + ':'
+        if row is not None:
+            s += str(row) + ':'
+        s += ' ' + mode + ': ' + msg
+        if flag:
+            s += ' [' + flag + ']'
+        return s
+
+    def __iter__(self):
+        rnd = random.Random(self.seed + 1000)
+        arch = self.arch
+        mix = self.mix
+        sites = iter(self.sites)
+        p_msg = mix['warning'] + mix['error']
+        p_jam = p_msg + mix['jam']
+        p_messed = p_jam + mix['messed']
+        p_context = p_messed + mix['context']
+        yield '...patience...'
+        yield '...found ' + str(self.lines * 3) + ' target(s)...'
+        yield '...updating ' + str(self.lines // 2) + ' target(s)...'
+        n = 3
+        pending = None
+        while n < self.lines - 2:
+            r = rnd.random()
+            name = rnd.choice(_NAMES)
+            if r < p_msg:
+                try:
+                    site = next(sites)
+                except StopIteration:
+                    continue
+                if rnd.random() < 0.5:
+                    yield (self.src + site[0] + ": In function '"
+                        + name + "':")
+                    n += 1
+                line = self._message(site)
+                if pending:
+                    # Output from two processes in the same line
+                    cut = rnd.randint(1, len(pending) - 1)
+                    line = pending[:cut] + line
+                    pending = None
+                yield line
+                if site[3] == 'error' and rnd.random() < 0.5:
+                    yield ('...failed C++ objects/haiku/' + arch
+                        + '/release/' + site[0].rsplit('.', 1)[0] + '.o ...')
+                    n += 1
+            elif r < p_jam:
+                yield rnd.choice(_JAM_MESSAGES).format(arch=arch, name=name)
+            elif r < p_messed:
+                pending = rnd.choice(_NOISE).format(arch=arch,
+                    dir=rnd.choice(_DIRS), name=name)
+                continue
+            elif r < p_context:
+                yield rnd.choice((
+                    '  {l} |     {name} = {name} + 1;',
+                    '      |     ^~~~~~',
+                    self.src + '{file}:{l}:{r}: note: declared here',
+                    self.src + '{file}: At top level:',
+                    'In file included from ' + self.src + '{file}:{l}:',
+                )).format(l=rnd.randint(1, 3000), r=rnd.randint(1, 60),
+                    name=name, file=rnd.choice(self.files))
+            elif r < p_context + 0.001:
+                yield name.lower() + '.hpkg: Creating the package ...'
+            else:
+                yield rnd.choice(_NOISE).format(arch=arch,
+                    dir=rnd.choice(_DIRS), name=name)
+            n += 1
+        yield '...updated ' + str(self.lines // 2) + ' target(s)...'
+        yield ''
@@ -2,27 +2,37 @@ import git
 import html
 import json
 import os
-from os.path import exists, join, relpath, split
-from shutil import copy, move, rmtree
-import stat
+from os.path import dirname, exists, join, relpath, split
+from shutil import copy, rmtree
 import subprocess
 import sys
 import time
 
-from archive import archive
+from archive import git_archive
+import artifacts
 import buildtools
 import chain
 from config import config
 import db
 import gitutils
+import imagestore
 from jam import jam
 import log_analysis
+import logpage
+import msgcatalog
+import msghistory
+import msgtree
 import paths
+from patchmap import PatchMap
+import predictor
+import rawlog
 import subprocess_wrapper
+import timing
 
 
-__all__ = ('update_release', 'build_change', 'changeset_branch_name',
-    'remove_done_changes', 'mrproper')
+__all__ = ('pending_release', 'build_release', 'update_release',
+    'build_change', 'changeset_branch_name', 'remove_done_changes',
+    'mrproper')
 
 
 BRANCH_BASE = config['branch_base']
@@ -67,7 +77,8 @@ def build(arch, tag):
     remove_emulated_attributes()
     path = paths.build(arch)
     os.makedirs(path, exist_ok=True)
-    paths.clean_up(path)
+    with timing.span('clean_up'):
+        paths.clean_up(path)
 
     # Some time measurements:
     # Command line, with everything from last build:
@@ -78,23 +89,20 @@ def build(arch, tag):
     #   real 2m12s, user 1m9s, sys  0m25s
     # Program (rmtree objects, remove images): 8m30s (7m7s for gcc2h)
 
-    if not exists(join(path, 'build', 'BuildConfig')):
-        configure_build(path, arch)
-    else:
-        configure_build_update(path)
+    with timing.span('configure'):
+        if not exists(join(path, 'build', 'BuildConfig')):
+            configure_build(path, arch)
+        else:
+            configure_build_update(path)
 
     options = ['-sHAIKU_REVISION='+tag,
         '-sHAIKU_BUILD_ATTRIBUTES_DIR='+paths.emulated_attributes()]
     options.extend(config['arches'][arch]['jam_options'])
-    res, fname = jam(path, config['arches'][arch]['target'], options,
-        jam_cmd=paths.jam(), output=join(path, 'build.out'))
+    with timing.span('jam'):
+        res, fname = jam(path, config['arches'][arch]['target'], options,
+            jam_cmd=paths.jam(), output=join(path, 'build.out'))
     remove_emulated_attributes()
-    with open(fname, 'rt') as logf:
-        log = logf.read().split('\n')
-    PT = log_analysis.PathTransformer()
-    for i, s in enumerate(PT.transform(log)):
-        log[i] = s
-    return res.returncode == 0, log
+    return res.returncode == 0, fname
 
 
 def remove_emulated_attributes():
@@ -111,20 +119,37 @@ def _get_msgs(tag, arch):
         return _MASTER_MSGS[arch]
     except KeyError:
         try:
-            with open(join(paths.www_release(config['branch'], tag, arch),
-                    'build-messages.json'), 'rt') as f:
-                _MASTER_MSGS[arch] = json.load(f)
+            _MASTER_MSGS[arch] = msgcatalog.load_messages(join(
+                paths.www_release(config['branch'], tag, arch),
+                'build-messages.json'))
         except Exception:
             _MASTER_MSGS[arch] = None
         return _MASTER_MSGS[arch]
 
 
+_PATCH_MAP = None
+def _get_patch_map(build_dir):
+    global _PATCH_MAP
+    if (not _PATCH_MAP) or _PATCH_MAP[0] != build_dir:
+        _PATCH_MAP = (build_dir, PatchMap(join(build_dir, 'patches')))
+    return _PATCH_MAP[1]
+
+
 # TODO: keep modifications in sync with reextract.py:_process_build
-def _process_build(src, dst, log, title, linker, parent, result, arch):
+def _process_build(src, dst, logfile, title, link, parent, result, arch,
+        release=None, picked=False):
     arch_data = result[arch]
 
-    result = log_analysis.analyse(log)
+    with timing.span('rawlog'):
+        rawlog.store(logfile, dst)
+    with timing.span('analyse'):
+        result = log_analysis.analyse_file(logfile)
+    arch_data['analysis'] = log_analysis.VERSION
     arch_data['message'] = result['failures']
+    msg_ids = [0] * len(result['messages'])
+    for k, v in result['messages'].items():
+        msg_ids[v] = msgcatalog.intern(k)
+    del result['messages']
     msg_refs = {'warnings': [], 'errors': []}
     for k in ('warnings', 'errors'):
         arch_data[k] = sum(len(v) for v in result[k].values())
@@ -132,8 +157,14 @@ def _process_build(src, dst, log, title, linker, parent, result, arch):
             for i, v in enumerate(msgs):
                 lf, ls, msg = v
                 msg_refs[k].append(lf)
-                msgs[i] = (0, lf, ls, msg)
-    result['files'] = ['buildlog.html']
+                msgs[i] = (0, lf, ls, msg_ids[msg])
+    for msgs in result['full'].values():
+        for i, v in enumerate(msgs):
+            lf, ls, msg = v
+            msgs[i] = (lf, ls, msgcatalog.intern(msg))
+    result['files'] = [logpage.PAGE]
+    if not logpage.writes_page(picked):
+        result['pages'] = rawlog.FRAME_LINES
 
     title = html.escape(title, quote=True)
     lead_items = ['<h1>', title, '</h1>\n<p>',
@@ -144,8 +175,12 @@ def _process_build(src, dst, log, title, linker, parent, result, arch):
     if parent:
         old_msgs = _get_msgs(parent, arch)
         if old_msgs:
-            _, new_msgs = log_analysis.diff(old_msgs, result['full'])
+            patch_map = _get_patch_map(dirname(dst))
+            with timing.span('diff'):
+                _, new_msgs = log_analysis.diff(old_msgs, result['full'],
+                    patch_map.map if patch_map else None)
             if new_msgs:
+                msgcatalog.sync()
                 with open(join(dst, 'new-messages.json'), 'wt') as f:
                     json.dump(new_msgs, f)
         parent_result = db.data['release'][parent]['result']
@@ -155,107 +190,66 @@ def _process_build(src, dst, log, title, linker, parent, result, arch):
                 if delta:
                     lead_items[i] = ' (%+d)' % delta
                     lead_items[9] = '<br>\n(vs ' + parent + ')'
+    if new_msgs is None:
+        # Nothing to compare with, everything is new
+        log_analysis.mark_new(result, result['full'])
+    else:
+        log_analysis.mark_new(result, new_msgs)
     lead = ''.join(lead_items)
-    css = paths.link_root() + '/css/log.css'
-
-    def write_log(log, dst, body, line_msgs):
-        with open(dst, 'wt') as fout:
-            fout.write('<!DOCTYPE html>\n<html><head>'
-                '<meta charset="utf-8" />\n<title>')
-            fout.write(title)
-            fout.write('</title>\n<link rel="stylesheet" href="')
-            fout.write(css)
-            fout.write('" />\n</head><body>\n')
-            fout.write(lead)
-
-            def write_msg_item(file, line, logline, msg):
-                if line:
-                    line = str(line)
-                    fout.write(' <li><samp><a href="')
-                    fout.write(linker(file, line))
-                    fout.write('">')
-                    fout.write(html.escape(file))
-                    fout.write(':' + line + '</a>: ')
-                else:
-                    fout.write(' <li><samp>')
-                    fout.write(html.escape(file))
-                    fout.write(': ')
-                fout.write('<a href="#n' + str(logline) + '">')
-                fout.write(html.escape(msg))
-                fout.write('</a></samp></li>\n')
-
-            if new_msgs:
-                fout.write('<h2>New messages</h2>\n<ul>\n')
-                for file, msgs in sorted(new_msgs.items()):
-                    for msg in msgs:
-                        write_msg_item(file, msg[1], msg[0], msg[2])
-                fout.write('</ul></pre>\n')
-
-            if result['errors']:
-                fout.write('\n<h2>Errors</h2>\n<ul>\n')
-                for file, msgs in sorted(result['errors'].items()):
-                    for msg in msgs:
-                        write_msg_item(file, msg[2], msg[1], messages[msg[3]])
-                fout.write('</ul></pre>\n')
-
-            fout.write('\n<h2>Log</h2>')
-            body(log, fout, file_linker=linker, line_msgs=line_msgs)
-            fout.write('\n</body></html>')
-
-    m = 0
-    for k in ('warnings', 'errors'):
-        try:
-            m = max(max(msg_refs[k]), m)
-        except ValueError:
-            pass
-    line_msgs = [0] * (m + 1)
-    for k, v in (('warnings', 1), ('errors', 2)):
-        for i in msg_refs[k]:
-            line_msgs[i] = v
-
-    messages = [''] * (max(result['messages'].values()) + 1)
-    for k, v in result['messages'].items():
-        messages[v] = k
-    result['messages'] = messages
 
-    write_log(log, join(dst, 'buildlog.html'), log_analysis.htmlout, line_msgs)
+    with timing.span('html'), open(logfile, 'rt') as f:
+        logpage.write(dst, log_analysis.PathTransformer().transform(
+            rawlog.text_lines(f)), {'title': title,
+            'top': logpage.top(lead, new_msgs, result['errors'],
+                logpage.linker(link)),
+            'link': link, 'warnings': msg_refs['warnings'],
+            'errors': msg_refs['errors']}, picked)
 
     if config['arches'][arch]['save_artifacts']:
-        pkgs = set(result['packages'])
-        obj_dir = join(src, 'objects', 'haiku')
-        for entry in os.scandir(obj_dir):
-            if entry.is_dir():
-                pkg_dir = join(obj_dir, entry.name, 'packaging', 'packages')
-                if exists(pkg_dir):
-                    for f in os.listdir(pkg_dir):
-                        # TODO: may have disappeared
-                        move(join(pkg_dir, f), dst)
-                        try:
-                            pkgs.remove(f)
-                        except KeyError:
-                            print('PKGGET UNEXPECTED', pkg_dir, f, file=sys.stderr)
-        for pkg in pkgs:
-            print('PKGGET NOTFOUND', pkg, file=sys.stderr)
-
-        # Maybe x86_64/objects/haiku/x86_64/release/system/boot/efi/{haiku_loader.efi,boot_loader_efi}
-        # gcc2h does not have efi.map and esp.image
-        for f in ('esp.image', 'haiku-nightly-anyboot.iso', 'haiku-mmc.image'):
-            try:
-                f = join(src, f)
-                os.chmod(f, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
-                move(f, dst)
-            except FileNotFoundError:
-                pass
+        with timing.span('artifacts'):
+            pkgs = set(result['packages'])
+            obj_dir = join(src, 'objects', 'haiku')
+            for entry in os.scandir(obj_dir):
+                if entry.is_dir():
+                    pkg_dir = join(obj_dir, entry.name, 'packaging', 'packages')
+                    if exists(pkg_dir):
+                        for f in os.listdir(pkg_dir):
+                            # TODO: may have disappeared
+                            artifacts.store(join(pkg_dir, f), dst)
+                            try:
+                                pkgs.remove(f)
+                            except KeyError:
+                                print('PKGGET UNEXPECTED', pkg_dir, f, file=sys.stderr)
+            for pkg in pkgs:
+                print('PKGGET NOTFOUND', pkg, file=sys.stderr)
+
+            # Maybe x86_64/objects/haiku/x86_64/release/system/boot/efi/{haiku_loader.efi,boot_loader_efi}
+            # gcc2h does not have efi.map and esp.image
+            for f in ('esp.image', 'haiku-nightly-anyboot.iso', 'haiku-mmc.image'):
+                try:
+                    if config['arches'][arch]['chunk_images']:
+                        imagestore.store(join(src, f), dst)
+                    else:
+                        artifacts.store(join(src, f), dst)
+                except FileNotFoundError:
+                    pass
 
     result['packages'] = list(result['packages'])
 
+    msgcatalog.sync()
     with open(join(dst, 'build-messages.json'), 'wt') as f:
         json.dump(result['full'], f)
+    if release:
+        msghistory.record(release, arch, result)
     del result['full']
 
+    with timing.span('msgtree'):
+        arch_data['tree'] = msgtree.write(dst, result)
     with open(join(dst, 'build-result.json'), 'wt') as f:
         json.dump(result, f)
 
+    arch_data['size'] = paths.bytes_used(dst)
+
 
 def _fill_empty_results(d=None):
     if d is None:
@@ -303,37 +297,66 @@ def build_release():
         # - keep what was built
         data_master = db.data['release'][old_tag]
 
+    src_archived = None
     if config['archive_src']:
         for f in os.listdir(dst):
-            if f.startswith('src.'):
-                # don't archive again, it takes some time
+            if f.startswith('src.') and not f.endswith('.tmp'):
+                # don't archive again
                 break
         else:
-            archive(dst, config['branch'], tag, '')
+            src_archived = git_archive(dst, commit.hexsha, config['branch'],
+                tag, '')
 
     for arch in config['arches'].keys():
-        if data_master['result'][arch]['ok'] is None:
-            data_master['result'][arch]['ok'], log = build(arch, tag)
-            build_dst = paths.www_release(config['branch'], tag, arch)
-            os.makedirs(build_dst, exist_ok=True)
-            _process_build(paths.build(arch), build_dst, log,
-                config['branch'] + ': ' + tag + ' [' + arch + ']',
-                log_analysis.file_link_release(tag),
-                data_master['parent'], data_master['result'], arch)
+        arch_data = data_master['result'][arch]
+        if arch_data['ok'] is None:
+            cold = predictor.is_cold(arch)
+            with timing.record(arch_data.setdefault('timing', {})):
+                arch_data['ok'], logfile = build(arch, tag)
+                build_dst = paths.www_release(config['branch'], tag, arch)
+                os.makedirs(build_dst, exist_ok=True)
+                _process_build(paths.build(arch), build_dst, logfile,
+                    config['branch'] + ': ' + tag + ' [' + arch + ']',
+                    ('release', tag),
+                    data_master['parent'], data_master['result'], arch,
+                    release=tag)
+            predictor.learn(arch, 'release', cold,
+                sum(arch_data['timing'].values()))
             db.save()
+            msghistory.export()
+
+    if src_archived is not None:
+        with timing.record(data_master.setdefault('timing', {})):
+            with timing.span('archive'):
+                src_archived()
+        data_master['result']['*']['size'] = {'src': sum(
+            paths.file_bytes(join(dst, f)) for f in os.listdir(dst)
+                if f.startswith('src.'))}
+        db.save()
 
 
-def update_release():
+def pending_release():
+    """Fetch, and tell which arches of the release are still to be built."""
     base = REPO.heads[BRANCH_BASE]
     remote_branch = base.tracking_branch()
-    REPO.remotes[remote_branch.remote_name].fetch(
-        remote_branch.remote_head, tags=True)
+    with timing.span('fetch'):
+        REPO.remotes[remote_branch.remote_name].fetch(
+            remote_branch.remote_head, tags=True)
     commit = remote_branch.commit
     last = db.data['current']
-    if ((not last) or db.data['release'][last]['commit'] != commit.hexsha
-            or None in (a['ok'] for a in
-                db.data['release'][last]['result'].values())):
+    if (not last) or db.data['release'][last]['commit'] != commit.hexsha:
         base.set_commit(commit)
+        return list(config['arches'].keys())
+    result = db.data['release'][last]['result']
+    pending = [arch for arch, a in result.items()
+        if arch != '*' and a['ok'] is None]
+    if pending:
+        base.set_commit(commit)
+    return pending
+
+
+def update_release():
+    if pending_release():
         build_release()
         return True
     return False
@@ -354,13 +377,18 @@ def _build_change(change, build_data, rebased):
 
     for arch in config['arches'].keys():
         if result[arch]['ok'] is None:
-            result[arch]['ok'], log = build(arch, tag)
-            build_dst = paths.www(change, build_data, arch, rebased)
-            os.makedirs(build_dst, exist_ok=True)
-            _process_build(paths.build(arch), build_dst, log,
-                cid + ' v' + version + ' on ' + parent + ' [' + arch + ']',
-                log_analysis.file_link_change(legacy_id, version),
-                parent, result, arch)
+            cold = predictor.is_cold(arch)
+            with timing.record(result[arch].setdefault('timing', {})):
+                result[arch]['ok'], logfile = build(arch, tag)
+                build_dst = paths.www(change, build_data, arch, rebased)
+                os.makedirs(build_dst, exist_ok=True)
+                _process_build(paths.build(arch), build_dst, logfile,
+                    cid + ' v' + version + ' on ' + parent + ' [' + arch
+                        + ']',
+                    ('change', legacy_id, version),
+                    parent, result, arch, picked=not rebased)
+            predictor.learn(arch, 'change', cold,
+                sum(result[arch]['timing'].values()))
             db.save()
 
 
@@ -378,6 +406,7 @@ def build_change(change):
         'version': change['version'],
         'time': int(time.time()),
         'logs_only': False,
+        'timing': {},
         'rebased': _fill_empty_results(),
         'picked': {}
     }
@@ -392,8 +421,16 @@ def build_change(change):
         os.makedirs(patches_dir, exist_ok=True)
         os.symlink(relpath(paths.www_release(config['branch'], parent, None),
             start=dst), join(dst, 'baseline'))
-        patches = gitutils.format_patch(REPO, parent + '..' + commit.hexsha,
-            patches_dir)
+        with timing.span('format_patch'):
+            patches = gitutils.format_patch(REPO,
+                parent + '..' + commit.hexsha, patches_dir)
+        size = {'patches': paths.tree_bytes(patches_dir)}
+        build_data['picked' if cherry else 'rebased']['*']['size'] = size
+        src_archived = None
+        if config['archive_change_src']:
+            # Otherwise the sources are the baseline ones plus the patches
+            src_archived = git_archive(dst, commit.hexsha, cid,
+                str(build_data['version']), parent, not cherry)
 
         rolling_branch = REPO.branches[BRANCH_ROLLING]
         REPO.head.ref = rolling_branch
@@ -402,6 +439,12 @@ def build_change(change):
         rolling_branch.set_commit(commit)
         rolling_branch.checkout(force=True)
         _build_change(change, build_data, not cherry)
+        if src_archived is not None:
+            with timing.span('archive'):
+                archived = src_archived()
+            if archived:
+                size['src'] = paths.file_bytes(join(dst, 'src.tar.xz'))
+                db.save()
         #except git.exc.GitCommandError:
 
         REPO.head.ref = rolling_branch
@@ -434,20 +477,25 @@ def build_change(change):
             db.save()
             _build(commit, cherry)
 
-    rebase, conflicts, conflicting_cid = change.rebase()
-    _do(rebase, conflicts, conflicting_cid, False)
+    with timing.record(build_data['timing']):
+        with timing.span('rebase'):
+            rebase, conflicts, conflicting_cid = change.rebase()
+        _do(rebase, conflicts, conflicting_cid, False)
 
-    pick, conflicts = change.pick()
-    if rebase and pick == rebase:
-        return
-    _fill_empty_results(build_data['picked'])
-    _do(pick, conflicts, None, True)
+        with timing.span('pick'):
+            pick, conflicts = change.pick()
+        if rebase and pick == rebase:
+            return
+        _fill_empty_results(build_data['picked'])
+        _do(pick, conflicts, None, True)
 
 
-def remove_done_changes(cids):
+def remove_done_changes(cids, sizes=None):
+    if sizes is None:
+        sizes = {}
     for cid in cids:
         del db.data['done'][cid]
-        paths.delete_change(cid)
+        paths.delete_change(cid, sizes.get(cid))
         remove = []
         prefix = changeset_branch_name(cid, '')
         for branch in REPO.branches:
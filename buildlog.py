@@ -0,0 +1,80 @@
+#! /usr/bin/python
+
+# Render the log page of a build written without html_logs (see logpage.py).
+#   buildlog.py path/to/build/arch [line] [output]
+# Also works as a CGI script or a WSGI application (application()), with the
+# build path below www_root as PATH_INFO, with or without /buildlog.html, and
+# n=line in the query string for only the block of lines with it.
+
+import os
+from os.path import join, normpath
+import sys
+from urllib.parse import parse_qs
+
+import logpage
+import paths
+import rawlog
+
+
+def _build_dir(environ):
+    path = normpath(environ.get('PATH_INFO', '/')).lstrip('/')
+    if path.startswith('.'):
+        path = ''
+    if path.endswith('/' + logpage.PAGE):
+        path = path[:-len(logpage.PAGE) - 1]
+    dst = join(paths.www_root(), path)
+    if not (logpage.has_index(dst) and rawlog.has_log(dst)):
+        return None
+    return dst
+
+
+def _line(environ):
+    try:
+        return int(parse_qs(environ.get('QUERY_STRING', ''))['n'][0])
+    except (KeyError, ValueError):
+        return None
+
+
+def application(environ, start_response):
+    dst = _build_dir(environ)
+    if dst is None:
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        return [b'Not found\n']
+    start_response('200 OK', [('Content-Type', 'text/html; charset=utf-8')])
+    return (s.encode('utf-8') for s in logpage.render(dst, _line(environ)))
+
+
+def cgi():
+    out = sys.stdout.buffer
+    dst = _build_dir(os.environ)
+    if dst is None:
+        out.write(b'Status: 404 Not Found\r\nContent-Type: text/plain\r\n\r\n'
+            b'Not found\n')
+        return
+    out.write(b'Content-Type: text/html; charset=utf-8\r\n\r\n')
+    for s in logpage.render(dst, _line(os.environ)):
+        out.write(s.encode('utf-8'))
+
+
+def write(dst, line, out):
+    for s in logpage.render(dst, line):
+        out.write(s)
+
+
+def main():
+    if 'GATEWAY_INTERFACE' in os.environ:
+        cgi()
+    elif len(sys.argv) not in (2, 3, 4):
+        print('Usage:', sys.argv[0], 'build [line] [output]', file=sys.stderr)
+        sys.exit(2)
+    else:
+        line = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2] else None
+        if len(sys.argv) == 4:
+            with open(sys.argv[3], 'wt') as out:
+                write(sys.argv[1], line, out)
+        else:
+            write(sys.argv[1], line, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
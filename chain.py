@@ -414,6 +414,6 @@ def delete_obsolete_branches(keep=10):
     else:
         for _, obsolete in index.values():
             delete.extend(obsolete)
-    if obsolete:
-        REPO.delete_head(*obsolete, force=True)
+    if delete:
+        REPO.delete_head(*delete, force=True)
 
@@ -19,7 +19,10 @@ db_master.intersection_update(f_master)
 db_cid = set(db.data['change'].keys())
 db_cid.update(db.data['done'].keys())
 f_cid = set(os.listdir(paths.www_root()))
-f_cid.difference_update({'release', 'builds.json', 'index.html', 'js', 'css', 'assets'})
+f_cid.difference_update({'release', 'builds.json', 'index.html', 'js', 'css', 'assets',
+    'messages.jsonl', 'message-history.sqlite', 'message-history.json', '.trash', '.pool',
+    '.chunks', 'summary', 'static', '.logcache', 'releases.html', 'done.html'})
+f_cid = set(f for f in f_cid if not f.endswith('.html'))
 
 for r in db_cid.difference(f_cid):
     print("cid with no file: ", r)
@@ -27,6 +27,17 @@ for name in ('keep_done_pressure', 'keep_done'):
 
 for name in ('archive_src',):
     config[name] = ini['Builder'].getboolean(name)
+config['archive_change_src'] = ini['Builder'].getboolean('archive_change_src',
+    False)
+
+# Not in older config.ini files
+config['trash_jobs'] = ini['Builder'].getint('trash_jobs', 2)
+config['html_logs'] = ini['Builder'].getboolean('html_logs', True)
+config['html_logs_picked'] = ini['Builder'].getboolean('html_logs_picked',
+    False)
+config['log_cache'] = ini['Builder'].get('log_cache',
+    config['www_root'] + '/.logcache')
+config['log_cache_size'] = ini['Builder'].getint('log_cache_size', 500000000)
 
 config['arches'] = {}
 for name in ini.sections():
@@ -37,6 +48,7 @@ for name in ini.sections():
     job = dict(ini[name])
     for optname in ('save_artifacts',):
         job[optname] = ini[name].getboolean(optname)
+    job['chunk_images'] = ini[name].getboolean('chunk_images', False)
     # TODO: quoted spaces
     job['jam_options'] = job['jam_options'].split()
     config['arches'][job['arch']] = job
@@ -6,6 +6,7 @@ import time
 
 import gerrit
 import paths
+import publish
 
 
 __all__ = ('data', 'load', 'save', 'set_change_done',
@@ -98,20 +99,93 @@ class Change(dict):
             return None
 
     def broken_for(self, job):
-        # TODO: probably unnecessary, and we are using db.data
-        try:
-            broken = [0] * (self['version'] + 1)
+        last_ok, broken, total = self.streak(job)
+        if broken is None:
+            return None, None
+        if last_ok is not None:
             for build in reversed(self['build']):
-                if (build['rebased'][job]['ok']
-                        or (build['picked'] and build['picked'][job]['ok'])):
-                    return build, broken
-                elif data['release'][build['parent']]['result'][job]['ok']:
-                    # TODO: maybe only count None if the prev real build is False?
-                    broken[build['version']] += 1
-            return None, broken
+                if build['time'] == last_ok:
+                    last_ok = build
+                    break
+        counts = [0] * (self['version'] + 1)
+        for version, n in self._streak_counts(job).items():
+            counts[int(version)] += n
+        return last_ok, counts
+
+    def streak(self, job):
+        """Builds broken for job since the last good one.
+
+        Returns the time of the last good build (None if none), the count
+        for the current version and the total count. Counts are None if some
+        build has no result for job. Only builds where the release they are
+        based on was fine for job are counted.
+        """
+        state = self._streak_state(job, self._fold_streak())
+        if state['error']:
+            return state['last_ok'], None, None
+        return (state['last_ok'], state['broken'].get(str(self['version']), 0),
+            sum(state['broken'].values()))
+
+    def _streak_counts(self, job):
+        return self._streak_state(job, self._fold_streak())['broken']
+
+    @staticmethod
+    def _streak_step(state, build, job):
+        try:
+            if (build['rebased'][job]['ok']
+                    or (build['picked'] and build['picked'][job]['ok'])):
+                return {'last_ok': build['time'], 'broken': {},
+                    'error': False}
+            elif data['release'][build['parent']]['result'][job]['ok']:
+                # TODO: maybe only count None if the prev real build is False?
+                broken = dict(state['broken'])
+                version = str(build['version'])
+                broken[version] = broken.get(version, 0) + 1
+                return {'last_ok': state['last_ok'], 'broken': broken,
+                    'error': state['error']}
         except KeyError:
-            pass
-        return None, None
+            return {'last_ok': state['last_ok'], 'broken': state['broken'],
+                'error': True}
+        return state
+
+    def _fold_streak(self):
+        # All but the latest build, which may still be building, are folded
+        # into self['streak'] as they come. Anything else done to the build
+        # list (old builds removed) starts it again.
+        builds = self['build']
+        settled = len(builds) - 1
+        streak = self.get('streak')
+        if (streak is None or streak['n'] > settled
+                or (streak['n'] and builds[streak['n'] - 1]['time']
+                    != streak['time'])):
+            streak = {'n': 0, 'time': None, 'jobs': {}}
+        for build in builds[streak['n']:settled]:
+            jobs = streak['jobs']
+            for job in set(jobs).union(build['rebased']):
+                jobs[job] = self._streak_step(self._job_streak(streak, job),
+                    build, job)
+            streak['n'] += 1
+            streak['time'] = build['time']
+        self['streak'] = streak
+        return streak
+
+    @staticmethod
+    def _job_streak(streak, job):
+        try:
+            return streak['jobs'][job]
+        except KeyError:
+            # Not in the builds so far
+            return _NO_STREAK_ERROR if streak['n'] else _NO_STREAK
+
+    def _streak_state(self, job, streak):
+        state = self._job_streak(streak, job)
+        if len(self['build']) > streak['n']:
+            state = self._streak_step(state, self['build'][-1], job)
+        return state
+
+
+_NO_STREAK = {'last_ok': None, 'broken': {}, 'error': False}
+_NO_STREAK_ERROR = {'last_ok': None, 'broken': {}, 'error': True}
 
 
 def load():
@@ -131,6 +205,7 @@ def save():
         f.flush()
         os.fsync(f.fileno())
     os.replace(_BACKUP, _DATAFILE)
+    publish.publish(data)
 
 
 def change(cid):
@@ -196,6 +271,7 @@ except FileNotFoundError:
     data = {
         'change': {},
         'queued': [],
+        'cycles': [],
         'done': {},
         'time': 0,
         'current': None,
@@ -215,16 +291,30 @@ except FileNotFoundError:
 #    tags[]
 #    review (code review numeric value)
 #    sent_review {...} last sent build report
+#    streak{}: broken_for() summary of all but the latest build
+#        n: builds in it
+#        time: time of the last one
+#        jobs{*/arch}:
+#            last_ok: time of the last good build
+#            broken{version}: broken builds since, with a good release
+#            error: some build has no result
 #    build[]:
 #        parent (hrev)
 #        version
 #        time
 #        logs_only: boolean, have we kept artifacts?
+#        timing{}: seconds per phase, including the arch builds
 #        rebased/picked{*(prepare)/x86_64/x86_gcc2h}:
 #            ok: result
 #            warnings: n
 #            errors: n
 #            message: optional error message
+#            tree: the msgtree.py tree file in the build directory, for arches
+#            analysis: log_analysis.VERSION used, for arches
+#            timing{}: seconds per phase (jam, analyse...), for arches
+#            size{}: bytes on disk
+#                artifacts (what clean_up removes), logs for arches
+#                patches/src for *
 #
 #queued[cid]
 #
@@ -239,4 +329,13 @@ except FileNotFoundError:
 #    title (subject)
 #    time (build)
 #    result{}: result per arch
+#    timing{}: seconds per phase not in an arch build
+#
+#eta{cid}: [estimated start, estimated seconds] for the queued ones
+#durations{arch}{release/change[-cold]}: average build seconds
+#
+#cycles[]: last runs
+#    start, end
+#    builds: n
+#    timing{}: seconds per phase, total
 #
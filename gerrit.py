@@ -54,19 +54,17 @@ class Branch:
             query = query + ' is:open'
 
         url = self.repo.baseURL + 'changes/'
-        before = None
+        start = 0
         get_more = True
         while get_more:
-            q = query
-            if before:
-                q = q + ' before:"' + before + '"'
-            r = self.repo.session.get(url, params={'q': q, 'pp': 0, 'o': [
-                'CURRENT_REVISION', 'SKIP_MERGEABLE', 'SKIP_DIFFSTAT',
-                'LABELS']})
+            r = self.repo.session.get(url, params={'q': query, 'pp': 0,
+                'S': start, 'o': ['CURRENT_REVISION', 'SKIP_MERGEABLE',
+                'SKIP_DIFFSTAT', 'LABELS']})
             changes = extract_json(r)
 
             if not changes:
                 break
+            start += len(changes)
 
             last = changes[-1]
             try:
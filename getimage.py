@@ -0,0 +1,52 @@
+#! /usr/bin/python
+
+# Put together an image saved as chunks.
+#   getimage.py path/to/haiku-nightly-anyboot.iso.chunks [output]
+# Also works as a CGI script, with the recipe path below www_root as
+# PATH_INFO, with or without the .chunks extension.
+
+import os
+from os.path import basename, join, normpath
+import sys
+
+import imagestore
+import paths
+
+
+def write(recipe, out):
+    for data in imagestore.read(recipe):
+        out.write(data)
+
+
+def cgi():
+    path = normpath(os.environ.get('PATH_INFO', '/')).lstrip('/')
+    if path.startswith('.'):
+        path = ''
+    if not path.endswith(imagestore.RECIPE_EXT):
+        path += imagestore.RECIPE_EXT
+    recipe = join(paths.www_root(), path)
+    out = sys.stdout.buffer
+    try:
+        size = imagestore.size(recipe)
+    except (FileNotFoundError, IsADirectoryError):
+        out.write(b'Status: 404 Not Found\r\nContent-Type: text/plain\r\n\r\n'
+            b'Not found\n')
+        return
+    name = basename(recipe)[:-len(imagestore.RECIPE_EXT)]
+    out.write('Content-Type: application/octet-stream\r\n'
+        'Content-Length: {}\r\n'
+        'Content-Disposition: attachment; filename="{}"\r\n\r\n'.format(
+            size, name).encode())
+    write(recipe, out)
+
+
+if 'GATEWAY_INTERFACE' in os.environ:
+    cgi()
+elif len(sys.argv) not in (2, 3):
+    print('Usage:', sys.argv[0], 'recipe [output]', file=sys.stderr)
+    sys.exit(2)
+elif len(sys.argv) == 3:
+    with open(sys.argv[2], 'wb') as out:
+        write(sys.argv[1], out)
+else:
+    write(sys.argv[1], sys.stdout.buffer)
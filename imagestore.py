@@ -0,0 +1,98 @@
+from glob import iglob
+import hashlib
+import json
+import os
+from os.path import basename, dirname, exists, join
+
+import paths
+import trash
+
+
+__all__ = ('store', 'read', 'size', 'gc', 'RECIPE_EXT')
+
+
+# Boot images are mostly the same filesystem blocks from one build to the
+# next, at the same offsets. They are stored as a list of fixed size chunks,
+# each unique chunk once, and put together again when downloaded. Each chunk
+# counts for the build that stored it first: removing that one frees less
+# when later builds still use its chunks, but the ones it shares with
+# earlier builds are not counted again.
+_CHUNKS = join(paths.www_root(), '.chunks')
+CHUNK_SIZE = 64 * 1024
+RECIPE_EXT = '.chunks'
+
+
+def _chunk_path(digest):
+    return join(_CHUNKS, digest[:2], digest[2:])
+
+
+def store(src, dst):
+    """Move the image src to the directory dst as a recipe of chunks.
+
+    Returns the bytes of the chunks it added, recorded in the recipe as
+    'stored': those are counted as the build's (paths.bytes_used()).
+    """
+    chunks = []
+    whole = hashlib.sha256()
+    size = 0
+    stored = 0
+    with open(src, 'rb') as f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            whole.update(data)
+            size += len(data)
+            digest = hashlib.sha256(data).hexdigest()
+            path = _chunk_path(digest)
+            if not exists(path):
+                os.makedirs(dirname(path), exist_ok=True)
+                with open(path + '.tmp', 'wb') as out:
+                    out.write(data)
+                os.replace(path + '.tmp', path)
+                stored += os.stat(path).st_blocks * 512
+            chunks.append(digest)
+    recipe = join(dst, basename(src) + RECIPE_EXT)
+    with open(recipe + '.tmp', 'wt') as f:
+        json.dump({'size': size, 'sha256': whole.hexdigest(),
+            'chunk_size': CHUNK_SIZE, 'stored': stored, 'chunks': chunks}, f)
+    os.replace(recipe + '.tmp', recipe)
+    os.remove(src)
+    return stored
+
+
+def read(recipe):
+    """Contents of the image, by chunks."""
+    with open(recipe, 'rt') as f:
+        data = json.load(f)
+    for digest in data['chunks']:
+        with open(_chunk_path(digest), 'rb') as f:
+            yield f.read()
+
+
+def size(recipe):
+    with open(recipe, 'rt') as f:
+        return json.load(f)['size']
+
+
+def gc():
+    """Remove the chunks no recipe uses. Returns the bytes freed."""
+    used = set()
+    # www_root/{cid/version/master,release/branch/tag}/arch/
+    for recipe in iglob(join(paths.www_root(), '*', '*', '*', '*',
+            '*' + RECIPE_EXT)):
+        with open(recipe, 'rt') as f:
+            used.update(json.load(f)['chunks'])
+    names = []
+    freed = 0
+    try:
+        subdirs = os.listdir(_CHUNKS)
+    except FileNotFoundError:
+        return 0
+    for d in subdirs:
+        for entry in os.scandir(join(_CHUNKS, d)):
+            if d + entry.name not in used:
+                names.append(entry.path)
+                freed += entry.stat(follow_symlinks=False).st_blocks * 512
+    trash.discard(*names, size=freed)
+    return freed
@@ -1,5 +1,7 @@
-from collections import defaultdict
+from collections import Counter, defaultdict
+from heapq import heapify, heappop, heappush
 import html
+import mmap
 import os
 from os.path import dirname, normpath, relpath
 import re
@@ -8,8 +10,13 @@ from config import config
 import paths
 
 
-__all__ = ('analyse', 'htmlout', 'file_link_release', 'file_link_change',
-    'PathTransformer', 'diff')
+__all__ = ('analyse', 'analyse_file', 'htmlout', 'file_link_release', 'file_link_change',
+    'PathTransformer', 'diff', 'mark_new', 'VERSION')
+
+
+# Of what analyse() and the rest make of a log, recorded with each build.
+# Bump it when they change: reextract.py redoes the builds with an older one.
+VERSION = 1
 
 
 
@@ -35,6 +42,17 @@ RE_NOTICE = re.compile(r'\b(warning|(?:fatal )error|error)\s*:.*',
 # Should be good enough for this
 RE_URL = re.compile(r'\b\w+://[\w\./-]*\b')
 
+# Something itemize() looks for, to find the lines of a file worth decoding.
+# None has a '/', so the paths PathTransformer replaces with '/s', '/b' or
+# '/t' cannot make a line match that did not.
+RE_CANDIDATE = re.compile(rb' error: |warning: |yntax error|:\d*:'
+    rb"|collect2: |Warning: couldn't |build-feature packages unavailable"
+    rb"|AddHaikuImagePackages: package|\.\.\.failed |\.\.\.can't "
+    rb"|don't know how to|ERROR: |problem|failed: Connection timed out\."
+    rb'|\.hpkg: Creating the package \.\.\.')
+# Bytes of a file scanned at a time, to the end of a line
+_BLOCK = 1 << 20
+
 
 class PathTransformer():
     abs_src = paths.worktree()
@@ -183,7 +201,55 @@ def match_error_key(s):
 
 
 def itemize(f):
-    for lineno, line in enumerate(f, start=1):
+    return _itemize(enumerate(f, start=1))
+
+
+def _candidates(fname):
+    """Yield the lines of fname that RE_CANDIDATE finds something in.
+
+    As (line number, transformed line), with the lines as text mode reads
+    them. The file is mapped, not read.
+    """
+    PT = PathTransformer()
+    with open(fname, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty
+            return
+    with buf:
+        lineno = 1
+        start = 0
+        released = 0
+        while start < len(buf):
+            end = buf.find(b'\n', start + _BLOCK) + 1 or len(buf)
+            block = buf[start:end]
+            if b'\r' in block:
+                # As universal newlines
+                block = block.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+            counted = 0
+            m = RE_CANDIDATE.search(block)
+            while m:
+                begin = block.rfind(b'\n', 0, m.start()) + 1
+                stop = block.find(b'\n', m.end())
+                if stop < 0:
+                    stop = len(block)
+                lineno += block.count(b'\n', counted, begin)
+                counted = begin
+                yield lineno, PT.transform_line(
+                    block[begin:stop].decode('utf-8', 'replace'))
+                m = RE_CANDIDATE.search(block, stop + 1)
+            lineno += block.count(b'\n', counted)
+            # Not to keep the pages already scanned
+            done = end - end % mmap.PAGESIZE
+            if done > released:
+                buf.madvise(mmap.MADV_DONTNEED, released, done - released)
+                released = done
+            start = end
+
+
+def _itemize(lines):
+    for lineno, line in lines:
         #if line.startswith(file_prefix):
         if ' warning: ' in line or ' error: ' in line:
             match = RE_COMPILER_MSG.match(line)
@@ -314,13 +380,26 @@ def itemize(f):
 
 
 def analyse(log):
+    return _analyse(itemize(log))
+
+
+def analyse_file(fname):
+    """As analyse() for the lines of the file fname, transformed.
+
+    Only the lines with something that may be a message are decoded, so it
+    takes little memory for any size of log.
+    """
+    return _analyse(_itemize(_candidates(fname)))
+
+
+def _analyse(items):
     msg_key = defaultdict(lambda: len(msg_key))
     warnings = defaultdict(list)
     errors = defaultdict(list)
     full = defaultdict(list)
     failures = []
     pkgs = set()
-    for type, line, data in itemize(log):
+    for type, line, data in items:
         if type in ('WARN', 'ERR'):
             if type == 'WARN':
                 d = warnings
@@ -372,6 +451,8 @@ def htmlout(log, fout, anchor_prefix='n', lineno=1, file_linker=None,
         line_msgs=None):
     msg_name = [None, 'warning', 'error']
     msg_class = None
+    pkg_suffix = '.hpkg: Creating the package ...'
+    pkg_tail = ': Creating the package ...'
 
     def repl_notice(m):
         return ('<span class="' + m.group(1).lower() + '">'
@@ -381,14 +462,21 @@ def htmlout(log, fout, anchor_prefix='n', lineno=1, file_linker=None,
         return ('<a href="' + file_linker(m.group('file'), m.group('line'))
             + '">' + m.group(0) + '</a>')
 
-    fout.write('\n<pre><ol class="log">')
+    # The regexes only run on the lines that can match: RE_URL needs a
+    # '://', RE_SRCFILE a '/s/', and neither escaping nor the markup added
+    # before them makes one. The output goes out in large writes.
+    out = []
+    if lineno == 1:
+        out.append('\n<pre><ol class="log">')
+    else:
+        out.append('\n<pre><ol class="log" start="' + str(lineno) + '">')
     for line in log:
         line = html.escape(line, quote=True)
-        if line.endswith('.hpkg: Creating the package ...'):
-            pkg = line[:-len(': Creating the package ...')]
+        if line.endswith(pkg_suffix):
+            pkg = line[:-len(pkg_tail)]
             line = ('<a href="' + pkg + '" class="pkg">' + pkg + '</a>'
-                + ': Creating the package ...')
-        else:
+                + pkg_tail)
+        elif '://' in line:
             line = RE_URL.sub(r'<a href="\g<0>">\g<0></a>', line)
         if line_msgs:
             try:
@@ -401,52 +489,134 @@ def htmlout(log, fout, anchor_prefix='n', lineno=1, file_linker=None,
             except IndexError:
                 line_msgs = None
                 msg_class = None
-        if file_linker:
+        if file_linker and '/s/' in line:
             line = RE_SRCFILE.sub(repl_file, line)
         if msg_class:
-            fout.write(''.join(('\n<li><samp id="', anchor_prefix, str(lineno),
-                '" class="', msg_class, '">', line, '</samp>')))
+            out.append('\n<li><samp id="' + anchor_prefix + str(lineno)
+                + '" class="' + msg_class + '">' + line + '</samp>')
         else:
-            fout.write(''.join(('\n<li><samp id="', anchor_prefix, str(lineno),
-                '">', line, '</samp>')))
+            out.append('\n<li><samp id="' + anchor_prefix + str(lineno)
+                + '">' + line + '</samp>')
         lineno += 1
-    fout.write('\n</ol></pre>')
+        if len(out) >= 4096:
+            fout.write(''.join(out))
+            out.clear()
+    out.append('\n</ol></pre>')
+    fout.write(''.join(out))
+
+
+def _match_lines(old, new):
+    """Pair line numbers from both lists, closest pairs first.
+
+    Returns the indices of the items that were left without a pair.
+    """
+    items = sorted([(line, 0, i) for i, line in enumerate(old)]
+        + [(line, 1, i) for i, line in enumerate(new)])
+    n = len(items)
+    prev = list(range(-1, n - 1))
+    succ = list(range(1, n + 1))
+    # The closest pair of unmatched items from different lists is always
+    # made of neighbours among the unmatched ones
+    heap = [(items[i+1][0] - items[i][0], i, i + 1) for i in range(n - 1)
+        if items[i][1] != items[i+1][1]]
+    heapify(heap)
+    matched = [False] * n
+    while heap:
+        _, a, b = heappop(heap)
+        if matched[a] or matched[b]:
+            continue
+        matched[a] = matched[b] = True
+        p = prev[a]
+        s = succ[b]
+        if p >= 0:
+            succ[p] = s
+        if s < n:
+            prev[s] = p
+            if p >= 0 and items[p][1] != items[s][1]:
+                heappush(heap, (items[s][0] - items[p][0], p, s))
+    unmatched = ([], [])
+    for i, item in enumerate(items):
+        if not matched[i]:
+            unmatched[item[1]].append(item[2])
+    return unmatched
+
 
+def _move(msgs, moved):
+    result = defaultdict(list)
+    for file, file_msgs in msgs.items():
+        for msg in file_msgs:
+            new_file, line = moved(file, msg[1])
+            result[new_file].append((msg[0], line, msg[2]))
+    return result
 
-def diff(old, new):
+
+def diff(old, new, moved=None):
     # WARNING: they may be defaultdicts that we don't want to change (esp. new),
     # so no try except KeyError.
-    # TODO: use patch info for renames, line changes, etc
+    # moved(file, line) gives the position in new for those in old, so that
+    # renames and added or removed lines are not taken for new messages.
+    if moved:
+        old = _move(old, moved)
     removed = defaultdict(list)
     added = defaultdict(list)
-    oldmsgs = defaultdict(list)
-    newmsgs = defaultdict(list)
     for file, msgs in old.items():
-        if file in new:
-            oldmsgs.clear()
-            for msg in msgs:
-                oldmsgs[msg[2]].append(msg)
-            newmsgs.clear()
-            for msg in new[file]:
-                newmsgs[msg[2]].append(msg)
-            for k, v in newmsgs.items():
-                size = len(v)
-                oldsize = len(oldmsgs[k])
-                # As bad a choice as any other
-                if size > oldsize:
-                    for msg in v[:size-oldsize]:
-                        added[file].append(msg)
-                elif size < oldsize:
-                    for msg in oldmsgs[k][:oldsize-size]:
-                        removed[file].append(msg)
-                del oldmsgs[k]
-            for k, v in oldmsgs.items():
-                for msg in v[:size-oldsize]:
-                    removed[file].append(msg)
-        else:
-            removed[file] = msgs.copy()
+        if file not in new:
+            removed[file] = list(msgs)
+            continue
+        new_msgs = new[file]
+        old_count = Counter(msg[2] for msg in msgs)
+        new_count = Counter(msg[2] for msg in new_msgs)
+        changed = {k for k, n in new_count.items() if old_count[k] != n}
+        changed.update(k for k in old_count if k not in new_count)
+        if not changed:
+            continue
+        old_groups = defaultdict(list)
+        for msg in msgs:
+            if msg[2] in changed:
+                old_groups[msg[2]].append(msg)
+        new_groups = defaultdict(list)
+        for msg in new_msgs:
+            if msg[2] in changed:
+                new_groups[msg[2]].append(msg)
+        for k in changed:
+            o = old_groups[k]
+            n = new_groups[k]
+            if not o:
+                added[file].extend(n)
+            elif not n:
+                removed[file].extend(o)
+            else:
+                # As bad a choice as any other: the ones farthest from
+                # where they were
+                unmatched_old, unmatched_new = _match_lines(
+                    [msg[1] for msg in o], [msg[1] for msg in n])
+                removed[file].extend(o[i] for i in unmatched_old)
+                added[file].extend(n[i] for i in unmatched_new)
+        for d in (removed, added):
+            if file in d:
+                d[file].sort(key=lambda msg: msg[0])
     for file, msgs in new.items():
         if file not in old:
-            added[file] = msgs.copy()
+            added[file] = list(msgs)
     return removed, added
 
+
+def mark_new(result, added):
+    """Flag the messages in result that are in added (as given by diff()).
+
+    New messages get a fifth element set to 1.
+    """
+    for file, msgs in added.items():
+        new = {id(msg) for msg in msgs}
+        # Several messages may come from the same line, but always in order
+        flags = defaultdict(list)
+        for msg in reversed(result['full'][file]):
+            flags[msg[0]].append(id(msg) in new)
+        for k in ('warnings', 'errors'):
+            if file not in result[k]:
+                continue
+            msgs = result[k][file]
+            for i, msg in enumerate(msgs):
+                if flags[msg[1]].pop():
+                    msgs[i] = tuple(msg) + (1,)
+    result['marked_new'] = True
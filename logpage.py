@@ -0,0 +1,221 @@
+import hashlib
+import html
+import io
+import json
+import os
+from os.path import exists, join
+
+import assets
+from config import config
+import log_analysis
+import msgcatalog
+import rawlog
+
+
+__all__ = ('PAGE', 'INDEX', 'linker', 'top', 'writes_page', 'write',
+    'has_index', 'pages', 'render')
+
+
+# The HTML page of a build log, buildlog.html in the build directory. With
+# html_logs off, and by default for the builds of changes picked alone
+# (html_logs_picked), the build writes buildlog.json instead, and buildlog.py
+# renders the page from it and the raw log (rawlog.py) when asked for:
+#   buildlog.json:
+#       title: of the page, as HTML
+#       top: HTML above the log: counts, failures, new messages and errors
+#       link: ['release', tag] or ['change', number, version], see linker()
+#       warnings[], errors[]: log lines with one
+# It renders a block of rawlog.FRAME_LINES lines at a time, and keeps them
+# in log_cache, dropping the least recently used ones beyond log_cache_size.
+
+PAGE = 'buildlog.html'
+INDEX = 'buildlog.json'
+# Of the cached blocks, for changes in htmlout()
+_RENDER_VERSION = 1
+
+
+def linker(link):
+    """The file linker for htmlout(), for a link as in buildlog.json."""
+    if link[0] == 'release':
+        return log_analysis.file_link_release(link[1])
+    return log_analysis.file_link_change(link[1], link[2])
+
+
+def top(lead, new_msgs, errors, file_linker):
+    """HTML above the log: lead and the lists of new messages and errors."""
+    out = [lead]
+
+    def msg_item(file, line, logline, msg):
+        if line:
+            line = str(line)
+            out.append(' <li><samp><a href="' + file_linker(file, line) + '">'
+                + html.escape(file) + ':' + line + '</a>: ')
+        else:
+            out.append(' <li><samp>' + html.escape(file) + ': ')
+        out.append('<a href="#n' + str(logline) + '">'
+            + html.escape(msgcatalog.text(msg)) + '</a></samp></li>\n')
+
+    if new_msgs:
+        out.append('<h2>New messages</h2>\n<ul>\n')
+        for file, msgs in sorted(new_msgs.items()):
+            for msg in msgs:
+                msg_item(file, msg[1], msg[0], msg[2])
+        out.append('</ul></pre>\n')
+
+    if errors:
+        out.append('\n<h2>Errors</h2>\n<ul>\n')
+        for file, msgs in sorted(errors.items()):
+            for msg in msgs:
+                msg_item(file, msg[2], msg[1], msg[3])
+        out.append('</ul></pre>\n')
+
+    out.append('\n<h2>Log</h2>')
+    return ''.join(out)
+
+
+def _line_msgs(index):
+    m = max(index['warnings'] + index['errors'], default=0)
+    line_msgs = [0] * (m + 1)
+    for k, v in (('warnings', 1), ('errors', 2)):
+        for i in index[k]:
+            line_msgs[i] = v
+    return line_msgs
+
+
+def _head(title):
+    return ('<!DOCTYPE html>\n<html><head><meta charset="utf-8" />\n<title>'
+        + title + '</title>\n<link rel="stylesheet" href="'
+        + assets.link('css/log.css') + '" />\n</head><body>\n')
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def writes_page(picked=False):
+    """Whether write() writes the page, for a picked (-sep) build or not."""
+    return config['html_logs'] and (config['html_logs_picked'] or not picked)
+
+
+def write(dst, log, index, picked=False):
+    """Write the page of log in dst, or only its index (see writes_page()).
+
+    index as buildlog.json, with the title already escaped.
+    """
+    if not writes_page(picked):
+        with open(join(dst, INDEX), 'wt') as f:
+            json.dump(index, f)
+        _remove(join(dst, PAGE))
+        return
+    with open(join(dst, PAGE), 'wt') as fout:
+        fout.write(_head(index['title']))
+        fout.write(index['top'])
+        log_analysis.htmlout(log, fout, file_linker=linker(index['link']),
+            line_msgs=_line_msgs(index))
+        fout.write('\n</body></html>')
+    _remove(join(dst, INDEX))
+
+
+def has_index(dst):
+    return exists(join(dst, INDEX))
+
+
+def pages(dst):
+    """How many blocks the log in dst is rendered in."""
+    return max(1, (rawlog.count(dst) + rawlog.FRAME_LINES - 1)
+        // rawlog.FRAME_LINES)
+
+
+def _render_block(dst, index, block):
+    start = block * rawlog.FRAME_LINES
+    log = rawlog.read(dst, start, start + rawlog.FRAME_LINES)
+    for i, s in enumerate(log_analysis.PathTransformer().transform(log)):
+        log[i] = s
+    out = io.StringIO()
+    log_analysis.htmlout(log, out, lineno=start + 1,
+        file_linker=linker(index['link']), line_msgs=_line_msgs(index))
+    return out.getvalue()
+
+
+def _trim(root):
+    entries = []
+    total = 0
+    for entry in os.scandir(root):
+        if entry.name.endswith('.html'):
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+    if total <= config['log_cache_size']:
+        return
+    # Down to 3/4, not to do it again on the next miss
+    entries.sort()
+    for _, size, path in entries:
+        _remove(path)
+        total -= size
+        if total <= config['log_cache_size'] * 3 // 4:
+            break
+
+
+def _block(dst, index, block, version):
+    root = config['log_cache']
+    key = hashlib.sha256('\0'.join((dst, str(block), version)).encode(
+        'utf-8')).hexdigest()[:32]
+    path = join(root, key + '.html')
+    try:
+        with open(path, 'rt') as f:
+            content = f.read()
+        # Recently used
+        os.utime(path)
+        return content
+    except FileNotFoundError:
+        pass
+    content = _render_block(dst, index, block)
+    os.makedirs(root, exist_ok=True)
+    tmp = path + '.' + str(os.getpid())
+    with open(tmp, 'wt') as f:
+        f.write(content)
+    os.replace(tmp, path)
+    _trim(root)
+    return content
+
+
+def _nav(block, count, lines):
+    n = rawlog.FRAME_LINES
+    links = ['Lines ' + str(block * n + 1) + ' to '
+        + str(min((block + 1) * n, lines)) + ' of ' + str(lines)]
+    if block > 0:
+        links.append('<a href="?n=' + str((block - 1) * n + 1)
+            + '">previous</a>')
+    if block + 1 < count:
+        links.append('<a href="?n=' + str((block + 1) * n + 1)
+            + '">next</a>')
+    links.append('<a href="?">whole log</a>')
+    return '<p>' + ' · '.join(links) + '</p>\n'
+
+
+def render(dst, line=None):
+    """Yield the page of the log in dst, or the block with that line.
+
+    dst must have buildlog.json and the raw log.
+    """
+    with open(join(dst, INDEX), 'rt') as f:
+        index = json.load(f)
+    # Both change when the build is analysed again
+    version = '-'.join(str(os.stat(join(dst, f)).st_mtime_ns)
+        for f in (INDEX, rawlog.INDEX)) + '-' + str(_RENDER_VERSION)
+    count = pages(dst)
+    yield _head(index['title'])
+    if line is None:
+        yield index['top']
+        for block in range(count):
+            yield _block(dst, index, block, version)
+    else:
+        block = min(max(line - 1, 0) // rawlog.FRAME_LINES, count - 1)
+        nav = _nav(block, count, rawlog.count(dst))
+        yield '<h1>' + index['title'] + '</h1>\n' + nav
+        yield _block(dst, index, block, version)
+        yield '\n' + nav
+    yield '\n</body></html>'
@@ -0,0 +1,135 @@
+import fcntl
+import json
+import os
+from os.path import join
+
+import paths
+
+
+__all__ = ('intern', 'intern_all', 'text', 'all_messages', 'sync',
+    'load_messages')
+
+
+# Append-only, one JSON string per line. The line number is the message id,
+# so ids never change once written and can be shared by all the builds.
+_CATALOGFILE = join(paths.www_root(), 'messages.jsonl')
+
+_messages = []  # id: text
+_index = {}     # text: id
+_synced = 0     # messages before this one are already in the file
+_offset = 0     # bytes of the file read or written
+
+
+def _load():
+    global _synced, _offset
+    try:
+        with open(_CATALOGFILE, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return
+    end = data.rfind(b'\n') + 1
+    if end != len(data):
+        # Interrupted while appending. Nothing can reference that line.
+        with open(_CATALOGFILE, 'r+b') as f:
+            f.truncate(end)
+    _add_lines(data[:end])
+    _synced = len(_messages)
+    _offset = end
+
+
+def _add_lines(data):
+    for line in data.decode('utf-8').split('\n')[:-1]:
+        s = json.loads(line)
+        _index[s] = len(_messages)
+        _messages.append(s)
+
+
+def intern(s):
+    try:
+        return _index[s]
+    except KeyError:
+        i = len(_messages)
+        _messages.append(s)
+        _index[s] = i
+        return i
+
+
+def intern_all(texts):
+    """intern() for processes sharing the catalog, returns {text: id}.
+
+    Ids are taken with the file locked, after reading what the others
+    added, and are permanent at once. Do not mix with intern() in those.
+    """
+    global _synced, _offset
+    if _synced != len(_messages):
+        raise RuntimeError('Messages not in the catalog file yet')
+    with open(_CATALOGFILE, 'a+b') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(_offset)
+        data = f.read()
+        _add_lines(data)
+        _offset += len(data)
+        new = [s for s in dict.fromkeys(texts) if s not in _index]
+        if new:
+            lines = b''.join(json.dumps(s).encode('utf-8') + b'\n'
+                for s in new)
+            for s in new:
+                intern(s)
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+            _offset += len(lines)
+        _synced = len(_messages)
+    return {s: _index[s] for s in texts}
+
+
+def text(i):
+    # Files written before the catalog existed have the text itself
+    if isinstance(i, str):
+        return i
+    return _messages[i]
+
+
+def all_messages():
+    # Do not modify
+    return _messages
+
+
+def sync():
+    """Make new ids permanent.
+
+    Must be called before writing anything that uses them.
+    """
+    global _synced, _offset
+    if _synced == len(_messages):
+        return
+    with open(_CATALOGFILE, 'ab') as f:
+        for s in _messages[_synced:]:
+            f.write(json.dumps(s).encode('utf-8') + b'\n')
+        f.flush()
+        os.fsync(f.fileno())
+        _offset = f.tell()
+    _synced = len(_messages)
+
+
+def load_messages(path, shared=False):
+    """Read a build-messages.json file, with catalog ids for the messages.
+
+    With shared, the ids are taken as intern_all() does.
+    """
+    with open(path, 'rt') as f:
+        data = json.load(f)
+    if shared:
+        ids = intern_all([msg[2] for msgs in data.values() for msg in msgs
+            if isinstance(msg[2], str)])
+        get = ids.__getitem__
+    else:
+        get = intern
+    for msgs in data.values():
+        for i, msg in enumerate(msgs):
+            if isinstance(msg[2], str):
+                msgs[i] = (msg[0], msg[1], get(msg[2]))
+    return data
+
+
+_load()
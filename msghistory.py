@@ -0,0 +1,236 @@
+from collections import Counter
+import json
+import os
+from os.path import join
+import sqlite3
+
+import msgcatalog
+import paths
+
+
+__all__ = ('record', 'update', 'messages', 'search', 'trend', 'export')
+
+
+_DBFILE = join(paths.www_root(), 'message-history.sqlite')
+_EXPORTFILE = join(paths.www_root(), 'message-history.json')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS release (
+    tag TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS recorded (
+    arch TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (arch, tag)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS message (
+    arch TEXT NOT NULL,
+    file TEXT NOT NULL,
+    msg INTEGER NOT NULL,
+    first TEXT NOT NULL,
+    last TEXT NOT NULL,
+    releases INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    last_count INTEGER NOT NULL,
+    PRIMARY KEY (arch, file, msg)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS message_msg ON message (msg);
+CREATE TABLE IF NOT EXISTS seen (
+    arch TEXT NOT NULL,
+    file TEXT NOT NULL,
+    msg INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (arch, file, msg, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS seen_release ON seen (arch, seq);
+CREATE TABLE IF NOT EXISTS file_count (
+    arch TEXT NOT NULL,
+    file TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    warnings INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    PRIMARY KEY (arch, file, seq)
+) WITHOUT ROWID;
+'''
+
+_db = None
+
+
+def _connect():
+    global _db
+    if _db is None:
+        _db = sqlite3.connect(_DBFILE)
+        _db.executescript(_SCHEMA)
+    return _db
+
+
+def _seq(db, tag):
+    row = db.execute('SELECT seq FROM release WHERE tag = ?',
+        (tag,)).fetchone()
+    if row:
+        return row[0]
+    seq = db.execute('SELECT COALESCE(MAX(seq), 0) + 1 FROM release'
+        ).fetchone()[0]
+    db.execute('INSERT INTO release (tag, seq) VALUES (?, ?)', (tag, seq))
+    return seq
+
+
+def _counts(result):
+    counts = Counter()
+    for file, msgs in result['full'].items():
+        for msg in msgs:
+            counts[(file, msg[2])] += 1
+    return counts
+
+
+def _add_release(db, arch, seq, result, counts):
+    db.executemany('INSERT INTO seen (arch, file, msg, seq, count) '
+            'VALUES (?, ?, ?, ?, ?)',
+        ((arch, file, msg, seq, n) for (file, msg), n in counts.items()))
+    files = set(result['warnings'].keys())
+    files.update(result['errors'].keys())
+    db.executemany('INSERT OR REPLACE INTO file_count (arch, file, seq, '
+            'warnings, errors) VALUES (?, ?, ?, ?, ?)',
+        ((arch, file, seq, len(result['warnings'].get(file, ())),
+            len(result['errors'].get(file, ())))
+            for file in files))
+
+
+def record(tag, arch, result):
+    """Add the messages of a release build to the history.
+
+    result is what log_analysis.analyse() returned, with catalog ids in
+    'full'. Releases are expected in build order, and each arch is only
+    counted once per release.
+    """
+    db = _connect()
+    with db:
+        if db.execute('SELECT 1 FROM recorded WHERE arch = ? AND tag = ?',
+                (arch, tag)).fetchone():
+            return
+        db.execute('INSERT INTO recorded (arch, tag) VALUES (?, ?)',
+            (arch, tag))
+        seq = _seq(db, tag)
+        counts = _counts(result)
+        db.executemany('INSERT INTO message (arch, file, msg, first, last, '
+                'releases, count, last_count) VALUES (?, ?, ?, ?, ?, 1, ?, ?) '
+            'ON CONFLICT (arch, file, msg) DO UPDATE SET last = excluded.last, '
+                'releases = releases + 1, count = count + excluded.count, '
+                'last_count = excluded.last_count',
+            ((arch, file, msg, tag, tag, n, n)
+                for (file, msg), n in counts.items()))
+        _add_release(db, arch, seq, result, counts)
+
+
+def update(tag, arch, result):
+    """Replace the messages of a recorded release build, analysed again.
+
+    Like record(), in any order. The messages it had or has now are summed
+    up again from each release they were seen in, the ones no longer built
+    included. Builds never recorded are left out, returns whether it was.
+    """
+    db = _connect()
+    with db:
+        row = db.execute('SELECT seq FROM release JOIN recorded '
+                'ON recorded.tag = release.tag '
+            'WHERE recorded.arch = ? AND recorded.tag = ?',
+            (arch, tag)).fetchone()
+        if not row:
+            return False
+        seq = row[0]
+        keys = set(db.execute('SELECT file, msg FROM seen '
+            'WHERE arch = ? AND seq = ?', (arch, seq)))
+        db.execute('DELETE FROM seen WHERE arch = ? AND seq = ?', (arch, seq))
+        db.execute('DELETE FROM file_count WHERE arch = ? AND seq = ?',
+            (arch, seq))
+        counts = _counts(result)
+        _add_release(db, arch, seq, result, counts)
+        keys.update(counts)
+        for file, msg in keys:
+            rows = db.execute('SELECT release.tag, seen.count FROM seen '
+                    'JOIN release ON release.seq = seen.seq '
+                'WHERE arch = ? AND file = ? AND msg = ? ORDER BY seen.seq',
+                (arch, file, msg)).fetchall()
+            if not rows:
+                db.execute('DELETE FROM message '
+                    'WHERE arch = ? AND file = ? AND msg = ?',
+                    (arch, file, msg))
+                continue
+            db.execute('INSERT OR REPLACE INTO message (arch, file, msg, '
+                    'first, last, releases, count, last_count) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (arch, file, msg, rows[0][0], rows[-1][0], len(rows),
+                    sum(n for _, n in rows), rows[-1][1]))
+        return True
+
+
+def messages(arch=None, prefix=''):
+    """Messages seen for files starting with prefix.
+
+    Yields (arch, file, message, first, last, releases, count, last_count).
+    """
+    db = _connect()
+    query = ('SELECT arch, file, msg, first, last, releases, count, '
+        'last_count FROM message WHERE file >= ? AND file < ?')
+    params = [prefix, prefix + '\U0010ffff']
+    if arch:
+        query += ' AND arch = ?'
+        params.append(arch)
+    query += ' ORDER BY file, arch, msg'
+    for row in db.execute(query, params):
+        yield row[:2] + (msgcatalog.text(row[2]),) + row[3:]
+
+
+def search(text, arch=None):
+    """Like messages(), for the messages containing text."""
+    ids = [i for i, s in enumerate(msgcatalog.all_messages()) if text in s]
+    db = _connect()
+    query = ('SELECT arch, file, msg, first, last, releases, count, '
+        'last_count FROM message WHERE msg = ?')
+    if arch:
+        query += ' AND arch = ?'
+    for i in ids:
+        params = (i, arch) if arch else (i,)
+        for row in db.execute(query, params):
+            yield row[:2] + (msgcatalog.text(row[2]),) + row[3:]
+
+
+def trend(arch, file):
+    """(tag, warnings, errors) for each recorded release of arch."""
+    db = _connect()
+    return db.execute('SELECT release.tag, COALESCE(warnings, 0), '
+            'COALESCE(errors, 0) FROM release '
+            'JOIN recorded ON recorded.tag = release.tag AND recorded.arch = ? '
+            'LEFT JOIN file_count ON file_count.seq = release.seq '
+                'AND file_count.arch = ? AND file_count.file = ? '
+            'ORDER BY release.seq',
+        (arch, arch, file)).fetchall()
+
+
+def export(path=None):
+    """Write the per file message counts of every release as JSON.
+
+    {"releases": [tag...], "arch": {arch: {file: [[index, warnings, errors]
+    ...]}}}, with index pointing into releases. Releases with no messages
+    for a file are left out.
+    """
+    if path is None:
+        path = _EXPORTFILE
+    db = _connect()
+    releases = []
+    index = {}
+    for tag, seq in db.execute('SELECT tag, seq FROM release ORDER BY seq'):
+        index[seq] = len(releases)
+        releases.append(tag)
+    arches = {}
+    for arch, file, seq, warnings, errors in db.execute('SELECT arch, file, '
+            'seq, warnings, errors FROM file_count ORDER BY arch, file, seq'):
+        arches.setdefault(arch, {}).setdefault(file, []).append(
+            (index[seq], warnings, errors))
+    tmp = path + '.tmp'
+    with open(tmp, 'wt') as f:
+        json.dump({'releases': releases, 'arch': arches}, f,
+            separators=(',', ':'))
+    os.replace(tmp, path)
@@ -0,0 +1,111 @@
+from collections import defaultdict
+import json
+import os
+from os.path import join
+
+from assets import hashed_name
+import msgcatalog
+
+
+__all__ = ('write',)
+
+
+# The messages of a build by directory, for the error view (msgview.js), so
+# that it does not need the whole build-result.json. Below <build>/messages,
+# with a hash of their contents in the names so that they can be cached for
+# good (the arch result has the tree one):
+#   tree.<hash>.json:
+#       files[]: log files, as in build-result.json
+#       pages: lines in each page of them, if rendered by blocks (logpage.py)
+#       messages{msg}: text of each message id in the build, so that the view
+#           does not need the whole catalog
+#       dirs{path}: each directory with messages below, '' for the top and
+#               the rest ending in /
+#           dirs[]: names of the directories in it with messages
+#           counts{msg}: [warnings, errors, new warnings, new errors] below it
+#           files{name}: counts{msg} for each file in it
+#           leaf: name of its leaf file, if it has files
+#   leaf-<n>.<hash>.json:
+#       {name}[]: messages of each file in the directory, by line, as
+#           [log file, log line, line, msg, error, new]
+
+DIR = 'messages'
+
+
+def _split(path):
+    """'a/b/c' or 'a/b/c/' to ('a/b/', 'c')."""
+    i = path.rstrip('/').rfind('/') + 1
+    return path[:i], path[i:].rstrip('/')
+
+
+def _add(counts, more):
+    for msg, c in more.items():
+        total = counts[msg]
+        for i in range(4):
+            total[i] += c[i]
+
+
+def _dump(root, name, obj):
+    text = json.dumps(obj, separators=(',', ':')).encode('utf-8')
+    name = hashed_name(name, text)
+    with open(join(root, name), 'wb') as f:
+        f.write(text)
+    return name
+
+
+def write(dst, result):
+    """Write the tree for result, with messages as in build-result.json.
+
+    Returns the name of the tree file, relative to dst.
+    """
+    new_counts = lambda: defaultdict(lambda: [0, 0, 0, 0])
+    dirs = defaultdict(lambda: {'dirs': set(), 'counts': new_counts(),
+        'files': {}})
+    leaves = defaultdict(lambda: defaultdict(list))
+    for error, k in enumerate(('warnings', 'errors')):
+        for file, msgs in result[k].items():
+            path, name = _split(file)
+            counts = dirs[path]['files'].setdefault(name, new_counts())
+            leaf = leaves[path][name]
+            for msg in msgs:
+                new = len(msg) > 4 and msg[4] == 1
+                counts[msg[3]][error] += 1
+                if new:
+                    counts[msg[3]][error + 2] += 1
+                leaf.append(list(msg[:4]) + [error, int(new)])
+
+    for path, node in list(dirs.items()):
+        for counts in node['files'].values():
+            _add(node['counts'], counts)
+        # Up to the top, adding the directories on the way
+        while path:
+            parent, name = _split(path)
+            up = dirs[parent]
+            up['dirs'].add(name)
+            path = parent
+
+    # Now the totals, deepest first
+    for path in sorted(dirs, key=lambda p: p.count('/'), reverse=True):
+        if path:
+            _add(dirs[_split(path)[0]]['counts'], dirs[path]['counts'])
+
+    root = join(dst, DIR)
+    os.makedirs(root, exist_ok=True)
+    for f in os.listdir(root):
+        os.remove(join(root, f))
+    tree = {}
+    for n, path in enumerate(sorted(dirs)):
+        node = dirs[path]
+        tree[path] = {'dirs': sorted(node['dirs']), 'counts': node['counts'],
+            'files': node['files']}
+        if node['files']:
+            leaf = leaves[path]
+            for msgs in leaf.values():
+                msgs.sort(key=lambda msg: msg[2])
+            tree[path]['leaf'] = _dump(root, 'leaf-%d.json' % n, leaf)
+    top = {'files': result['files'], 'dirs': tree,
+        'messages': {msg: msgcatalog.text(msg)
+            for msg in dirs['']['counts']} if '' in dirs else {}}
+    if 'pages' in result:
+        top['pages'] = result['pages']
+    return DIR + '/' + _dump(root, 'tree.json', top)
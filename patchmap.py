@@ -0,0 +1,148 @@
+from bisect import bisect_right
+import os
+from os.path import join
+import re
+
+
+__all__ = ('PatchMap',)
+
+
+RE_HUNK = re.compile(r'@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+def _path(s, prefix):
+    # TODO: git quotes names with unusual characters, we only strip the quotes
+    s = s.rstrip('\n')
+    if s.startswith('"') and s.endswith('"'):
+        s = s[1:-1]
+    if s == '/dev/null':
+        return None
+    if s.startswith(prefix):
+        s = s[len(prefix):]
+    return s
+
+
+class _FileMap:
+    def __init__(self, name):
+        self.name = name
+        self.starts = []
+        self.blocks = []
+
+    def add_block(self, old_start, old_len, new_start, new_len):
+        # Lines that were removed and/or added together. Empty ranges are
+        # right before the given line.
+        self.starts.append(old_start)
+        self.blocks.append((old_start, old_len, new_start, new_len))
+
+    def map(self, line):
+        i = bisect_right(self.starts, line) - 1
+        if i < 0:
+            return line
+        old_start, old_len, new_start, new_len = self.blocks[i]
+        if line < old_start + old_len:
+            # Changed line, anything close will do
+            return new_start + min(line - old_start, max(new_len - 1, 0))
+        return line + (new_start + new_len) - (old_start + old_len)
+
+
+class PatchMap:
+    """Where lines of the base tree end up after applying a patch series.
+
+    Built from the files of git format-patch, applied in name order.
+    """
+    def __init__(self, patch_dir):
+        self._patches = []
+        try:
+            names = sorted(f for f in os.listdir(patch_dir)
+                if f.endswith('.patch'))
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            with open(join(patch_dir, name), 'rt', errors='replace') as f:
+                self._patches.append(self._parse(f))
+
+    @staticmethod
+    def _parse(f):
+        files = {}
+        current = None
+        old_name = None
+        new_name = None
+        remaining = 0
+        block = None
+        for line in f:
+            if remaining > 0:
+                # Hunk body, only the changed lines matter
+                if line.startswith(' '):
+                    if block and current:
+                        current.add_block(*block)
+                        block = None
+                    old_line += 1
+                    new_line += 1
+                    remaining -= 2
+                elif line.startswith(('-', '+')):
+                    if block is None:
+                        block = [old_line, 0, new_line, 0]
+                    if line[0] == '-':
+                        block[1] += 1
+                        old_line += 1
+                    else:
+                        block[3] += 1
+                        new_line += 1
+                    remaining -= 1
+                if remaining <= 0 and block and current:
+                    current.add_block(*block)
+                    block = None
+                continue
+            if line.startswith('diff --git '):
+                current = None
+                old_name = new_name = None
+            elif line.startswith('rename from '):
+                old_name = _path(line[12:], '')
+            elif line.startswith('rename to '):
+                new_name = _path(line[10:], '')
+                current = _FileMap(new_name)
+                files[old_name] = current
+            elif line.startswith('--- '):
+                old_name = _path(line[4:], 'a/')
+            elif line.startswith('+++ '):
+                new_name = _path(line[4:], 'b/')
+                if old_name is None:
+                    # New file, nothing to map
+                    current = None
+                else:
+                    current = files.get(old_name)
+                    if current is None:
+                        current = _FileMap(new_name)
+                        files[old_name] = current
+                    current.name = new_name
+            elif line.startswith('@@ '):
+                m = RE_HUNK.match(line)
+                if m:
+                    old_len = 1 if m.group(2) is None else int(m.group(2))
+                    new_len = 1 if m.group(4) is None else int(m.group(4))
+                    # Empty ranges are given by the line before them
+                    old_line = int(m.group(1)) + (old_len == 0)
+                    new_line = int(m.group(3)) + (new_len == 0)
+                    remaining = old_len + new_len
+        return files
+
+    def __bool__(self):
+        return any(self._patches)
+
+    def map(self, file, line):
+        """Return the (file, line) of the patched tree for a base tree one.
+
+        Lines of deleted files stay where they were.
+        """
+        orig = (file, line)
+        for patch in self._patches:
+            try:
+                fmap = patch[file]
+            except KeyError:
+                continue
+            if fmap.name is None:
+                return orig
+            file = fmap.name
+            if line:
+                line = fmap.map(line)
+        return file, line
@@ -1,9 +1,11 @@
+import json
 import os
 from os.path import join
-from shutil import rmtree
+import stat
 
 from config import config
 import tmpfs
+import trash
 
 
 def www_root():
@@ -47,35 +49,98 @@ def jam():
 def emulated_attributes():
     return join(tmpfs.preferred_root(), 'haiku_testbuilds')
 
-def delete_release(branch, tag):
-    rmtree(www_release(branch, tag, None), ignore_errors=True)
+def delete_release(branch, tag, size=None):
+    _discard(www_release(branch, tag, None), size=size)
 
-def delete_change(cid):
-    rmtree(join(www_root(), cid), ignore_errors=True)
+def delete_change(cid, size=None):
+    _discard(join(www_root(), cid), size=size)
 
-def clean_up(path):
+def delete_build(change, build, size=None):
+    _discard(www(change, build, None), www(change, build, None, full=False),
+        size=size)
+
+def _discard(*names, size=None):
+    # The size is recorded in the db most of the time, but not always
+    if size is None:
+        size = sum(tree_bytes(n) for n in names)
+    trash.discard(*names, size=size)
+
+def _is_artifact(name):
+    return (name in ('build.err', 'build.out', 'boot.scr')
+        or name.startswith(('haiku.', 'haiku-'))
+        or name.endswith(('.hpkg', '.iso', '.image', '.xz', '.map',
+            '.chunks')))
+
+
+def clean_up(path, size=0):
     """Remove some files from the directory.
 
     Remove artifacts from build directory.
     Just keep logs from download directory.
+    size is what they use, if known, for trash.free().
     """
     # TODO: maybe only objects/{catalogs,common,haiku}
     # What about tmp/ and other dangling stuff?
     # Keep at least build_packages/, download/
-    rmtree(join(path, 'objects'), ignore_errors=True)
     try:
-        for f in os.listdir(path):
-            if (f in ('build.err', 'build.out', 'boot.scr')
-                    or f.startswith(('haiku.', 'haiku-'))
-                    or f.endswith(('.hpkg', '.iso', '.image', '.xz', '.map'))):
-                try:
-                    os.remove(join(path, f))
-                except FileNotFoundError:
-                    pass
-        try:
-            os.remove(join(path, 'build', 'haiku-revision'))
-        except FileNotFoundError:
-            pass
+        names = [join(path, f) for f in os.listdir(path) if _is_artifact(f)]
     except FileNotFoundError:
-        pass
+        return
+    names.append(join(path, 'objects'))
+    names.append(join(path, 'build', 'haiku-revision'))
+    trash.discard(*names, size=size)
+
+
+def file_bytes(path):
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return 0
+    if st.st_nlink > 1 and stat.S_ISREG(st.st_mode):
+        # Shared with other builds through the artifact pool: each one
+        # counts its part, the pool link does not count
+        return st.st_blocks * 512 // (st.st_nlink - 1)
+    return st.st_blocks * 512
+
 
+def _recipe_bytes(path):
+    # The image chunks it stored, see imagestore.py
+    try:
+        with open(path, 'rt') as f:
+            return json.load(f).get('stored', 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def tree_bytes(path):
+    total = 0
+    for dirname, subdirs, files in os.walk(path):
+        for f in files:
+            total += file_bytes(join(dirname, f))
+    return total
+
+
+def bytes_used(path):
+    """Disk space used by a build directory.
+
+    Returns {'artifacts': n, 'logs': n}, where artifacts is what clean_up()
+    would free and logs is the rest.
+    """
+    used = {'artifacts': 0, 'logs': 0}
+    try:
+        entries = list(os.scandir(path))
+    except FileNotFoundError:
+        return used
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            if entry.name == 'objects':
+                used['artifacts'] += tree_bytes(entry.path)
+            else:
+                used['logs'] += tree_bytes(entry.path)
+        elif _is_artifact(entry.name):
+            used['artifacts'] += file_bytes(entry.path)
+            if entry.name.endswith('.chunks'):
+                used['artifacts'] += _recipe_bytes(entry.path)
+        else:
+            used['logs'] += file_bytes(entry.path)
+    return used
@@ -0,0 +1,74 @@
+from os.path import exists, join
+
+from config import config
+import db
+import paths
+
+
+__all__ = ('is_cold', 'learn', 'arch_estimate', 'release_estimate',
+    'change_estimate')
+
+
+# Exponential moving average of the build time of an arch, per scenario.
+# Recent builds weigh more, as the tree and the machine change.
+_ALPHA = 0.3
+# Until there is something to learn from
+_DEFAULT = 60 * 60
+
+
+def _model():
+    # {arch: {scenario: seconds}}
+    return db.data.setdefault('durations', {})
+
+
+def _scenario(kind, cold):
+    return kind + ('-cold' if cold else '')
+
+
+def is_cold(arch):
+    # Without a configured build directory, it has to be set up from scratch
+    return not exists(join(paths.build(arch), 'build', 'BuildConfig'))
+
+
+def learn(arch, kind, cold, seconds):
+    """Record the time taken by an arch build of a release or a change."""
+    model = _model().setdefault(arch, {})
+    scenario = _scenario(kind, cold)
+    try:
+        model[scenario] = round(model[scenario]
+            + _ALPHA * (seconds - model[scenario]), 1)
+    except KeyError:
+        model[scenario] = round(seconds, 1)
+
+
+def arch_estimate(arch, kind, cold=None):
+    if cold is None:
+        cold = is_cold(arch)
+    model = _model().get(arch, {})
+    try:
+        return model[_scenario(kind, cold)]
+    except KeyError:
+        pass
+    # Something close: the other kind of build, or warm and cold
+    for scenario in (_scenario('release' if kind == 'change' else 'change',
+            cold), _scenario(kind, not cold)):
+        try:
+            return model[scenario]
+        except KeyError:
+            pass
+    if model:
+        return max(model.values())
+    return _DEFAULT
+
+
+def release_estimate(arches):
+    return sum(arch_estimate(arch, 'release') for arch in arches)
+
+
+def change_estimate(change):
+    """Time to build a change, rebased and, if it was before, picked."""
+    t = sum(arch_estimate(arch, 'change') for arch in config['arches'])
+    latest = change.latest_build()
+    if latest is not None and latest['picked']:
+        t *= 2
+    return t
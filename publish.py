@@ -0,0 +1,193 @@
+import json
+import os
+from os.path import join
+
+import paths
+
+
+__all__ = ('publish',)
+
+
+# What the summary page loads, below www_root/summary:
+#   index.json: everything the tables show at first
+#       time, current, queued, eta, cycles: as in builds.json
+#       release{tag}: commit, title, parent, time, result{*/arch}: ok,
+#           warnings, errors
+#       change{cid}: the active change without ref, sent_review and streak,
+#           builds (how many) and only the latest build in build[]
+#       seq: of the last feed record taken into account
+#   change/<cid>.json: the whole change, active or done
+#   release/<tag>.json: the whole release
+#   feed.jsonl: what changed in the index, one record per line, to poll with
+#       ?since=<seq> (the server may use it to filter, no need to):
+#       seq, time
+#       current, queued, eta, cycles: when they changed
+#       change{cid}, release{tag}: rows added or changed
+#       removed{change/release}[]: rows gone
+#       feed-old.jsonl has the records before those, once feed.jsonl is full
+# A shard is only written when its contents change.
+
+_DIR = 'summary'
+FEED_RECORDS = 64
+_FEED_KEYS = ('current', 'queued', 'eta', 'cycles')
+
+_written = {}   # path: contents
+_names = {}     # kind: names with a shard
+_seen = None    # what the last index had, as in _index_texts()
+_seq = 0        # of the last feed record
+_feed_lines = 0 # records in feed.jsonl
+
+
+def _path(*names):
+    return join(paths.www_root(), _DIR, *names)
+
+
+def _dump(obj):
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def _write(path, text):
+    try:
+        old = _written[path]
+    except KeyError:
+        # Written by an earlier run?
+        try:
+            with open(path, 'rt') as f:
+                old = f.read()
+        except FileNotFoundError:
+            old = None
+    if old == text:
+        _written[path] = text
+        return
+    tmp = path + '.tmp'
+    with open(tmp, 'wt') as f:
+        f.write(text)
+    os.replace(tmp, path)
+    _written[path] = text
+
+
+def _shards(kind, items):
+    d = _path(kind)
+    try:
+        names = _names[kind]
+    except KeyError:
+        os.makedirs(d, exist_ok=True)
+        names = set(f[:-5] for f in os.listdir(d) if f.endswith('.json'))
+        _names[kind] = names
+    for name in names.difference(items):
+        path = join(d, name + '.json')
+        _written.pop(path, None)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    names.clear()
+    for name, item in items.items():
+        _write(join(d, name + '.json'), _dump(item))
+        names.add(name)
+
+
+def _release_row(release):
+    row = {k: release[k] for k in ('commit', 'title', 'parent', 'time')}
+    row['result'] = {arch: {k: v for k, v in result.items()
+            if k in ('ok', 'warnings', 'errors')}
+        for arch, result in release['result'].items()}
+    return row
+
+
+def _change_row(change):
+    row = {k: v for k, v in change.items()
+        if k not in ('ref', 'sent_review', 'streak', 'build')}
+    row['builds'] = len(change['build'])
+    row['build'] = change['build'][-1:]
+    return row
+
+
+def _index_texts(index):
+    """Each row and each other part of index, dumped, to compare."""
+    texts = {k: _dump(index.get(k)) for k in _FEED_KEYS}
+    for kind in ('change', 'release'):
+        texts[kind] = {name: _dump(row)
+            for name, row in index.get(kind, {}).items()}
+    return texts
+
+
+def _delta(index):
+    """The feed record for index, None if only the time changed."""
+    global _seen
+    texts = _index_texts(index)
+    seen = _seen
+    _seen = texts
+    record = {}
+    for k in _FEED_KEYS:
+        if texts[k] != seen[k]:
+            record[k] = index[k]
+    removed = {}
+    for kind in ('change', 'release'):
+        rows = {name: index[kind][name]
+            for name, text in texts[kind].items()
+            if seen[kind].get(name) != text}
+        if rows:
+            record[kind] = rows
+        gone = sorted(set(seen[kind]).difference(texts[kind]))
+        if gone:
+            removed[kind] = gone
+    if removed:
+        record['removed'] = removed
+    return record or None
+
+
+def _load_seen():
+    global _seen, _seq, _feed_lines
+    try:
+        with open(_path('index.json'), 'rt') as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        index = {}
+    _seen = _index_texts(index)
+    _seq = index.get('seq', 0)
+    _feed_lines = 0
+    try:
+        with open(_path('feed.jsonl'), 'rt') as f:
+            for line in f:
+                # The feed is written before the index, it may be ahead
+                _seq = max(_seq, json.loads(line)['seq'])
+                _feed_lines += 1
+    except FileNotFoundError:
+        pass
+
+
+def _append_feed(record):
+    global _feed_lines
+    path = _path('feed.jsonl')
+    if _feed_lines >= FEED_RECORDS:
+        os.replace(path, _path('feed-old.jsonl'))
+        _feed_lines = 0
+    with open(path, 'at') as f:
+        f.write(_dump(record) + '\n')
+    _feed_lines += 1
+
+
+def publish(data):
+    """Write the summary index, the shards that changed and a feed record."""
+    global _seq
+    if _seen is None:
+        _load_seen()
+    changes = dict(data['done'])
+    changes.update(data['change'])
+    _shards('change', changes)
+    _shards('release', data['release'])
+    index = {k: data.get(k) for k in ('time', 'current', 'queued', 'eta',
+        'cycles')}
+    index['release'] = {tag: _release_row(release)
+        for tag, release in data['release'].items()}
+    index['change'] = {cid: _change_row(change)
+        for cid, change in data['change'].items()}
+    record = _delta(index)
+    if record is not None:
+        _seq += 1
+        record['seq'] = _seq
+        record['time'] = index['time']
+        _append_feed(record)
+    index['seq'] = _seq
+    _write(_path('index.json'), _dump(index))
@@ -0,0 +1,39 @@
+#! /usr/bin/python
+
+import argparse
+
+import msghistory
+
+
+def print_messages(rows):
+    for arch, file, msg, first, last, releases, count, last_count in rows:
+        print(arch, file, first, last, releases, count, last_count, msg,
+            sep='\t')
+
+
+parser = argparse.ArgumentParser(
+    description='When were the messages seen in the releases')
+parser.add_argument('--arch', help='only for this arch')
+sub = parser.add_subparsers(dest='command', required=True)
+p = sub.add_parser('file', help='messages for files under a path')
+p.add_argument('path', nargs='?', default='')
+p = sub.add_parser('grep', help='messages containing a text')
+p.add_argument('text')
+p = sub.add_parser('trend', help='message count per release for a file')
+p.add_argument('path')
+p = sub.add_parser('export',
+    help='write the per file counts of the releases as JSON')
+p.add_argument('output', nargs='?', help='instead of the default location')
+args = parser.parse_args()
+
+if args.command == 'file':
+    print_messages(msghistory.messages(args.arch, args.path))
+elif args.command == 'grep':
+    print_messages(msghistory.search(args.text, args.arch))
+elif args.command == 'trend':
+    if not args.arch:
+        parser.error('trend needs --arch')
+    for tag, warnings, errors in msghistory.trend(args.arch, args.path):
+        print(tag, warnings, errors, sep='\t')
+else:
+    msghistory.export(args.output)
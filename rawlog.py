@@ -0,0 +1,108 @@
+import gzip
+from itertools import islice
+import json
+import os
+from os.path import exists, join
+
+
+__all__ = ('store', 'write', 'text_lines', 'lines', 'read', 'count',
+    'has_log')
+
+
+# The log of a build as jam wrote it, before any path transformation, in
+# the build directory:
+#   build.log.gz: FRAME_LINES lines per gzip member, so a range of lines can
+#       be read without the rest. zcat reads it all.
+#   build.log.idx: JSON
+#       frame_lines
+#       lines: in the log, as in file.read().split('\n')
+#       offsets[]: where each member starts, and the end of the last one
+
+LOG = 'build.log.gz'
+INDEX = 'build.log.idx'
+FRAME_LINES = 4096
+
+
+def _write(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def write(dst, log):
+    """Store log, lines or an iterable of them, in the build directory dst."""
+    log = iter(log)
+    offsets = [0]
+    count = 0
+    path = join(dst, LOG)
+    with open(path + '.tmp', 'wb') as f:
+        while True:
+            frame = list(islice(log, FRAME_LINES))
+            if not frame:
+                break
+            data = gzip.compress(''.join(line + '\n'
+                for line in frame).encode('utf-8'), 6)
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+            count += len(frame)
+    os.replace(path + '.tmp', path)
+    _write(join(dst, INDEX), json.dumps({'frame_lines': FRAME_LINES,
+        'lines': count, 'offsets': offsets}).encode('utf-8'))
+
+
+def text_lines(f):
+    """Yield the lines of the text file f as in f.read().split('\\n')."""
+    last = ''
+    for line in f:
+        if line.endswith('\n'):
+            yield line[:-1]
+            last = ''
+        else:
+            last = line
+    yield last
+
+
+def store(fname, dst):
+    """Store the log in the file fname, as read for the analysis."""
+    with open(fname, 'rt') as f:
+        write(dst, text_lines(f))
+
+
+def has_log(dst):
+    return exists(join(dst, INDEX))
+
+
+def _index(dst):
+    with open(join(dst, INDEX), 'rt') as f:
+        return json.load(f)
+
+
+def count(dst):
+    """Lines in the log in dst."""
+    return _index(dst)['lines']
+
+
+def lines(dst, start=0, stop=None):
+    """Yield the lines start to stop of the log in dst, a frame at a time."""
+    index = _index(dst)
+    n = index['frame_lines']
+    offsets = index['offsets']
+    if stop is None or stop > index['lines']:
+        stop = index['lines']
+    if start >= stop:
+        return
+    first = start // n
+    with open(join(dst, LOG), 'rb') as f:
+        f.seek(offsets[first])
+        for frame in range(first, (stop - 1) // n + 1):
+            data = f.read(offsets[frame + 1] - offsets[frame])
+            frame_lines = gzip.decompress(data).decode('utf-8').split('\n')
+            base = frame * n
+            # The last one is the '' after the newline
+            yield from frame_lines[max(start - base, 0):min(stop - base, n)]
+
+
+def read(dst, start=0, stop=None):
+    """The lines start to stop of the log in dst, as a list."""
+    return list(lines(dst, start, stop))
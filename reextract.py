@@ -1,16 +1,34 @@
 #! /usr/bin/python
 
+# Analyses the logs of the builds again, after log_analysis changes.
+# Only the builds analysed with an older log_analysis.VERSION are redone,
+# unless --all. The builds of the arches are spread over --jobs processes
+# and the results saved every --batch builds, with a checkpoint to go on
+# from if interrupted. Logs come from the raw ones (rawlog.py) where the build
+# has them, from the HTML ones otherwise. The release builds redone are updated
+# in the message history (msghistory.py).
+
+import argparse
 import json
 from html import escape, unescape
+import multiprocessing
 import os
-from os.path import basename, exists, join
+from os.path import basename, exists, join, relpath
 import re
-from shutil import move
+from shutil import move, rmtree
+import tempfile
 
+import assets
 from config import config
 import db
 import log_analysis
+import logpage
+import msgcatalog
+import msghistory
+import msgtree
 import paths
+import rawlog
+from patchmap import PatchMap
 import tmpfs
 
 
@@ -23,19 +41,25 @@ if not exists('stop.please'):
     # TODO: this is no guarantee
     raise Exception('Make sure the main process is not running')
 
-badbefore = set()
-badafter = set()
+CHECKPOINT = 'reextract.checkpoint'
 
-def extract_bad(file, set):
+def extract_bad(file):
+    bad = set()
     with open(file, 'rt') as f:
         data = json.load(f)
-        for s in data['messages']:
-            if ' ' in s:
-                set.add(s)
-
-def clear_html_log(file):
+    try:
+        messages = data['messages']
+    except KeyError:
+        messages = (msgcatalog.text(msg[3]) for k in ('warnings', 'errors')
+            for msgs in data[k].values() for msg in msgs)
+    for s in messages:
+        if ' ' in s:
+            bad.add(s)
+    return bad
+
+def clear_html_log(file, tmp):
     with open(file, 'rt') as f:
-        outname = join(tmpfs.preferred_root(), 'haiku_'+basename(file))
+        outname = join(tmp, 'haiku_'+basename(file))
         with open(outname, 'wt') as out:
             for line in f:
                 if line.startswith('<li>'):
@@ -44,7 +68,9 @@ def clear_html_log(file):
 
 def loglines(fname):
     with open(fname, 'rt') as logf:
-        log = logf.read().split('\n')
+        return transformed(logf.read().split('\n'))
+
+def transformed(log):
     PT = log_analysis.PathTransformer()
     for i, s in enumerate(PT.transform(log)):
         log[i] = s
@@ -111,7 +137,7 @@ def _process_build2(stdout, stderr, dst, title, linker, arch_data, parent_arch_d
                 lead_items[i] = ' (%+d)' % delta
                 lead_items[9] = '<br>\n(vs ' + parent_arch_data['name'] + ')'
     lead = ''.join(lead_items)
-    css = paths.link_root() + '/css/log.css'
+    css = assets.link('css/log.css')
 
     def write_log(lines, dst, title2, body, line_msgs):
         with open(dst, 'wt') as fout:
@@ -164,28 +190,40 @@ def _get_msgs(tag, arch):
         return _MASTER_MSGS[arch]
     except KeyError:
         try:
-            with open(join(paths.www_release(config['branch'], tag, arch),
-                    'build-messages.json'), 'rt') as f:
-                _MASTER_MSGS[arch] = json.load(f)
+            _MASTER_MSGS[arch] = msgcatalog.load_messages(join(
+                paths.www_release(config['branch'], tag, arch),
+                'build-messages.json'), shared=True)
         except Exception:
             _MASTER_MSGS[arch] = None
         return _MASTER_MSGS[arch]
 
 # TODO: keep modifications in sync with builder.py:_process_build
-def _process_build1(stdout, dst, title, linker, arch_data, parent_arch_data, arch):
-    log = loglines(stdout)
+def _process_build1(log, dst, title, link, arch_data, parent_arch_data, arch,
+        patch_map=None, picked=False):
     result = log_analysis.analyse(log)
     arch_data['message'] = result['failures']
+    # Other workers add to the catalog too
+    ids = msgcatalog.intern_all(list(result['messages']) + [v[2]
+        for msgs in result['full'].values() for v in msgs])
+    msg_ids = [0] * len(result['messages'])
+    for k, v in result['messages'].items():
+        msg_ids[v] = ids[k]
+    del result['messages']
     msg_refs = {'warnings': [], 'errors': []}
     for k in ('warnings', 'errors'):
         arch_data[k] = sum(len(v) for v in result[k].values())
         for msgs in result[k].values():
             for i, v in enumerate(msgs):
                 lf, ls, msg = v
-                f = 'buildlog.html'
                 msg_refs[k].append(lf)
-                msgs[i] = (0, lf, ls, msg)
-    result['files'] = ['buildlog.html']
+                msgs[i] = (0, lf, ls, msg_ids[msg])
+    for msgs in result['full'].values():
+        for i, v in enumerate(msgs):
+            lf, ls, msg = v
+            msgs[i] = (lf, ls, ids[msg])
+    result['files'] = [logpage.PAGE]
+    if not logpage.writes_page(picked):
+        result['pages'] = rawlog.FRAME_LINES
 
     title = escape(title, quote=True)
     lead_items = ['<h1>', title, '</h1>\n<p>',
@@ -196,8 +234,10 @@ def _process_build1(stdout, dst, title, linker, arch_data, parent_arch_data, arc
     if parent_arch_data:
         old_msgs = _get_msgs(parent_arch_data['name'], arch)
         if old_msgs:
-            _, new_msgs = log_analysis.diff(old_msgs, result['full'])
+            _, new_msgs = log_analysis.diff(old_msgs, result['full'],
+                patch_map.map if patch_map else None)
             if new_msgs:
+                msgcatalog.sync()
                 with open(join(dst, 'new-messages.json'), 'wt') as f:
                     json.dump(new_msgs, f)
         for t, i in (('warnings', 4), ('errors', 7)):
@@ -205,150 +245,229 @@ def _process_build1(stdout, dst, title, linker, arch_data, parent_arch_data, arc
             if delta:
                 lead_items[i] = ' (%+d)' % delta
                 lead_items[9] = '<br>\n(vs ' + parent_arch_data['name'] + ')'
+    if new_msgs is None:
+        # Nothing to compare with, everything is new
+        log_analysis.mark_new(result, result['full'])
+    else:
+        log_analysis.mark_new(result, new_msgs)
     lead = ''.join(lead_items)
-    css = paths.link_root() + '/css/log.css'
-
-    def write_log(lines, dst, body, line_msgs):
-        with open(dst, 'wt') as fout:
-            fout.write('<!DOCTYPE html>\n<html><head>'
-                '<meta charset="utf-8" />\n<title>')
-            fout.write(title)
-            fout.write('</title>\n<link rel="stylesheet" href="')
-            fout.write(css)
-            fout.write('" />\n</head><body>\n')
-            fout.write(lead)
-            def write_msg_item(file, line, logline, msg):
-                if line:
-                    line = str(line)
-                    fout.write(' <li><samp><a href="')
-                    fout.write(linker(file, line))
-                    fout.write('">')
-                    fout.write(escape(file))
-                    fout.write(':' + line + '</a>: ')
-                else:
-                    fout.write(' <li><samp>')
-                    fout.write(escape(file))
-                    fout.write(': ')
-                fout.write('<a href="#n' + str(logline) + '">')
-                fout.write(escape(msg))
-                fout.write('</a></samp></li>\n')
-            if new_msgs:
-                fout.write('<h2>New messages</h2>\n<ul>\n')
-                for file, msgs in sorted(new_msgs.items()):
-                    for msg in msgs:
-                        write_msg_item(file, msg[1], msg[0], msg[2])
-                fout.write('</ul></pre>\n')
-            if result['errors']:
-                fout.write('\n<h2>Errors</h2>\n<ul>\n')
-                for file, msgs in sorted(result['errors'].items()):
-                    for msg in msgs:
-                        write_msg_item(file, msg[2], msg[1], messages[msg[3]])
-                fout.write('</ul></pre>\n')
-            fout.write('\n<h2>Log</h2>')
-            body(lines, fout, file_linker=linker, line_msgs=line_msgs)
-            fout.write('\n</body></html>')
-
-    m = 0
-    for k in ('warnings', 'errors'):
-        try:
-            m = max(max(msg_refs[k]), m)
-        except ValueError:
-            pass
-    line_msgs = [0] * (m + 1)
-    for k, v in (('warnings', 1), ('errors', 2)):
-        for i in msg_refs[k]:
-            line_msgs[i] = v
 
     result['packages'] = list(result['packages'])
 
-    messages = [''] * (max(result['messages'].values()) + 1)
-    for k, v in result['messages'].items():
-        messages[v] = k
-    result['messages'] = messages
-
-    write_log(log, join(dst, 'buildlog.html'), log_analysis.htmlout, line_msgs)
+    logpage.write(dst, log, {'title': title,
+        'top': logpage.top(lead, new_msgs, result['errors'],
+            logpage.linker(link)),
+        'link': link, 'warnings': msg_refs['warnings'],
+        'errors': msg_refs['errors']}, picked)
 
+    msgcatalog.sync()
     with open(join(dst, 'build-messages.json'), 'wt') as f:
         json.dump(result['full'], f)
     del result['full']
 
+    arch_data['tree'] = msgtree.write(dst, result)
     with open(join(dst, 'build-result.json'), 'wt') as f:
         json.dump(result, f)
 
-def process(basedir, result, parent, title, linker):
-    print(basedir)
-    for arch in result:
-        if arch != '*':
-            base = join(basedir, arch)
-            resultfile = join(base, 'build-result.json')
-            if exists(resultfile):
-                extract_bad(resultfile, badbefore)
-                parent_result = None
-                if parent:
-                    try:
-                        parent_result = parent['result'][arch].copy()
-                        parent_result['name'] = parent['name']
-                    except KeyError:
-                        pass
-                stdout = join(base, 'buildlog-stdout.html')
-                if exists(stdout):
-                    newstdout = clear_html_log(stdout)
-                    stderr = join(base, 'buildlog-stderr.html')
-                    newstderr = clear_html_log(stderr)
-                    _process_build2(newstdout, newstderr, TMPDIR,
-                        title + ' [' + arch + ']', linker,
-                        result[arch], parent_result)
-                    move(join(TMPDIR, 'buildlog-stdout.html'), stdout)
-                    move(join(TMPDIR, 'buildlog-stderr.html'), stderr)
-                else:
-                    stdout = join(base, 'buildlog.html')
-                    newstdout = clear_html_log(stdout)
-                    _process_build1(newstdout, TMPDIR,
-                        title + ' [' + arch + ']', linker,
-                        result[arch], parent_result, arch)
-                    move(join(TMPDIR, 'buildlog.html'), stdout)
-                    move(join(TMPDIR, 'build-messages.json'),
-                        join(base, 'build-messages.json'))
-                    new_msgs = join(base, 'new-messages.json')
-                    try:
-                        move(join(TMPDIR, 'new-messages.json'), new_msgs)
-                    except FileNotFoundError:
-                        try:
-                            os.remove(new_msgs)
-                        except FileNotFoundError:
-                            pass
-                move(join(TMPDIR, 'build-result.json'), resultfile)
-                extract_bad(resultfile, badafter)
-            elif not exists(join(basedir, 'conflicts.html')):
-                print('No results', base)
-    db.save()
+def move_or_remove(name, tmp, base):
+    """Move name from tmp to base, or remove it if it was not written."""
+    try:
+        move(join(tmp, name), join(base, name))
+    except FileNotFoundError:
+        try:
+            os.remove(join(base, name))
+        except FileNotFoundError:
+            pass
+
+def redo(job):
+    """Analyse the log of one arch build again. Runs in a worker."""
+    basedir = job['basedir']
+    arch = job['arch']
+    arch_data = job['arch_data']
+    base = join(basedir, arch)
+    resultfile = join(base, 'build-result.json')
+    title = job['title'] + ' [' + arch + ']'
+    tmp = tempfile.mkdtemp(prefix='reextract-', dir=TMPDIR)
+    try:
+        before = extract_bad(resultfile)
+        stdout = join(base, 'buildlog-stdout.html')
+        if exists(stdout):
+            newstdout = clear_html_log(stdout, tmp)
+            stderr = join(base, 'buildlog-stderr.html')
+            newstderr = clear_html_log(stderr, tmp)
+            _process_build2(newstdout, newstderr, tmp, title,
+                logpage.linker(job['link']), arch_data, job['parent'])
+            move(join(tmp, 'buildlog-stdout.html'), stdout)
+            move(join(tmp, 'buildlog-stderr.html'), stderr)
+        else:
+            if rawlog.has_log(base):
+                log = transformed(rawlog.read(base))
+            else:
+                log = loglines(clear_html_log(join(base, logpage.PAGE), tmp))
+                if not logpage.writes_page(job['picked']):
+                    # Already transformed, but the page needs one
+                    rawlog.write(base, log)
+            _process_build1(log, tmp, title, job['link'], arch_data,
+                job['parent'], arch, PatchMap(join(basedir, 'patches')),
+                job['picked'])
+            for f in (logpage.PAGE, logpage.INDEX, 'new-messages.json'):
+                move_or_remove(f, tmp, base)
+            move(join(tmp, 'build-messages.json'),
+                join(base, 'build-messages.json'))
+            rmtree(join(base, msgtree.DIR), ignore_errors=True)
+            move(join(tmp, msgtree.DIR), join(base, msgtree.DIR))
+        move(join(tmp, 'build-result.json'), resultfile)
+        after = extract_bad(resultfile)
+    finally:
+        rmtree(tmp, ignore_errors=True)
+    arch_data['analysis'] = log_analysis.VERSION
+    return job['key'], arch_data, before, after
 
 def parent(build):
     if build['parent']:
         try:
-            return {
-                'result': db.data['release'][build['parent']]['result'],
-                'name': build['parent'],
-            }
+            result = db.data['release'][build['parent']]['result']
         except KeyError:
             pass
-    return None
-
-for tag, build in sorted(db.data['release'].items(), key=lambda x: x[1]['time']):
-    base = paths.www_release(config['branch'], tag, None)
-    process(base, build['result'], parent(build), config['branch'] + ': ' + tag,
-        log_analysis.file_link_release(tag))
-
-for group in ('done', 'change'):
-    for cid, change in db.data[group].items():
-        for build in change['build']:
-            base = paths.www(change, build, None)
-            title = cid + ' v' + str(build['version']) + ' on ' + build['parent']
-            linker = log_analysis.file_link_change(change['id'], build['version'])
-            process(base, build['rebased'], parent(build), title, linker)
-            if build['picked']:
-                base = paths.www(change, build, None, False)
-                process(base, build['picked'], parent(build), title, linker)
+        else:
+            return build['parent'], result
+    return None, None
+
+def jobs_for(basedir, result, parent, title, link, picked=False):
+    """The arch builds in basedir to do, and where their results go."""
+    tag, parent_result = parent
+    for arch in result:
+        if arch == '*':
+            continue
+        base = join(basedir, arch)
+        key = relpath(base, paths.www_root())
+        if key in done or (result[arch].get('analysis', 0)
+                >= log_analysis.VERSION and not args.all):
+            continue
+        if not exists(join(base, 'build-result.json')):
+            if not exists(join(basedir, 'conflicts.html')):
+                print('No results', base)
+            continue
+        parent_arch_data = None
+        if tag:
+            try:
+                parent_arch_data = parent_result[arch].copy()
+                parent_arch_data['name'] = tag
+            except KeyError:
+                pass
+        targets[key] = result[arch]
+        if link[0] == 'release':
+            releases[key] = (link[1], arch)
+        yield {'key': key, 'basedir': basedir, 'arch': arch,
+            'arch_data': dict(result[arch]), 'parent': parent_arch_data,
+            'title': title, 'link': link, 'picked': picked}
+
+def release_jobs():
+    # In order: each one is compared with the previous one, and the arches
+    # of one release can go together
+    for tag, build in sorted(db.data['release'].items(),
+            key=lambda x: x[1]['time']):
+        base = paths.www_release(config['branch'], tag, None)
+        yield list(jobs_for(base, build['result'], parent(build),
+            config['branch'] + ': ' + tag, ('release', tag)))
+
+def change_jobs():
+    # Only compared with releases, all at once
+    jobs = []
+    for group in ('done', 'change'):
+        for cid, change in db.data[group].items():
+            for build in change['build']:
+                title = (cid + ' v' + str(build['version']) + ' on '
+                    + build['parent'])
+                link = ('change', change['id'], build['version'])
+                jobs.extend(jobs_for(paths.www(change, build, None),
+                    build['rebased'], parent(build), title, link))
+                if build['picked']:
+                    jobs.extend(jobs_for(paths.www(change, build, None,
+                        False), build['picked'], parent(build), title, link,
+                        True))
+    yield jobs
+
+def history_result(key):
+    """The result of a build as msghistory takes it."""
+    base = join(paths.www_root(), key)
+    with open(join(base, 'build-result.json'), 'rt') as f:
+        result = json.load(f)
+    with open(join(base, 'build-messages.json'), 'rt') as f:
+        result['full'] = json.load(f)
+    return result
+
+def save_checkpoint():
+    db.save()
+    with open(CHECKPOINT + '.tmp', 'wt') as f:
+        json.dump({'version': log_analysis.VERSION, 'all': args.all,
+            'done': sorted(done), 'bad_before': sorted(badbefore),
+            'bad_after': sorted(badafter)}, f)
+    os.replace(CHECKPOINT + '.tmp', CHECKPOINT)
+
+
+parser = argparse.ArgumentParser(description='Analyse the build logs again')
+parser.add_argument('--all', action='store_true',
+    help='also the builds analysed by this version of log_analysis')
+parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+    help='worker processes (default %(default)s)')
+parser.add_argument('--batch', type=int, default=50,
+    help='builds between saves (default %(default)s)')
+args = parser.parse_args()
+
+done = set()
+badbefore = set()
+badafter = set()
+try:
+    with open(CHECKPOINT, 'rt') as f:
+        checkpoint = json.load(f)
+    if (checkpoint['version'] == log_analysis.VERSION
+            and checkpoint['all'] == args.all):
+        print('Going on from', CHECKPOINT)
+        done.update(checkpoint['done'])
+        badbefore.update(checkpoint['bad_before'])
+        badafter.update(checkpoint['bad_after'])
+except FileNotFoundError:
+    pass
+
+targets = {}    # key: arch_data in db.data
+releases = {}   # key: (tag, arch) of release builds, for msghistory
+history = False
+if args.jobs > 1:
+    pool = multiprocessing.get_context('fork').Pool(args.jobs)
+    run = pool.imap_unordered
+else:
+    pool = None
+    run = map
+pending = 0
+for phase in (release_jobs, change_jobs):
+    for jobs in phase():
+        for key, arch_data, before, after in run(redo, jobs):
+            print(key)
+            targets.pop(key).update(arch_data)
+            if key in releases:
+                tag, arch = releases.pop(key)
+                # Legacy builds have no build-messages.json, nor history
+                if exists(join(paths.www_root(), key, 'build-messages.json')):
+                    history = msghistory.update(tag, arch,
+                        history_result(key)) or history
+            badbefore.update(before)
+            badafter.update(after)
+            done.add(key)
+            pending += 1
+            if pending >= args.batch:
+                save_checkpoint()
+                pending = 0
+if pool is not None:
+    pool.close()
+    pool.join()
+db.save()
+if history:
+    msghistory.export()
+try:
+    os.remove(CHECKPOINT)
+except FileNotFoundError:
+    pass
 
 print(len(badbefore), '->', len(badafter))
 print('REMOVED', badbefore.difference(badafter))
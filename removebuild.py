@@ -3,11 +3,13 @@
 import argparse
 import os
 from os.path import exists
-from shutil import rmtree
 
+import artifacts
 from config import config
 import db
+import imagestore
 import paths
+import trash
 
 
 def pop_master(builds, hrev):
@@ -25,9 +27,7 @@ def remove_changeset(cid, hrev):
     old = pop_master(change['build'], hrev)
     if old is None:
         raise Exception('Unknown build')
-    rmtree(paths.www(change, old, None), ignore_errors=True)
-    if old['picked']:
-        rmtree(paths.www(change, old, None, full=False), ignore_errors=True)
+    paths.delete_build(change, old)
 
 
 def remove_master(hrev):
@@ -39,10 +39,7 @@ def remove_master(hrev):
         for cid, change in db.data[group].items():
             old = pop_master(change['build'], hrev)
             if old is not None:
-                rmtree(paths.www(change, old, None), ignore_errors=True)
-                if old['picked']:
-                    rmtree(paths.www(change, old, None, full=False),
-                        ignore_errors=True)
+                paths.delete_build(change, old)
     paths.delete_release(config['branch'], hrev)
     del db.data['release'][hrev]
                 
@@ -62,4 +59,7 @@ else:
     remove_changeset(args.changeset, args.hrev)
 
 db.save()
-
+trash.wait()
+artifacts.gc()
+imagestore.gc()
+trash.wait()
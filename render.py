@@ -0,0 +1,275 @@
+from html import escape
+import json
+import os
+from os.path import abspath, dirname, join
+import re
+import time
+
+import assets
+from config import config
+import paths
+
+
+__all__ = ('render',)
+
+
+# Static summary pages, from the templates in web/, so that the tables are
+# there before summary.js has loaded anything. It then only enhances the
+# rows in the page. Changesets go to index.html, changes-2.html...,
+# releases to releases.html, releases-2.html... and merged or abandoned
+# changesets to done.html, done-2.html...
+
+PAGE_ROWS = 100
+
+# As in web/js/url.js
+GIT_BASE = 'https://git.haiku-os.org/haiku/'
+GERRIT_BASE = (config['gerrit_url'].rstrip('/') + '/c/' + config['project']
+    + '/+/')
+
+_TEMPLATES = join(dirname(abspath(__file__)), 'web')
+_RE_PAGE = re.compile(r'^(changes|releases|done)-(\d+)\.html$')
+_RE_ASSET = re.compile(r'((?:src|href)=")((?:assets|css|js)/[^"]+)"')
+_APP = '<script>const app = {};</script>'
+
+
+def _time(t):
+    return ('<time datetime="' + time.strftime('%Y-%m-%dT%H:%M:%SZ',
+        time.gmtime(t)) + '">' + time.strftime('%Y-%m-%d %H:%M UTC',
+        time.gmtime(t)) + '</time>')
+
+
+def _duration(s):
+    # As app.util.durationString
+    if s < 60:
+        return '{:.1f}s'.format(s)
+    s = round(s)
+    h = s // 3600
+    m = s // 60 % 60
+    if h:
+        return '{}h {}m'.format(h, m)
+    return '{}m {}s'.format(m, s % 60)
+
+
+def _link(href, text):
+    return '<a href="' + escape(href) + '">' + escape(str(text)) + '</a>'
+
+
+def _cell(content, cls=None):
+    if cls:
+        return '<td class="' + cls + '">' + content + '</td>'
+    return '<td>' + content + '</td>'
+
+
+def _release_path(tag):
+    return 'release/' + config['branch'] + '/' + tag
+
+
+def _git_tree(release, tag):
+    if '+' in tag:
+        return GIT_BASE + 'tree/?id=' + release['commit']
+    return GIT_BASE + 'tree/?id=' + tag
+
+
+def _ages(releases):
+    """As summary.js: 0 for the latest, 1 to 3 as they get older."""
+    ordered = sorted(releases.items(), key=lambda r: r[1]['time'],
+        reverse=True)
+    ages = {}
+    if len(ordered) > 1:
+        last = ordered[1][1]['time']
+        count = 0
+        age = 1
+        for tag, release in ordered:
+            if ((count >= 5 or last - release['time'] > 3 * 24 * 60 * 60)
+                    and age < 3):
+                age += 1
+                count = 1
+                last = release['time']
+            ages[tag] = age
+            count += 1
+    if ordered:
+        ages[ordered[0][0]] = 0
+    return [tag for tag, _ in ordered], ages
+
+
+def _pills(result):
+    if not result['*']['ok']:
+        message = result['*'].get('message')
+        if message:
+            return ('<details><summary>Conflict</summary><aside><pre>'
+                + escape(message) + '</pre></aside></details>')
+        return 'Conflict'
+    pills = []
+    for arch, res in result.items():
+        if arch == '*':
+            continue
+        if res['ok'] is None:
+            state = ('build-wait', ' waiting')
+        elif res['ok']:
+            state = ('build-ok', ' ok')
+        else:
+            state = ('build-fail', ' broken')
+        pills.append('<span class="build ' + state[0] + '">' + escape(arch)
+            + '<span class="visuallyhidden">' + state[1] + '</span></span> ')
+    return ''.join(pills)
+
+
+def _build_state(build):
+    state = _pills(build['rebased'])
+    if build['picked'].get('*') is not None:
+        state += ('<div class="cherry">🍒<span class="visuallyhidden">'
+            'cherrypicking:</span></div>' + _pills(build['picked']))
+    return state
+
+
+def _tags(change):
+    tags = list(change['tags'])
+    pills = []
+    if change['review']:
+        value = ('Rejected', 'Disliked', '', 'Liked', 'Approved')[
+            change['review'] + 2]
+        pills.append('<span class="pill CR-' + value + '">' + value
+            + '</span>')
+    for tag, cls, text in (('Unresolved comments', 'pending-comments',
+            'Pending comments'), ('WIP', 'wip', 'WIP')):
+        if tag in tags:
+            tags.remove(tag)
+            pills.append('<span class="pill ' + cls + '">' + text + '</span>')
+    if tags:
+        pills.append(escape(', '.join(sorted(tags))))
+    return ', '.join(pills)
+
+
+def _release_row(tag, release, age):
+    link = _link(_git_tree(release, tag), tag)
+    if release['result']['*']['ok']:
+        link += ' <small>' + _link(_release_path(tag), '[build]') + '</small>'
+    return ('<tr id="' + escape(tag) + '" class="age' + str(age) + '">'
+        + _cell(link) + _cell(_pills(release['result']))
+        + _cell(escape(release['title'])) + '</tr>\n')
+
+
+def _change_row(cid, change, ages, queue=None):
+    cells = []
+    if queue is not None:
+        position, eta, now = queue
+        expand = str(position) if position else ''
+        if eta:
+            expand += ' <small>in ' + _duration(eta[0] - now) + '</small>'
+        cells.append(_cell(expand))
+    age = 'age1'
+    latest = change['build'][-1] if change['build'] else None
+    if latest and latest['version'] == change['version']:
+        age = 'age0'
+        parent = latest['parent']
+        cells.append(_cell(_time(latest['time'])))
+        cells.append(_cell(_link(_release_path(parent), parent),
+            'age' + str(ages.get(parent, 3))))
+        cells.append(_cell(_build_state(latest)))
+    else:
+        cells.extend(('<td></td>',) * 3)
+    cells.append(_cell(_link(GERRIT_BASE + str(change['id']),
+        change['title']), age))
+    cells.append(_cell(_tags(change)))
+    return '<tr id="' + escape(cid) + '">' + ''.join(cells) + '</tr>\n'
+
+
+def _page_name(kind, n):
+    if n == 1:
+        return {'changes': 'index', 'releases': 'releases', 'done': 'done'}[
+            kind] + '.html'
+    return kind + '-' + str(n) + '.html'
+
+
+def _nav(kind, n, pages):
+    if pages < 2:
+        return ''
+    links = []
+    for i in range(1, pages + 1):
+        if i == n:
+            links.append('<strong>' + str(i) + '</strong>')
+        else:
+            links.append(_link(_page_name(kind, i), i))
+    return 'Pages: ' + ' '.join(links)
+
+
+def _fill(page, id, content):
+    """Put content in the empty element with that id."""
+    pattern = re.compile('(<(\\w+) id="' + id + '"[^>]*>)(</\\2>)')
+    return pattern.sub(lambda m: m.group(1) + content + m.group(3), page, 1)
+
+
+def _write(name, page):
+    path = join(paths.www_root(), name)
+    tmp = path + '.tmp'
+    with open(tmp, 'wt') as f:
+        f.write(page)
+    os.replace(tmp, path)
+
+
+def _template(name):
+    """The template, linking to the hashed copies of the assets."""
+    manifest = assets.manifest()
+    with open(join(_TEMPLATES, name), 'rt') as f:
+        template = f.read()
+    template = _RE_ASSET.sub(lambda m: m.group(1)
+        + manifest.get(m.group(2), m.group(2)) + '"', template)
+    # For the ones the scripts ask for
+    return template.replace(_APP, '<script>const app = {assets: '
+        + json.dumps(manifest, separators=(',', ':')) + '};</script>')
+
+
+def _pages(kind, template, rows, tbody, fixed={}):
+    template = _template(template)
+    for k, v in fixed.items():
+        template = _fill(template, k, v)
+    pages = max(1, (len(rows) + PAGE_ROWS - 1) // PAGE_ROWS)
+    for n in range(1, pages + 1):
+        page = _fill(template, tbody, ''.join(
+            rows[(n - 1) * PAGE_ROWS:n * PAGE_ROWS]))
+        page = _fill(page, kind + 'pages', _nav(kind, n, pages))
+        _write(_page_name(kind, n), page)
+    return pages
+
+
+def render(data):
+    """Write the summary pages for data, as in builds.json."""
+    now = data['time']
+    tags, ages = _ages(data['release'])
+    fixed = {'lastupdate': _time(now)}
+    current = data['current']
+    if current:
+        release = data['release'][current]
+        link = _link(_git_tree(release, current), current)
+        if release['result']['*']['ok']:
+            link += (' <small>' + _link(_release_path(current), '[build]')
+                + '</small>')
+        fixed['lastrevision'] = link
+        fixed['lastsubject'] = escape(release['title'])
+        fixed['laststatus'] = _pills(release['result'])
+
+    queue = {cid: i + 1 for i, cid in enumerate(data['queued'])}
+    eta = data.get('eta') or {}
+    changes = sorted(data['change'].items(),
+        key=lambda c: c[1]['time']['update'], reverse=True)
+    done = sorted(data['done'].items(),
+        key=lambda c: c[1]['time']['update'], reverse=True)
+    pages = {
+        'changes': _pages('changes', 'index.html',
+            [_change_row(cid, change, ages,
+                (queue.get(cid), eta.get(cid), now))
+                for cid, change in changes],
+            'changesets', fixed),
+        'releases': _pages('releases', 'releases.html',
+            [_release_row(tag, data['release'][tag], ages[tag])
+                for tag in tags],
+            'allreleases', fixed),
+        'done': _pages('done', 'done.html',
+            [_change_row(cid, change, ages) for cid, change in done],
+            'donechanges', fixed),
+    }
+
+    for f in os.listdir(paths.www_root()):
+        m = _RE_PAGE.match(f)
+        if m and int(m.group(2)) > pages[m.group(1)]:
+            os.remove(join(paths.www_root(), f))
@@ -0,0 +1,87 @@
+from config import config
+import db
+import paths
+
+
+__all__ = ('arch_bytes', 'build_bytes', 'change_bytes', 'release_bytes',
+    'plan')
+
+
+def arch_bytes(data, path, category=None):
+    """Bytes used by one arch build, as recorded when it was published.
+
+    Builds from before the accounting are measured once and recorded now.
+    """
+    if not data or data.get('ok') is None:
+        return 0
+    try:
+        used = data['size']
+    except KeyError:
+        used = paths.bytes_used(path)
+        data['size'] = used
+    if category is None:
+        return sum(used.values())
+    return used.get(category, 0)
+
+
+def _dir_bytes(data):
+    # Patches, source archives: recorded in the '*' step of the build
+    try:
+        return sum(data['*']['size'].values())
+    except KeyError:
+        return 0
+
+
+def build_bytes(change, build, category=None):
+    """Bytes used by a change build, both rebased and picked."""
+    total = 0
+    for res, full in (('rebased', True), ('picked', False)):
+        if not build[res]:
+            continue
+        for arch, data in build[res].items():
+            if arch != '*':
+                total += arch_bytes(data,
+                    paths.www(change, build, arch, full=full), category)
+        if category is None:
+            total += _dir_bytes(build[res])
+    return total
+
+
+def change_bytes(change):
+    return sum(build_bytes(change, build) for build in change['build'])
+
+
+def release_bytes(tag, category=None):
+    result = db.data['release'][tag]['result']
+    total = 0
+    for arch, data in result.items():
+        if arch != '*':
+            total += arch_bytes(data,
+                paths.www_release(config['branch'], tag, arch), category)
+    if category is None:
+        total += _dir_bytes(result)
+    return total
+
+
+def plan(candidates, needed):
+    """Choose what to remove to free at least needed bytes.
+
+    candidates is a sequence of (bytes, item) in the order they should be
+    used. Takes them in order until there is enough, and then gives back the
+    latest ones that turned out not to be needed.
+    Returns the chosen items and the bytes they free.
+    """
+    chosen = []
+    total = 0
+    for size, item in candidates:
+        if total >= needed:
+            break
+        if size > 0:
+            chosen.append((size, item))
+            total += size
+    for i in range(len(chosen) - 1, -1, -1):
+        size = chosen[i][0]
+        if total - size >= needed:
+            total -= size
+            chosen[i] = None
+    return [c[1] for c in chosen if c is not None], total
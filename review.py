@@ -6,6 +6,7 @@ import re
 from config import config
 import db
 import gerrit
+import msgcatalog
 import paths
 
 
@@ -55,7 +56,7 @@ def _new_messages(change, build, arch):
             data = json.load(f)
         for k, v in data.items():
             for m in v:
-                messages.append((k, m[1], m[2]))
+                messages.append((k, m[1], msgcatalog.text(m[2])))
         messages.sort()
     except:
         pass
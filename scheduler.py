@@ -0,0 +1,253 @@
+from bisect import bisect_left, insort
+import time
+
+import db
+
+
+__all__ = ('Scheduler',)
+
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+KNOB_OLD_VERSION = 10 * SECONDS_PER_DAY
+KNOB_OLD_CHANGESET = 2 * 30 * SECONDS_PER_DAY
+KNOB_OLD_BUILD = 30 * SECONDS_PER_DAY
+KNOB_MINIMUM_DELAY = SECONDS_PER_DAY
+
+
+# Discard already built with same version and master
+# Make changes with rejected label wait at least two days, unless they have
+# not been built before
+# Order:
+#   0 Master broken, no WIP, no unresolved messages, new
+#   1 Master broken, no WIP, new
+#   2 No WIP, no unresolved messages, new version, previous version broken
+#   3 No WIP, no unresolved messages, new
+#   4 No WIP, no unresolved messages, new version
+#   5 No unresolved messages, new version, previous version broken
+#   6 No unresolved messages, new / new version
+#   7 new version, previous version broken
+#   8 new / new version
+#   9 rest
+#       base time: now (or time_limit, not that it matters a lot) - build time
+#       + k(update - build) if updated after build time
+#       half if version created more than 10? days ago
+#       half if changeset created more than 2? months ago
+#       -1 day if WIP
+#       -1 day if unresolved messages
+#       +2 days if broken build?
+#       double if last build older than 1 month?
+# For groups 0-8, order by version time desc (build the newest one first)
+# For group 9, order by age desc (build the oldest build first)
+# Notice it's desc for both, as we are using now - t for group 9
+#
+# Only group 9 depends on the time. The group and order of the rest, and
+# everything group 9 needs but the time, only change when the change, its
+# builds or the current release do, so they are kept from one call to the
+# next and recomputed only for the changes with a different signature.
+
+
+def _both_broken(build):
+    return (db.is_broken(build['rebased'])
+        and ((not build['picked']) or db.is_broken(build['picked'])))
+
+
+def _results(build):
+    return tuple((res, arch, v['ok']) for res in ('rebased', 'picked')
+        for arch, v in build[res].items())
+
+
+def _signature(change, current, release):
+    builds = change['build']
+    latest = change.latest_build()
+    return (change['version'], change['time']['update'],
+        change['time']['version'], change['review'], tuple(change['tags']),
+        change.unresolved_comments(), current, release, len(builds),
+        builds[0]['time'] if builds else None,
+        latest['time'] if latest else None,
+        _results(latest) if latest else None)
+
+
+def _classify(change, current, master_broken):
+    """Group of the change and what sorts it in the group.
+
+    None if it does not need a build. For group 9, what is needed to weigh
+    it at any given time.
+    """
+    latest = change.latest_build()
+
+    if latest is None:
+        # New changeset: 0, 1, 3, 6, 8
+
+        if change.is_wip():
+            if change.unresolved_comments():
+                prio = 8
+            else:
+                prio = 6
+        elif master_broken:
+            if change.unresolved_comments():
+                prio = 1
+            else:
+                prio = 0
+        elif change.unresolved_comments():
+            prio = 8
+        else:
+            prio = 3
+        return prio, (change['review'], change['time']['update'])
+
+    if latest['version'] != change['version']:
+        # New version: 2, 4, 5, 6, 7, 8
+
+        if _both_broken(latest):
+            if change.unresolved_comments():
+                prio = 7
+            elif change.is_wip():
+                prio = 5
+            else:
+                prio = 2
+        elif change.unresolved_comments():
+            prio = 8
+        elif change.is_wip():
+            prio = 6
+        else:
+            prio = 4
+        return prio, (change['review'], change['time']['update'])
+
+    if latest['parent'] != current:
+        # change already built with a different master
+        last_ok, broken, total = change.streak('*')
+        if broken is not None and broken > 2:
+            broken_penalty = total - 2
+        else:
+            broken_penalty = 0
+        penalty = []
+        for arch in latest['rebased']:
+            if arch == '*':
+                continue
+            last_ok, broken, total = change.streak(arch)
+            if broken is not None and broken > 2:
+                penalty.append(total - 2)
+            else:
+                penalty.append(0)
+        return 9, {
+            'built': latest['time'],
+            'update': change['time']['update'],
+            'version': change['time']['version'],
+            'wip': change.is_wip(),
+            'unresolved': bool(change.unresolved_comments()),
+            'broken': bool(_both_broken(latest)),
+            'broken_penalty': broken_penalty,
+            'arch_penalty': min(penalty),
+            'review': change['review']
+        }
+
+    # else no changes
+    return None
+
+
+def _weight(stale, now):
+    """Sort key of a group 9 change, None if it has to wait."""
+    min_delay = KNOB_MINIMUM_DELAY
+
+    # better chance the oldest the last build was
+    # TODO: use time of last build with a correct master build?
+    weight = now - stale['built']
+    # better chance for more activity
+    weight += max(0, stale['update'] - stale['built']) / 3
+    # old version?
+    if now - stale['version'] > KNOB_OLD_VERSION:
+        min_delay *= 2
+        if now - stale['version'] > 3 * KNOB_OLD_VERSION:
+            weight /= 2
+    # wait more if WIP
+    if stale['wip']:
+        weight -= 2 * SECONDS_PER_DAY
+    # wait more if unresolved comments
+    if stale['unresolved']:
+        weight -= SECONDS_PER_DAY
+        min_delay *= 2
+    # try again sooner for broken builds
+    if stale['broken']:
+        weight += 2 * SECONDS_PER_DAY
+    # but not always
+    weight -= stale['broken_penalty'] * SECONDS_PER_DAY
+    min_delay += stale['arch_penalty'] * SECONDS_PER_DAY / 2
+    min_delay -= stale['review'] * SECONDS_PER_DAY
+
+    # don't forget anyone
+    if now - stale['built'] > KNOB_OLD_BUILD:
+        weight = max(0, weight * 2)
+    elif weight <= min_delay:
+        return None
+    return (stale['review'], weight)
+
+
+class Scheduler:
+    """Build queue of the active changes, kept between calls."""
+
+    def __init__(self):
+        self._cache = {}                        # cid: (signature, prio, key)
+        self._groups = [[] for i in range(9)]   # sorted [(-review, -t, cid)]
+        self._stale = {}                        # cid: group 9 data
+
+    def _remove(self, cid):
+        try:
+            signature, prio, key = self._cache.pop(cid)
+        except KeyError:
+            return
+        if prio == 9:
+            del self._stale[cid]
+        elif prio is not None:
+            group = self._groups[prio]
+            item = (-key[0], -key[1], cid)
+            del group[bisect_left(group, item)]
+
+    def _add(self, change, signature, current, master_broken):
+        cid = change.cid
+        prio, key = _classify(change, current, master_broken) or (None, None)
+        self._cache[cid] = (signature, prio, key)
+        if prio == 9:
+            self._stale[cid] = key
+        elif prio is not None:
+            insort(self._groups[prio], (-key[0], -key[1], cid))
+
+    def update(self, changes):
+        """Recompute the changes that are new or have moved."""
+        current = db.data['current']
+        result = db.data['release'][current]['result']
+        master_broken = db.is_broken(result)
+        # Also for the streaks, when the builds on it are counted
+        release = tuple((arch, v['ok']) for arch, v in result.items())
+        seen = set()
+        for change in changes:
+            cid = change.cid
+            seen.add(cid)
+            signature = _signature(change, current, release)
+            try:
+                if self._cache[cid][0] == signature:
+                    continue
+            except KeyError:
+                pass
+            self._remove(cid)
+            self._add(change, signature, current, master_broken)
+        for cid in set(self._cache).difference(seen):
+            self._remove(cid)
+
+    def queue(self, now=None):
+        if now is None:
+            now = time.time()
+        queue = []
+        for group in self._groups:
+            queue.extend(item[2] for item in group)
+        weights = {}
+        for cid, stale in self._stale.items():
+            weight = _weight(stale, now)
+            if weight is not None:
+                weights[cid] = weight
+        queue.extend(sorted(weights.keys(), key=lambda k: weights[k],
+            reverse=True))
+        return queue
+
+    def sorted_changes(self, changes, now=None):
+        self.update(changes)
+        return self.queue(now)
@@ -9,24 +9,28 @@
 
 import os
 from os.path import exists, join
-from shutil import disk_usage, rmtree
 import time
 
+import artifacts
 import builder
 import chain
 from config import config
 import db
 import gerrit
+import imagestore
 import paths
+import predictor
+import render
+import retention
 from review import review
+import scheduler
+import timing
+import trash
 
 
 SECONDS_PER_DAY = 24 * 60 * 60
 
-KNOB_OLD_VERSION = 10 * SECONDS_PER_DAY
-KNOB_OLD_CHANGESET = 2 * 30 * SECONDS_PER_DAY
-KNOB_OLD_BUILD = 30 * SECONDS_PER_DAY
-KNOB_MINIMUM_DELAY = SECONDS_PER_DAY
+KNOB_KEEP_CYCLES = 50
 
 GERRIT_BRANCH = gerrit.Repo(config['gerrit_url']).projects[config['project']].branches['refs/heads/' + config['branch']]
 
@@ -46,164 +50,51 @@ def update_changes():
     chain.update_changes()
 
 
-def sorted_changes():
-    # Discard already built with same version and master
-    # Make changes with rejected label wait at least two days, unless they have
-    # not been built before
-    # Order:
-    #   0 Master broken, no WIP, no unresolved messages, new
-    #   1 Master broken, no WIP, new
-    #   2 No WIP, no unresolved messages, new version, previous version broken
-    #   3 No WIP, no unresolved messages, new
-    #   4 No WIP, no unresolved messages, new version
-    #   5 No unresolved messages, new version, previous version broken
-    #   6 No unresolved messages, new / new version
-    #   7 new version, previous version broken
-    #   8 new / new version
-    #   9 rest
-    #       base time: now (or time_limit, not that it matters a lot) - build time
-    #       + k(update - build) if updated after build time
-    #       half if version created more than 10? days ago
-    #       half if changeset created more than 2? months ago
-    #       -1 day if WIP
-    #       -1 day if unresolved messages
-    #       +2 days if broken build?
-    #       double if last build older than 1 month?
-    # For groups 0-8, order by version time desc (build the newest one first)
-    # For group 9, order by age desc (build the oldest build first)
-    # Notice it's desc for both, as we are using now - t for group 9
-
-    now = time.time()
-    priority = [{} for i in range(10)]
-    for change in db.active_changes():
-        cid = change.cid
-        latest = change.latest_build()
-
-        if latest is None:
-            # New changeset: 0, 1, 3, 6, 8
-
-            if change.is_wip():
-                if change.unresolved_comments():
-                    prio = 8
-                else:
-                    prio = 6
-            elif db.is_broken(db.data['release'][db.data['current']]['result']):
-                if change.unresolved_comments():
-                    prio = 1
-                else:
-                    prio = 0
-            elif change.unresolved_comments():
-                prio = 8
-            else:
-                prio = 3
-            priority[prio][cid] = (change['review'], change['time']['update'])
-
-        elif latest['version'] != change['version']:
-            # New version: 2, 4, 5, 6, 7, 8
-
-            if (db.is_broken(latest['rebased'])
-                    and ((not latest['picked'])
-                        or db.is_broken(latest['picked']))):
-                # Both builds are broken
-                if change.unresolved_comments():
-                    prio = 7
-                elif change.is_wip():
-                    prio = 5
-                else:
-                    prio = 2
-            elif change.unresolved_comments():
-                prio = 8
-            elif change.is_wip():
-                prio = 6
-            else:
-                prio = 4
-            priority[prio][cid] = (change['review'], change['time']['update'])
-
-        elif latest['parent'] != db.data['current']:
-            # change already built with a different master
-
-            min_delay = KNOB_MINIMUM_DELAY
-
-            # better chance the oldest the last build was
-            # TODO: use time of last build with a correct master build?
-            weight = now - latest['time']
-            # better chance for more activity
-            weight += max(0, change['time']['update'] - latest['time']) / 3
-            # old version?
-            if now - change['time']['version'] > KNOB_OLD_VERSION:
-                min_delay *= 2
-                if now - change['time']['version'] > 3 * KNOB_OLD_VERSION:
-                    weight /= 2
-            # wait more if WIP
-            if change.is_wip():
-                weight -= 2 * SECONDS_PER_DAY
-            # wait more if unresolved comments
-            if change.unresolved_comments():
-                weight -= SECONDS_PER_DAY
-                min_delay *= 2
-            # try again sooner for broken builds
-            if (db.is_broken(latest['rebased'])
-                    and ((not latest['picked'])
-                        or db.is_broken(latest['picked']))):
-                weight += 2 * SECONDS_PER_DAY
-            # but not always
-            last_ok, broken = change.broken_for('*')
-            if broken and broken[-1] > 2:
-                weight -= (sum(broken) - 2) * SECONDS_PER_DAY
-            penalty = []
-            for arch in latest['rebased']:
-                if arch == '*':
-                    continue
-                last_ok, broken = change.broken_for(arch)
-                if broken and broken[-1] > 2:
-                    penalty.append(sum(broken) - 2)
-                else:
-                    penalty.append(0)
-            min_delay += min(penalty) * SECONDS_PER_DAY / 2
-            min_delay -= change['review'] * SECONDS_PER_DAY
-
-            # don't forget anyone
-            if now - latest['time'] > KNOB_OLD_BUILD:
-                weight = max(0, weight * 2)
-            elif weight <= min_delay:
-                continue
-            priority[9][cid] = (change['review'], weight)
+SCHEDULER = scheduler.Scheduler()
 
-        # else no changes, continue
 
-    queue = []
-    for pq in priority:
-        queue.extend(sorted(pq.keys(), key=lambda k: pq[k], reverse=True))
-    return queue
+def sorted_changes():
+    return SCHEDULER.sorted_changes(db.active_changes())
 
 
 def remove_done_before(t):
-    builder.remove_done_changes(list(c.cid for c in db.data['done'].values()
-        if c.latest_build() is None or c.latest_build()['time'] < t))
+    done = list(c for c in db.data['done'].values()
+        if c.latest_build() is None or c.latest_build()['time'] < t)
+    sizes = {c.cid: retention.change_bytes(c) for c in done}
+    builder.remove_done_changes(list(sizes), sizes)
+    return sum(sizes.values())
 
 
 def remove_unused_releases():
     ditch, clean = db.unused_releases()
     for tag in ditch:
-        paths.delete_release(config['branch'], tag)
+        paths.delete_release(config['branch'], tag,
+            retention.release_bytes(tag))
         del db.data['release'][tag]
     for tag in clean:
-        for arch in db.data['release'][tag]['result']:
+        for arch, data in db.data['release'][tag]['result'].items():
             if arch != '*':
-                paths.clean_up(paths.www_release(config['branch'], tag, arch))
+                path = paths.www_release(config['branch'], tag, arch)
+                paths.clean_up(path,
+                    retention.arch_bytes(data, path, 'artifacts'))
+                if data and 'size' in data:
+                    data['size']['artifacts'] = 0
 
 
 def clean_up_build(change, build):
     for res, full in (('rebased', True), ('picked', False)):
-        for arch in build[res]:
-            if arch != '*' and build[res][arch]:
-                paths.clean_up(paths.www(change, build, arch, full=full))
+        for arch, data in build[res].items():
+            if arch != '*' and data:
+                path = paths.www(change, build, arch, full=full)
+                paths.clean_up(path,
+                    retention.arch_bytes(data, path, 'artifacts'))
+                if 'size' in data:
+                    data['size']['artifacts'] = 0
     build['logs_only'] = True
 
 
-def remove_old_harder():
-    remove_done_before(time.time()
-        - config['keep_done_pressure'] * SECONDS_PER_DAY)
+def trim_builds():
+    freed = 0
     for k, lim in (('done', 1), ('change', 3)):
         for change in db.data[k].values():
             try:
@@ -216,66 +107,167 @@ def remove_old_harder():
                 if old['parent'] == keep:
                     change['build'].insert(0, old)
                 else:
-                    rmtree(paths.www(change, old, None), ignore_errors=True)
-                    if old['picked']:
-                        rmtree(paths.www(change, old, None, full=False),
-                            ignore_errors=True)
+                    size = retention.build_bytes(change, old)
+                    paths.delete_build(change, old, size)
+                    freed += size
+    return freed
+
+
+def clean_up_old_builds():
+    freed = 0
+    for k in ('done', 'change'):
+        for change in db.data[k].values():
             for old in change['build'][:-1]:
-                clean_up_build(change, old)
+                if not old['logs_only']:
+                    freed += retention.build_bytes(change, old, 'artifacts')
+                    clean_up_build(change, old)
+    return freed
+
+
+def collect_garbage():
+    """Remove the pooled files and chunks no build uses any more.
+
+    The links to pooled files in the trash do not count, without waiting for
+    it to be emptied.
+    """
+    artifacts.gc(trash.held())
+    imagestore.gc()
+
+
+def remove_old_harder(needed):
+    """Free needed bytes, the least valuable first.
+
+    Each step only runs if the previous ones did not free enough, as counted
+    from the sizes recorded in the db. Returns what is still needed.
+    """
+    for step in (lambda: remove_done_before(time.time()
+                - config['keep_done_pressure'] * SECONDS_PER_DAY),
+            trim_builds, clean_up_old_builds):
+        if needed <= 0:
+            break
+        needed -= step()
     remove_unused_releases()
+    collect_garbage()
     db.save()
+    return needed
+
 
+def remove_old_starved(needed):
+    """Clean up the latest builds, done changes first.
 
-def remove_old_starved():
+    Only as many as needed to free the given bytes, oldest first.
+    """
+    candidates = []
     for change in db.data['done'].values():
-        if change['build']:
-            clean_up_build(change, change['build'][-1])
-    if disk_usage(paths.www_root()).free > config['low_disk']:
-        return True
-    else:
-        for change in sorted((change for change in db.active_changes()
-                    if change.latest_build()),
-                key=lambda change: change.latest_build()['time']):
-            clean_up_build(change, change.latest_build())
-            if disk_usage(paths.www_root()).free > config['low_disk']:
-                return True
-    return False
+        if change['build'] and not change['build'][-1]['logs_only']:
+            build = change['build'][-1]
+            candidates.append((retention.build_bytes(change, build,
+                'artifacts'), (change, build)))
+    for change in sorted((change for change in db.active_changes()
+                if change.latest_build()),
+            key=lambda change: change.latest_build()['time']):
+        build = change.latest_build()
+        if not build['logs_only']:
+            candidates.append((retention.build_bytes(change, build,
+                'artifacts'), (change, build)))
+    chosen, freed = retention.plan(candidates, needed)
+    for change, build in chosen:
+        clean_up_build(change, build)
+    collect_garbage()
+    db.save()
+    return trash.free(paths.www_root()) > config['low_disk']
+
+
+def admit(to_build, time_limit, first=False):
+    """Choose the first change in the queue that can be built in time.
+
+    The first build of a run is not held to it: the estimates only change
+    with builds, and one over the whole budget would never run otherwise.
+    Also estimates when each one would start, for the web.
+    """
+    now = time.time()
+    eta = {}
+    start = now
+    chosen = None
+    for cid in to_build:
+        t = predictor.change_estimate(db.change(cid))
+        eta[cid] = [int(start), int(t)]
+        start += t
+        if chosen is None and (first or now + t <= time_limit):
+            chosen = cid
+    db.data['eta'] = eta
+    return chosen
+
+
+def build_until(time_limit):
+    cycle = {'start': int(time.time()), 'builds': 0, 'timing': {}}
+    with timing.record(cycle['timing']):
+        with timing.span('total'):
+            build_loop(time_limit, cycle)
+    cycle['end'] = int(time.time())
+    cycles = db.data.setdefault('cycles', [])
+    cycles.append(cycle)
+    del cycles[:-KNOB_KEEP_CYCLES]
+
+
+def build_loop(time_limit, cycle):
+    while True:
+        if exists('stop.please'):
+            print('DDD stop requested')
+            return
+        free = trash.free(paths.www_root())
+        if free < config['low_disk']:
+            print('DDD low disk space')
+            with timing.span('disk'):
+                remove_old_harder(config['low_disk'] - free)
+                free = trash.free(paths.www_root())
+                if free < config['low_disk']:
+                    if not remove_old_starved(config['low_disk'] - free):
+                        return
+        if time.time() > time_limit:
+            return
+        arches = builder.pending_release()
+        if arches:
+            if (cycle['builds'] and predictor.release_estimate(arches)
+                    > time_limit - time.time()):
+                print('DDD no time left for the release')
+                return
+            builder.build_release()
+            # new build, took our time, check if there are updates again
+            cycle['builds'] += 1
+            continue
+        with timing.span('gerrit'):
+            update_changes()
+        with timing.span('schedule'):
+            to_build = sorted_changes()
+        db.data['queued'] = to_build
+        cid = admit(to_build, time_limit, not cycle['builds'])
+        if cid:
+            change = db.change(cid)
+            builder.build_change(change)
+            cycle['builds'] += 1
+            to_build.remove(cid)
+            db.data['queued'] = to_build
+            with timing.span('review'):
+                try:
+                    review(change, GERRIT_BRANCH.get_change(cid))
+                except KeyError:
+                    pass
+        else:
+            if to_build:
+                print('DDD no time left for', to_build[0])
+            return
 
 
 builder.mrproper()
+trash.resume()
 time_limit = time.time() + config['time_limit']
-while True:
-    if exists('stop.please'):
-        print('DDD stop requested')
-        break
-    if disk_usage(paths.www_root()).free < config['low_disk']:
-        print('DDD low disk space')
-        remove_old_harder()
-        if disk_usage(paths.www_root()).free < config['low_disk']:
-            if not remove_old_starved():
-                break
-    if time.time() > time_limit:
-        break
-    if builder.update_release():
-        # new build, took our time, check if there are updates again
-        continue
-    update_changes()
-    to_build = sorted_changes()
-    db.data['queued'] = to_build
-    if to_build:
-        cid = to_build[0]
-        change = db.change(cid)
-        builder.build_change(change)
-        db.data['queued'] = to_build[1:]
-        try:
-            review(change, GERRIT_BRANCH.get_change(cid))
-        except KeyError:
-            pass
-    else:
-        break
+build_until(time_limit)
 
 remove_done_before(time_limit - config['keep_done'] * SECONDS_PER_DAY)
 remove_unused_releases()
 
 db.save()
-
+render.render(db.data)
+collect_garbage()
+trash.wait()
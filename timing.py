@@ -0,0 +1,35 @@
+from contextlib import contextmanager
+import time
+
+
+__all__ = ('record', 'span')
+
+
+_records = []
+
+
+@contextmanager
+def record(times):
+    """Add the duration of the spans run inside to the dict times.
+
+    Records can be nested: a span counts for all the active ones.
+    """
+    _records.append(times)
+    try:
+        yield times
+    finally:
+        for i in range(len(_records) - 1, -1, -1):
+            if _records[i] is times:
+                del _records[i]
+                break
+
+
+@contextmanager
+def span(name):
+    t = time.monotonic()
+    try:
+        yield
+    finally:
+        t = time.monotonic() - t
+        for times in _records:
+            times[name] = round(times.get(name, 0) + t, 2)
@@ -0,0 +1,141 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import os
+from os.path import join
+from shutil import disk_usage, rmtree, which
+import subprocess
+import tempfile
+import threading
+
+from config import config
+
+
+__all__ = ('discard', 'free', 'held', 'resume', 'wait')
+
+
+# Removing a build tree full of packages takes minutes. It is moved to a trash
+# directory in the same filesystem instead, which is instantaneous, and
+# removed from there in the background at idle I/O priority.
+_ROOTS = (config['www_root'], config['build'])
+_TRASH = '.trash'
+
+_IONICE = which('ionice')
+
+_lock = threading.Lock()
+_pending = {}   # st_dev: bytes waiting to be removed
+_executor = None
+
+
+def _trash_dir(path):
+    dev = os.lstat(path).st_dev
+    for root in _ROOTS:
+        try:
+            if os.stat(root).st_dev == dev:
+                d = join(root, _TRASH)
+                os.makedirs(d, exist_ok=True)
+                return d, dev
+        except FileNotFoundError:
+            pass
+    return None, dev
+
+
+def _remove(path):
+    if _IONICE:
+        subprocess.run([_IONICE, '-c', '3', 'rm', '-rf', '--', path],
+            stdin=subprocess.DEVNULL)
+    else:
+        rmtree(path, ignore_errors=True)
+
+
+def _done(dev, size, future):
+    with _lock:
+        _pending[dev] -= size
+
+
+def _submit(entry, dev, size):
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config['trash_jobs'],
+                thread_name_prefix='trash')
+        _pending[dev] = _pending.get(dev, 0) + size
+        future = _executor.submit(_remove, entry)
+    future.add_done_callback(lambda f: _done(dev, size, f))
+
+
+def discard(*names, size=0):
+    """Remove files or directories in the background.
+
+    They are gone from their place when this returns. size is what they use
+    on disk, to be counted by free() until they are really removed.
+    """
+    names = [n for n in names if os.path.lexists(n)]
+    if not names:
+        return
+    trash, dev = _trash_dir(names[0])
+    if trash is None:
+        for n in names:
+            _remove(n)
+        return
+    entry = tempfile.mkdtemp(dir=trash)
+    for i, n in enumerate(names):
+        try:
+            os.rename(n, join(entry, str(i)))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # A mount point in the way
+            _remove(n)
+    _submit(entry, dev, size)
+
+
+def free(path):
+    """Free space in the device of path, counting pending removals."""
+    dev = os.stat(path).st_dev
+    with _lock:
+        pending = _pending.get(dev, 0)
+    return disk_usage(path).free + pending
+
+
+def held():
+    """Links in the trash to files also linked elsewhere.
+
+    A Counter by (st_dev, st_ino), for the files with more than one link.
+    """
+    links = Counter()
+    for root in set(_ROOTS):
+        for dirpath, dirnames, filenames in os.walk(join(root, _TRASH)):
+            for name in filenames:
+                try:
+                    st = os.lstat(join(dirpath, name))
+                except FileNotFoundError:
+                    # Removed meanwhile
+                    continue
+                if st.st_nlink > 1:
+                    links[(st.st_dev, st.st_ino)] += 1
+    return links
+
+
+def resume():
+    """Remove what an interrupted run left in the trash."""
+    for root in _ROOTS:
+        d = join(root, _TRASH)
+        try:
+            entries = os.listdir(d)
+        except FileNotFoundError:
+            continue
+        dev = os.stat(d).st_dev
+        for entry in entries:
+            _submit(join(d, entry), dev, 0)
+
+
+def wait():
+    """Wait until everything discarded is removed."""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
@@ -9,6 +9,10 @@
         getElement(id).appendChild(el);
     }
 
+    function setContent(id, el) {
+        getElement(id).replaceChildren(el);
+    }
+
     function compose(tag, element) {
         const parent = document.createElement(tag);
         parent.appendChild(element);
@@ -55,6 +59,7 @@
     app.dom = {
         getElement: getElement,
         appendTo: appendTo,
+        setContent: setContent,
         compose: compose,
         text: text,
         link: link,
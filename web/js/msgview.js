@@ -41,12 +41,12 @@
             this._current = text('samp', '');
             this._msgType = {};
             this._msgList = document.createElement('ul');
-            this._msgs = [];
+            this._dirs = {};
             this._msgTable = document.createElement('tbody');
 
             const style = document.createElement('link');
             style.setAttribute('rel', 'stylesheet');
-            style.setAttribute('href', 'css/msgview.css');
+            style.setAttribute('href', app.util.asset('css/msgview.css'));
             const shadow = this.attachShadow({mode: 'open'});
             shadow.appendChild(style);
             const content = document.createDocumentFragment();
@@ -89,7 +89,7 @@
             this._msgList.addEventListener('click', (ev) => {
                 const item = ev.target.closest('li');
                 if (item) {
-                    const msgData = this._msgType[item.textContent];
+                    const msgData = this._msgType[item.dataset.msg];
                     msgData.active = !msgData.active;
                     item.dataset.active = msgData.active;
                     this.update();
@@ -100,103 +100,148 @@
             shadow.appendChild(content);
         }
 
-        update() {
-            for (const msg of Object.values(this._msgType)) {
-                msg.count = 0;
+        _columns() {
+            // Of the counts in the tree: warnings, errors, new ones
+            const columns = this._onlyNew.checked ? [3] : [1];
+            if (!this._onlyError.checked) {
+                columns.push(columns[0] - 1);
             }
-            const prefix = this._current.textContent;
-            const prefixLength = prefix.length;
+            return columns;
+        }
+
+        _count(counts, columns, all=false) {
+            let n = 0;
+            for (const [msg, c] of Object.entries(counts)) {
+                if (all || this._msgType[msg].active) {
+                    for (const i of columns) {
+                        n += c[i];
+                    }
+                }
+            }
+            return n;
+        }
+
+        _collapse(path, columns) {
+            // Down while there is only one thing with messages in it, as
+            // the row for the directory
+            for (;;) {
+                const node = this._dirs[path];
+                const dirs = node.dirs.filter(name =>
+                    this._count(this._dirs[path + name + '/'].counts, columns));
+                const files = Object.keys(node.files).filter(name =>
+                    this._count(node.files[name], columns));
+                if (dirs.length + files.length != 1) {
+                    return {path: path, n: this._count(node.counts, columns)};
+                }
+                if (files.length) {
+                    return {path: path + files[0], dir: path, name: files[0],
+                        n: this._count(node.files[files[0]], columns)};
+                }
+                path += dirs[0] + '/';
+            }
+        }
+
+        _leaf(dir) {
+            let leaf = this._leaves.get(dir);
+            if (leaf === undefined) {
+                leaf = this._loadLeaf(this._dirs[dir]);
+                this._leaves.set(dir, leaf);
+            }
+            return leaf;
+        }
+
+        _logLink(imsg) {
+            // Rendered by blocks of _pageLines, the one with the line
+            let page = '';
+            if (this._pageLines) {
+                page = '?n=' + (Math.floor((imsg.logline - 1) / this._pageLines)
+                    * this._pageLines + 1);
+            }
+            return this._baseLocal + imsg.log + page + '#n' + imsg.logline;
+        }
+
+        _fileList(cell, dir, name) {
             const onlyError = this._onlyError.checked;
             const onlyNew = this._onlyNew.checked;
-            const msgs = [];
-            let current = { path: [], msgs: []};
-            let dir = false;
-            for (const msg of this._msgs) {
-                if (onlyError && !msg.error) continue;
-                if (onlyNew && !msg.new) continue;
-                if (!msg.file.startsWith(prefix)) continue;
-                const msgData = this._msgType[msg.msg];
-                msgData.count++;
-                if (msgData.active) {
-                    const path = msg.file.substring(prefixLength).split('/');
-                    let step = 0;
-                    while (step < current.path.length
-                            && current.path[step] === path[step]) {
-                        step++;
-                    }
-                    if (step) {
-                        current.msgs.push(msg);
-                        if (step < current.path.length) {
-                            current.path.length = step;
-                            dir = true;
-                        }
-                    } else {
-                        if (current.msgs.length) {
-                            msgs.push(current);
-                            if (dir) {
-                                current.path.push('');
-                            }
-                        }
-                        dir = false;
-                        current = { path: path, msgs: [msg]};
+            this._leaf(dir).then(leaf => {
+                const list = document.createElement('ul');
+                for (const imsg of leaf[name]) {
+                    if (onlyError && !imsg.error) continue;
+                    if (onlyNew && !imsg.new) continue;
+                    if (!this._msgType[imsg.msg].active) continue;
+                    const li = document.createElement('li');
+                    li.classList.add(imsg.error ? 'error' : 'warning');
+                    if (imsg.line) {
+                        li.appendChild(textLink(
+                            this._baseExternal(dir + name, imsg.line),
+                            'line ' + imsg.line));
+                        li.appendChild(text(': '));
                     }
+                    li.appendChild(textLink(this._logLink(imsg),
+                        this._messages[imsg.msg]));
+                    list.appendChild(li);
                 }
+                cell.appendChild(list);
+            });
+        }
+
+        update() {
+            const prefix = this._current.textContent;
+            const columns = this._columns();
+            const node = this._dirs[prefix] ?? {dirs: [], counts: {},
+                files: {}};
+
+            for (const msg of Object.values(this._msgType)) {
+                msg.element.dataset.count = 0;
             }
-            if (current.msgs.length) {
-                msgs.push(current);
-                if (dir) {
-                    current.path.push('');
+            for (const [msg, c] of Object.entries(node.counts)) {
+                this._msgType[msg].element.dataset.count = this._count(
+                    {[msg]: c}, columns, true);
+            }
+
+            const rows = [];
+            for (const name of node.dirs) {
+                const path = prefix + name + '/';
+                if (this._count(this._dirs[path].counts, columns)) {
+                    rows.push(this._collapse(path, columns));
+                }
+            }
+            for (const [name, counts] of Object.entries(node.files)) {
+                const n = this._count(counts, columns);
+                if (n) {
+                    rows.push({path: prefix + name, dir: prefix, name: name,
+                        n: n});
                 }
             }
+            rows.sort((a, b) => (a.path < b.path) ? -1
+                : (a.path > b.path) ? 1 : 0);
 
             /* TODO: only when we are moving up
              * We can find it also when selecting msg types
-            if (prefix && msgs.length <= 1) {
+            if (prefix && rows.length <= 1) {
                 this.navigate('..');
                 return;
             }
             */
 
-            for (const msg of Object.values(this._msgType)) {
-                msg.element.dataset.count = msg.count;
-            }
-
             const fragment = document.createDocumentFragment();
-            for (const msg of msgs) {
-                const path = msg.path.join('/');
+            for (const item of rows) {
+                const path = item.path.substring(prefix.length);
                 const row = document.createElement('tr');
-                if (path.endsWith('/')) {
+                if (item.name === undefined) {
                     row.appendChild(text('td', path));
                 } else {
                     row.classList.add('no-navigate');
                     const cell = compose('details', text('summary', path));
+                    cell.addEventListener('toggle', () =>
+                        this._fileList(cell, item.dir, item.name),
+                        {once: true});
                     row.appendChild(compose('td', cell));
-                    const list = document.createElement('ul');
-                    for (const imsg of msg.msgs) {
-                        const li = document.createElement('li');
-                        li.classList.add(imsg.error ? 'error' : 'warning');
-                        if (imsg.line) {
-                            li.appendChild(textLink(
-                                this._baseExternal(imsg.file, imsg.line),
-                                'line ' + imsg.line));
-                            li.appendChild(text(': '));
-                        }
-                        li.appendChild(textLink(this._baseLocal
-                            + imsg.log + '#n' + imsg.logline,
-                            imsg.msg));
-                        list.appendChild(li);
-                    }
-                    cell.appendChild(list);
                 }
-                row.appendChild(text('td', msg.msgs.length));
+                row.appendChild(text('td', item.n));
                 fragment.appendChild(row);
             }
-            let last = this._msgTable.lastChild;
-            while (last) {
-                this._msgTable.removeChild(last);
-                last = this._msgTable.lastChild;
-            }
-            this._msgTable.appendChild(fragment);
+            this._msgTable.replaceChildren(fragment);
         }
 
         navigate(where) {
@@ -215,53 +260,70 @@
             this.update();
         }
 
-        setMessages(own, parent, baseLocal, baseExternal) {
+        setTree(tree, messages, loadLeaf, baseLocal, baseExternal) {
+            // tree as in messages/tree.json (see msgtree.py), messages the
+            // texts of its ids, loadLeaf(dir) the promise of its leaf
             this._baseLocal = baseLocal;
             this._baseExternal = baseExternal;
+            this._pageLines = tree.pages;
+            this._dirs = tree.dirs;
+            this._messages = messages;
+            this._loadLeaf = loadLeaf;
+            this._leaves = new Map();
             this._msgType = {};
-            for (const msg of own.messages) {
-                const element = text('li', msg);
+            for (const msg of Object.keys(tree.dirs['']?.counts ?? {})) {
+                const element = text('li', messages[msg]);
+                element.dataset.msg = msg;
                 element.dataset.active = true;
                 element.dataset.count = 0;
                 this._msgType[msg] = {
                     element: element,
-                    count: 0,
                     active: true
                 }
             }
             const fragment = document.createDocumentFragment();
-            for (const [msg, data] of Object.entries(this._msgType).sort()) {
+            for (const data of Object.values(this._msgType).sort((a, b) =>
+                    a.element.textContent.localeCompare(
+                        b.element.textContent))) {
                 fragment.appendChild(data.element);
             }
-            let last = this._msgList.lastChild;
-            while (last) {
-                this._msgList.removeChild(last);
-                last = this._msgList.lastChild;
-            }
-            this._msgList.appendChild(fragment);
+            this._msgList.replaceChildren(fragment);
+            this.update();
+        }
 
-            this._msgs = [];
+        setMessages(own, parent, baseLocal, baseExternal) {
+            // A whole build-result.json, and the parent one if the new
+            // messages are not marked in it: made into a tree here
+            const msgs = [];
             for (const group of ['warnings', 'errors']) {
                 const error = group == 'errors';
-                for (const [file, msgs] of Object.entries(own[group])) {
+                for (const [file, fileMsgs] of Object.entries(own[group])) {
                     const current = {};
-                    for (const msgData of msgs) {
+                    for (const msgData of fileMsgs) {
                         const msg = {
                             file: file,
                             line: msgData[2],
                             log: own.files[msgData[0]],
                             logline: msgData[1],
-                            msg: own.messages[msgData[3]],
+                            msg: msgData[3],
                             error: error,
-                            new: false
+                            new: msgData[4] === 1
                         };
-                        this._msgs.push(msg);
-                        if (current[msg.msg] === undefined) {
-                            current[msg.msg] = [msg];
+                        msgs.push(msg);
+                        if (own.marked_new) {
+                            // Already compared with the parent when built
+                            continue;
+                        }
+                        const k = own.messages[msg.msg];
+                        if (current[k] === undefined) {
+                            current[k] = [msg];
                         } else {
-                            current[msg.msg].push(msg);
+                            current[k].push(msg);
                         }
                     }
+                    if (own.marked_new) {
+                        continue;
+                    }
                     const old = {};
                     for (const msgData of parent[group][file]??[]) {
                         const msg = {
@@ -287,11 +349,62 @@
                     }
                 }
             }
-            this._msgs.sort((a, b) => (a.file < b.file) ? -1
-                : (a.file > b.file) ? 1 : a.line - b.line
-            );
-            this.update();
+            const [dirs, leaves] = messageTree(msgs);
+            this.setTree({dirs: dirs}, own.messages,
+                node => Promise.resolve(leaves.get(node)),
+                baseLocal, baseExternal);
+        }
+    }
+
+    function splitPath(path) {
+        // 'a/b/c' or 'a/b/c/' to ['a/b/', 'c'], as msgtree.py
+        const i = path.replace(/\/+$/, '').lastIndexOf('/') + 1;
+        return [path.substring(0, i), path.substring(i).replace(/\/+$/, '')];
+    }
+
+    function messageTree(msgs) {
+        // What msgtree.py writes, from a list of messages
+        const dirs = {};
+        const leaves = new Map();
+        const node = path => dirs[path] ??= {dirs: [], counts: {}, files: {}};
+        const add = (counts, msg, c) => {
+            const total = counts[msg] ??= [0, 0, 0, 0];
+            for (let i = 0; i < 4; i++) {
+                total[i] += c[i];
+            }
+        };
+        for (const msg of msgs) {
+            const [dir, name] = splitPath(msg.file);
+            const c = [0, 0, 0, 0];
+            c[msg.error ? 1 : 0] = 1;
+            if (msg.new) {
+                c[msg.error ? 3 : 2] = 1;
+            }
+            const files = node(dir).files;
+            add(files[name] ??= {}, msg.msg, c);
+            let path = dir;
+            for (;;) {
+                add(node(path).counts, msg.msg, c);
+                if (!path) {
+                    break;
+                }
+                const [up, sub] = splitPath(path);
+                if (!node(up).dirs.includes(sub)) {
+                    dirs[up].dirs.push(sub);
+                }
+                path = up;
+            }
+            if (!leaves.has(dirs[dir])) {
+                leaves.set(dirs[dir], {});
+            }
+            (leaves.get(dirs[dir])[name] ??= []).push(msg);
+        }
+        for (const leaf of leaves.values()) {
+            for (const fileMsgs of Object.values(leaf)) {
+                fileMsgs.sort((a, b) => a.line - b.line);
+            }
         }
+        return [dirs, leaves];
     }
     customElements.define('msg-view', MsgView);
 
@@ -2,6 +2,8 @@
     'use strict';
 
     let builds = null;
+    // Seconds between looks at summary/feed.jsonl
+    const FEED_POLL = 60;
     const compose = app.dom.compose;
     const text = app.dom.text;
     const textLink = app.dom.textLink;
@@ -11,6 +13,37 @@
     const changePath = url.local.change;
     const buildPath = url.local.build;
 
+    function shardPath(kind, name) {
+        return 'summary/' + kind + '/' + encodeURIComponent(name) + '.json';
+    }
+
+    function loadRelease(release) {
+        // The index only has the message counts of the release results
+        release.loaded ??= app.util.fetchJSON(shardPath('release', release.tag))
+        .then(full => {
+            for (const [arch, result] of Object.entries(full.result)) {
+                Object.assign(release.result[arch] ??= {}, result);
+            }
+            release.compact = false;
+            return release;
+        });
+        return release.loaded;
+    }
+
+    function loadChange(change) {
+        // The index only has the latest build of each change
+        change.loaded ??= app.util.fetchJSON(shardPath('change', change.tag))
+        .then(full => {
+            for (const build of full.build) {
+                build.change = change;
+                build.parent = builds.release[build.parent];
+            }
+            change.build = full.build.reverse();
+            return change;
+        });
+        return change.loaded;
+    }
+
     function externalFilePath(build, file, line=0) {
         if (build.change == build) {
             return url.gitTree(build, file, line);
@@ -84,11 +117,56 @@
         } else {
             build = builds.release[change[0]];
         }
-        Promise.all([app.util.fetchJSON(path + '/build-result.json'),
-            build.parent && build.parent.result[arch] !== undefined
-            ? app.util.fetchJSON(releasePath(build.parent.tag)
+        if (!button.dataset.tree) {
+            loadResults(button, build, path, arch);
+            return;
+        }
+        // Written with the build, see msgtree.py
+        const treeFile = path + '/' + button.dataset.tree;
+        const treePath = treeFile.substring(0, treeFile.lastIndexOf('/') + 1);
+        app.util.fetchJSON(treeFile)
+        .then(tree => tree.messages ? [tree, tree.messages]
+            // Trees written before they had the texts
+            : app.util.messageCatalog().then(catalog => [tree, catalog]))
+        .then(([tree, messages]) => {
+            const view = document.createElement('msg-view');
+            view.setTree(tree, messages, node => app.util.fetchJSON(
+                    treePath + node.leaf)
+                .then(leaf => {
+                    for (const [name, msgs] of Object.entries(leaf)) {
+                        leaf[name] = msgs.map(m => ({log: tree.files[m[0]],
+                            logline: m[1], line: m[2], msg: m[3],
+                            error: m[4] === 1, new: m[5] === 1}));
+                    }
+                    return leaf;
+                }),
+                path + '/', (f, n) => externalFilePath(build, f, n));
+            button.parentNode.replaceChild(view, button);
+        })
+        ;
+    }
+
+    function loadResults(button, build, path, arch) {
+        // Older builds only have the whole build-result.json
+        return Promise.all([app.util.fetchJSON(path + '/build-result.json'),
+            app.util.messageCatalog()])
+        .then(values => {
+            const [own, catalog] = values;
+            // Old results have their own message list
+            own.messages ??= catalog;
+            // and need the parent one to find the new messages
+            if (own.marked_new || !build.parent
+                    || build.parent.result[arch] === undefined) {
+                return [own, {warnings: {}, errors: {}, messages: [],
+                    files: []}];
+            }
+            return app.util.fetchJSON(releasePath(build.parent.tag)
                 + '/' + arch + '/build-result.json')
-            : {warnings: {}, errors: {}, messages: [], files: []}])
+            .then(parent => {
+                parent.messages ??= catalog;
+                return [own, parent];
+            });
+        })
         .then(values => {
             const view = document.createElement('msg-view');
             view.setMessages(values[0], values[1], path + '/',
@@ -98,7 +176,7 @@
         ;
     }
 
-    function loadErrorsButton(build, path, arch) {
+    function loadErrorsButton(build, path, arch, tree) {
         const change = [build.change.tag];
         if (build != build.change) {
             change.push(build.change.build.indexOf(build));
@@ -107,6 +185,9 @@
         button.setAttribute('type', 'button');
         button.dataset.path = path;
         button.dataset.arch = arch;
+        if (tree) {
+            button.dataset.tree = tree;
+        }
         button.dataset.change = change.join(' ');
         button.addEventListener('click', loadErrors);
         return button;
@@ -185,8 +266,18 @@
         return fragment;
     }
 
+    function timingText(timing) {
+        // Longest phases first
+        return Object.entries(timing).sort((a, b) => b[1] - a[1])
+            .map(([k, v]) => k + ' ' + app.util.durationString(v))
+            .join(', ');
+    }
+
     function brokenBuildDetails(build, archData, arch, rebased=true) {
         const fragment = buildDetailsHead(build, arch, rebased);
+        if (archData.timing) {
+            fragment.appendChild(text('small', timingText(archData.timing)));
+        }
         fragment.appendChild(compose('pre', text('samp', archData.message)));
         let path;
         if (build === build.change) {
@@ -194,7 +285,8 @@
         } else {
             path = buildPath(build, rebased);
         }
-        fragment.appendChild(loadErrorsButton(build, path, arch));
+        fragment.appendChild(loadErrorsButton(build, path, arch,
+            archData.tree));
         return fragment;
     }
 
@@ -210,12 +302,12 @@
         case false:
             extra = ' broken';
             result = 'build-fail';
-            detail = brokenBuildDetails(build, archData, arch, rebased);
+            detail = brokenBuildDetails;
             break;
         default:
             extra = ' ok';
             result = 'build-ok';
-            detail = successfulBuildDetails(build, archData, arch, rebased);
+            detail = successfulBuildDetails;
             break;
         }
         let el;
@@ -231,9 +323,21 @@
             sum.appendChild(app.dom.hiddenText(extra));
             el = document.createElement('details');
             el.appendChild(sum);
-            detail = compose('aside', detail);
-            detail.classList.add('vbox');
-            el.appendChild(detail);
+            const fill = () => {
+                const aside = compose('aside',
+                    detail(build, archData, arch, rebased));
+                aside.classList.add('vbox');
+                el.appendChild(aside);
+            };
+            if (build.compact) {
+                el.addEventListener('toggle', () => loadRelease(build)
+                    .then(() => {
+                        archData = build.result[arch];
+                        fill();
+                    }), {once: true});
+            } else {
+                fill();
+            }
         }
         return el;
     }
@@ -285,32 +389,58 @@
         return rebased;
     }
 
+    function fillTable(id, keys, row) {
+        const tbody = app.dom.getElement(id);
+        if (tbody.rows.length) {
+            // Rendered by render.py: only enhance the rows in this page
+            const known = new Set(keys);
+            for (const tr of Array.from(tbody.rows)) {
+                if (known.has(tr.id)) {
+                    tbody.replaceChild(row(tr.id), tr);
+                }
+            }
+            return;
+        }
+        const fragment = document.createDocumentFragment();
+        for (const k of keys) {
+            fragment.appendChild(row(k));
+        }
+        tbody.appendChild(fragment);
+    }
+
     function lastRelease() {
-        // TODO: appendTo -> replace?
-        app.dom.appendTo('lastupdate', text(app.util.timeString(builds.time)));
         const release = builds.sortedReleases[0];
-        app.dom.appendTo('lastrevision', releaseLinkFragment(release));
-        app.dom.appendTo('lastsubject', text(release.title));
-        app.dom.appendTo('laststatus', releaseStateFragment(release));
+        app.dom.setContent('lastrevision', releaseLinkFragment(release));
+        app.dom.setContent('lastsubject', text(release.title));
+        app.dom.setContent('laststatus', releaseStateFragment(release));
+    }
+
+    function releaseRow(tag) {
+        const release = builds.release[tag];
+        const tr = document.createElement('tr');
+        tr.setAttribute('id', release.tag);
+        tr.appendChild(compose('td', releaseLinkFragment(release)));
+        tr.appendChild(compose('td', releaseStateFragment(release)));
+        tr.appendChild(compose('td', text(release.title)));
+        tr.classList.add('age' + release.age);
+        return tr;
     }
 
     function releaseTable() {
-        const fragment = document.createDocumentFragment();
-        for (const release of builds.sortedReleases) {
-            const tr = document.createElement('tr');
-            tr.setAttribute('id', release.tag);
-            tr.appendChild(compose('td', releaseLinkFragment(release)));
-            tr.appendChild(compose('td', releaseStateFragment(release)));
-            tr.appendChild(compose('td', text(release.title)));
-            tr.classList.add('age' + release.age);
-            fragment.appendChild(tr);
-        }
-        app.dom.getElement('allreleases').appendChild(fragment);
+        fillTable('allreleases', builds.sortedReleases.map(r => r.tag),
+            releaseRow);
+    }
+
+    function changesetBuildsDetails(change) {
+        const details = document.createElement('details');
+        details.appendChild(text('summary', ''));
+        details.addEventListener('toggle', () => loadChange(change)
+            .then(() => details.appendChild(changesetBuildsTable(change))),
+            {once: true});
+        return details;
     }
 
     function changesetBuildsTable(change) {
-        const fragment = document.createElement('details');
-        fragment.appendChild(text('summary', ''));
         const open = document.createElement('aside');
         open.appendChild(text('Created: '
             + app.util.timeString(change.time.create)));
@@ -352,111 +482,325 @@
             }
         }
         open.appendChild(table);
-        fragment.appendChild(open);
-        return fragment;
+        return open;
+    }
+
+    function changesetRow(k) {
+        const tr = document.createElement('tr');
+        tr.setAttribute('id', k);
+        const change = builds.change[k];
+        const expandCell = text('td', change.queue ?? '');
+        if (change.eta) {
+            expandCell.setAttribute('title', 'Estimated start: '
+                + app.util.timeString(change.eta[0]) + ', takes '
+                + app.util.durationString(change.eta[1]));
+            expandCell.appendChild(text('small', ' in '
+                + app.util.durationString(change.eta[0] - builds.time)));
+        }
+        tr.appendChild(expandCell);
+        let age = 'age1';
+        let current = false;
+        if (change.build.length > 0) {
+            const lastbuild = change.build[0];
+            if (lastbuild.version == change.version) {
+                age = 'age0';
+                current = true;
+                tr.appendChild(text('td',
+                    app.util.timeString(lastbuild.time)));
+                const parent = lastbuild.parent;
+                const parentCell = compose('td',
+                    textLink(releasePath(parent.tag), parent.tag));
+                    //textLink('#'+parent.tag, parent.tag));
+                parentCell.classList.add('age'+parent.age);
+                tr.appendChild(parentCell);
+                tr.appendChild(compose('td',
+                    changesetStateFragment(k, lastbuild)));
+            }
+            if (change.builds > 1 || !current) {
+                expandCell.appendChild(changesetBuildsDetails(change));
+            }
+        }
+        if (!current) {
+            tr.appendChild(text('td', ''));
+            tr.appendChild(text('td', ''));
+            tr.appendChild(text('td', ''));
+        }
+        const changeCell = compose('td',
+            textLink(url.gerrit(change), change.title));
+        changeCell.classList.add(age);
+        tr.appendChild(changeCell);
+        tr.appendChild(compose('td', tagsRun(change)));
+        return tr;
     }
 
     function changesetTable() {
+        fillTable('changesets', sortedChanges(), changesetRow);
+    }
+
+    function cycleTable() {
+        const cycles = builds.cycles.slice().reverse();
+        const totals = {};
+        for (const cycle of cycles) {
+            for (const [k, v] of Object.entries(cycle.timing)) {
+                if (k != 'total') {
+                    totals[k] = (totals[k] ?? 0) + v;
+                }
+            }
+        }
+        const phases = Object.keys(totals).sort((a, b) => totals[b] - totals[a]);
+        const head = document.createElement('tr');
+        for (const title of ['Start', 'Builds', 'Total', 'per build']
+                .concat(phases)) {
+            head.appendChild(text('th', title));
+        }
+        app.dom.setContent('cycleshead', head);
         const fragment = document.createDocumentFragment();
-        for (const k of Object.keys(builds.change).sort(
-                (a,b) => builds.change[b].time.update
-                    - builds.change[a].time.update)) {
+        const duration = app.util.durationString;
+        for (const cycle of cycles) {
             const tr = document.createElement('tr');
-            tr.setAttribute('id', k);
-            const change = builds.change[k];
-            const expandCell = text('td', change.queue ?? '');
-            tr.appendChild(expandCell);
-            let age = 'age1';
-            let current = false;
-            if (change.build.length > 0) {
-                const lastbuild = change.build[0];
-                if (lastbuild.version == change.version) {
-                    age = 'age0';
-                    current = true;
-                    tr.appendChild(text('td',
-                        app.util.timeString(lastbuild.time)));
-                    const parent = lastbuild.parent;
-                    const parentCell = compose('td',
-                        textLink(releasePath(parent.tag), parent.tag));
-                        //textLink('#'+parent.tag, parent.tag));
-                    parentCell.classList.add('age'+parent.age);
-                    tr.appendChild(parentCell);
-                    tr.appendChild(compose('td',
-                        changesetStateFragment(k, lastbuild)));
+            const total = cycle.timing.total ?? cycle.end - cycle.start;
+            tr.appendChild(text('td', app.util.timeString(cycle.start)));
+            tr.appendChild(text('td', cycle.builds));
+            tr.appendChild(text('td', duration(total)));
+            tr.appendChild(text('td', cycle.builds
+                ? duration(total / cycle.builds) : ''));
+            for (const k of phases) {
+                const v = cycle.timing[k];
+                tr.appendChild(text('td', v === undefined ? '' : duration(v)));
+            }
+            fragment.appendChild(tr);
+        }
+        app.dom.setContent('cycles', fragment);
+    }
+
+    function prepareRelease(b, tag, rel) {
+        rel.tag = tag;
+        rel.change = rel;
+        rel.compact = true;
+        rel.parent = b.release[rel.parent];
+    }
+
+    function sortReleases(b) {
+        b.sortedReleases = Object.values(b.release).sort((x, y) =>
+            y.time - x.time);
+        if (b.sortedReleases.length > 1) {
+            let last = b.sortedReleases[1].time;
+            let count = 0;
+            let age = 1;
+            for (const rel of b.sortedReleases) {
+                if ((count >= 5 || last - rel.time > 3 * 24 * 60 * 60)
+                        && age < 3) {
+                    age++;
+                    count = 1;
+                    last = rel.time;
                 }
-                if (change.build.length > 1 || !current) {
-                    expandCell.appendChild(changesetBuildsTable(change));
+                rel.age = age;
+                count++;
+            }
+        }
+        b.sortedReleases[0].age = 0;
+    }
+
+    function prepareChange(b, cid, change) {
+        change.tag = cid;
+        let found = change.tags.indexOf('Unresolved comments');
+        change.pendingComments = found != -1;
+        delete change.tags[found];
+        found = change.tags.indexOf('WIP');
+        change.wip = found != -1;
+        delete change.tags[found];
+        change.tags = change.tags.filter(v=>true).sort();
+        for (const build of change.build) {
+            build.change = change;
+            build.parent = b.release[build.parent];
+        }
+        change.build.reverse()
+    }
+
+    function setQueue(b) {
+        // Returns the changes whose place in the queue changed
+        const moved = [];
+        const queue = {};
+        let i = 1;
+        for (const cid of b.queued) {
+            queue[cid] = i;
+            i++;
+        }
+        for (const [cid, change] of Object.entries(b.change)) {
+            const eta = b.eta?.[cid];
+            if (change.queue !== queue[cid]
+                    || String(change.eta) !== String(eta)) {
+                change.queue = queue[cid];
+                change.eta = eta;
+                moved.push(cid);
+            }
+        }
+        return moved;
+    }
+
+    function sortedChanges() {
+        return Object.keys(builds.change).sort(
+            (a,b) => builds.change[b].time.update
+                - builds.change[a].time.update);
+    }
+
+    function refreshRows(id, keys, removed, order, row) {
+        // Rows from a feed record. Only the first page gets new rows, and
+        // its rows are moved to where they go now.
+        const tbody = app.dom.getElement(id);
+        const rows = new Map(Array.from(tbody.rows, tr => [tr.id, tr]));
+        for (const k of removed) {
+            rows.get(k)?.remove();
+            rows.delete(k);
+        }
+        const firstPage = !/-\d+\.html$/.test(location.pathname);
+        const position = new Map(order.map((k, i) => [k, i]));
+        for (const k of keys) {
+            const old = rows.get(k);
+            if (!firstPage) {
+                if (old) {
+                    tbody.replaceChild(row(k), old);
                 }
+                continue;
             }
-            if (!current) {
-                tr.appendChild(text('td', ''));
-                tr.appendChild(text('td', ''));
-                tr.appendChild(text('td', ''));
+            old?.remove();
+            rows.delete(k);
+            let next = null;
+            for (let i = position.get(k) + 1; i < order.length; i++) {
+                next = rows.get(order[i]);
+                if (next) {
+                    break;
+                }
             }
-            const changeCell = compose('td',
-                textLink(url.gerrit(change), change.title));
-            changeCell.classList.add(age);
-            tr.appendChild(changeCell);
-            tr.appendChild(compose('td', tagsRun(change)));
-            fragment.appendChild(tr);
+            const tr = row(k);
+            tbody.insertBefore(tr, next ?? null);
+            rows.set(k, tr);
+        }
+    }
+
+    function patch(record) {
+        const releases = new Set();
+        const changes = new Set();
+        const removed = record.removed ?? {};
+        let reordered = false;
+        for (const [tag, row] of Object.entries(record.release ?? {})) {
+            const rel = builds.release[tag];
+            if (rel) {
+                // Builds point to it
+                delete rel.loaded;
+                Object.assign(rel, row);
+            } else {
+                builds.release[tag] = row;
+                reordered = true;
+            }
+            releases.add(tag);
+        }
+        for (const tag of Object.keys(record.release ?? {})) {
+            prepareRelease(builds, tag, builds.release[tag]);
+        }
+        for (const tag of removed.release ?? []) {
+            delete builds.release[tag];
+            reordered = true;
+        }
+        if (reordered) {
+            sortReleases(builds);
+            for (const rel of builds.sortedReleases) {
+                releases.add(rel.tag);
+            }
+        }
+        for (const [cid, change] of Object.entries(record.change ?? {})) {
+            prepareChange(builds, cid, change);
+            builds.change[cid] = change;
+            changes.add(cid);
+        }
+        for (const cid of removed.change ?? []) {
+            delete builds.change[cid];
+            changes.delete(cid);
+        }
+        for (const k of ['current', 'queued', 'eta', 'cycles']) {
+            if (k in record) {
+                builds[k] = record[k];
+            }
+        }
+        for (const cid of setQueue(builds)) {
+            changes.add(cid);
+        }
+        builds.time = record.time;
+        builds.seq = record.seq;
+
+        const has = id => app.dom.getElement(id) !== null;
+        app.dom.setContent('lastupdate',
+            text(app.util.timeString(builds.time)));
+        if (has('laststatus') && (reordered || releases.size)) {
+            lastRelease();
+        }
+        if (has('allreleases')) {
+            refreshRows('allreleases', releases, removed.release ?? [],
+                builds.sortedReleases.map(r => r.tag), releaseRow);
+        }
+        if (has('changesets')) {
+            refreshRows('changesets', changes, removed.change ?? [],
+                sortedChanges(), changesetRow);
+        }
+        if ('cycles' in record && has('cycles')) {
+            cycleTable();
+        }
+    }
+
+    function fetchFeed(name) {
+        return fetch('summary/' + name + '?since=' + builds.seq,
+                {cache: 'no-cache'})
+            .then(r => r.ok ? r.text() : '')
+            .then(t => t.split('\n').filter(s => s).map(s => JSON.parse(s)));
+    }
+
+    async function poll() {
+        let records = await fetchFeed('feed.jsonl');
+        if (records.length && records[0].seq > builds.seq + 1) {
+            records = (await fetchFeed('feed-old.jsonl')).concat(records);
+        }
+        const last = records[records.length - 1]?.seq ?? builds.seq;
+        records = records.filter(r => r.seq > builds.seq);
+        if (last < builds.seq
+                || (records.length && records[0].seq != builds.seq + 1)) {
+            // Too far behind, or the feed started again
+            location.reload();
+            return;
+        }
+        for (const record of records) {
+            patch(record);
         }
-        app.dom.getElement('changesets').appendChild(fragment);
     }
 
     function update() {
-        app.util.fetchJSON('builds.json')
+        app.util.fetchJSON('summary/index.json')
         .then(b => {
-            let i = 1;
-            for (const cid of b.queued) {
-                b.change[cid].queue = i;
-                i++;
-            }
-            delete b.queued;
             for (const [tag, rel] of Object.entries(b.release)) {
-                rel.tag = tag;
-                rel.change = rel;
-                rel.parent = b.release[rel.parent];
+                prepareRelease(b, tag, rel);
             }
-            b.sortedReleases = Object.values(b.release).sort((x, y) =>
-                y.time - x.time);
-            if (b.sortedReleases.length > 1) {
-                let last = b.sortedReleases[1].time;
-                let count = 0;
-                let age = 1;
-                for (const rel of b.sortedReleases) {
-                    if ((count >= 5 || last - rel.time > 3 * 24 * 60 * 60)
-                            && age < 3) {
-                        age++;
-                        count = 1;
-                        last = rel.time;
-                    }
-                    rel.age = age;
-                    count++;
-                }
-            }
-            b.sortedReleases[0].age = 0;
-            for (const group of [b.change, b.done]) {
-                for (const [cid, change] of Object.entries(group)) {
-                    change.tag = cid;
-                    let found = change.tags.indexOf('Unresolved comments');
-                    change.pendingComments = found != -1;
-                    delete change.tags[found];
-                    found = change.tags.indexOf('WIP');
-                    change.wip = found != -1;
-                    delete change.tags[found];
-                    change.tags = change.tags.filter(v=>true).sort();
-                    for (const build of change.build) {
-                        build.change = change;
-                        build.parent = b.release[build.parent];
-                    }
-                    change.build.reverse()
-                }
+            sortReleases(b);
+            for (const [cid, change] of Object.entries(b.change)) {
+                prepareChange(b, cid, change);
             }
+            setQueue(b);
             builds = b;
             ///////////////
-            lastRelease();
-            releaseTable();
-            changesetTable();
+            const has = id => app.dom.getElement(id) !== null;
+            app.dom.setContent('lastupdate',
+                text(app.util.timeString(builds.time)));
+            if (has('laststatus')) {
+                lastRelease();
+            }
+            if (has('allreleases')) {
+                releaseTable();
+            }
+            if (has('changesets')) {
+                changesetTable();
+            }
+            if (builds.cycles && has('cycles')) {
+                cycleTable();
+            }
+            setInterval(() => poll().catch(console.error), FEED_POLL * 1000);
         })
         ;
     }
@@ -464,40 +808,43 @@
     app.update = update;
 }());
 
-/********* builds
+/********* builds (summary/index.json, see publish.py)
 change{cid}:
     id (number, oldstyle)
     tag (cid)
     title
     version
-    ref
     time{}:
        create
        version
        update
     queue  (n if queued, optional)
+    eta  ([estimated start, seconds] if queued, optional)
     tags[]
     wip
     pendingComments (currently a boolean)
     review (-2...2)
-    sent_review (build result)
-    build[] (in descending build time order):
+    builds (how many)
+    loaded (promise of the change with all the builds, once asked for)
+    build[] (in descending build time order, only the latest one until
+            loaded from summary/change/<cid>.json):
         parent (release object)
         change (change object)
         version
         time
         logs_only
+        timing{} (seconds per phase)
         rebased/picked{*(prepare)/x86_64/x86_gcc2h}:
             ok: result
+            timing{} (seconds per phase, for arches)
             warnings: n
             errors: n
             message: optional error message
 
-done{cid}
-    ...change{cid}
-
 time (last file update)
+seq (last feed record applied, see summary/feed.jsonl)
 current (last hrev)
+queued[cid], eta{cid} (as in builds.json, also in the changes)
 release{hrev}
     tag
     commit (sha1)
@@ -506,7 +853,14 @@ release{hrev}
     change  (itself, to make it like a change build item)
     time (build)
     age (0 for last one, 1..3 for the rest)
-    result{}: result per arch
+    result{}: result per arch, only ok, warnings and errors until loaded
+    compact (until loaded from summary/release/<tag>.json)
+    loaded (promise of the release, once asked for)
+
+cycles[] (last runs)
+    start, end
+    builds
+    timing{} (seconds per phase, and total)
 
 sortedReleases[releaseObject]  (in descending build time order)
 *********/
@@ -9,8 +9,40 @@
         return new Date(t*1000).toLocaleString();
     }
 
+    function durationString(s) {
+        if (s < 60) {
+            return s.toFixed(1) + 's';
+        }
+        s = Math.round(s);
+        const h = Math.floor(s / 3600);
+        const m = Math.floor(s / 60) % 60;
+        if (h) {
+            return h + 'h ' + m + 'm';
+        }
+        return m + 'm ' + (s % 60) + 's';
+    }
+
+    function asset(name) {
+        // The hashed copy, if the page was rendered by render.py
+        return app.assets?.[name] ?? name;
+    }
+
+    let catalog = null;
+
+    function messageCatalog() {
+        // Shared by all the builds, one JSON string per line
+        if (catalog === null) {
+            catalog = fetch('messages.jsonl').then(r => r.text())
+                .then(t => t.split('\n').filter(s => s).map(s => JSON.parse(s)));
+        }
+        return catalog;
+    }
+
     app.util = {
         fetchJSON: fetchJSON,
-        timeString: timeString
+        timeString: timeString,
+        durationString: durationString,
+        asset: asset,
+        messageCatalog: messageCatalog
     }
 }());